@@ -1,4 +1,8 @@
-from ._version import get_versions
+def __getattr__(name):
+    # resolving the version may run git, so it is only done when __version__ is first asked for
+    if name == "__version__":
+        from ._version import get_versions
 
-__version__ = get_versions()["version"]
-del get_versions
+        version = globals()["__version__"] = get_versions()["version"]
+        return version
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
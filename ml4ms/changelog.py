@@ -0,0 +1,265 @@
+import io
+import json
+import os
+import shutil
+import struct
+import threading
+
+import numpy as np
+
+from ml4ms.core import Dataset
+
+FORMAT_VERSION = 1
+STATE_FILE = "state.json"
+MAGIC = b"ML4MSLOG"
+# the length of a record, before its body
+_LENGTH = struct.Struct("<Q")
+
+
+def _segment_name(number):
+    return f"log-{number:06d}.bin"
+
+
+def encode_record(dataset, rows, names=None):
+    """
+    the bytes of a log record holding attributes names, every attribute when None, of the
+    materials at rows
+
+    a record is a json header, naming the attributes, followed by .npy arrays: the material_ids,
+    then for every attribute a mask of which of the materials have it and their values (categories
+    rather than codes for a categorical attribute).
+    """
+    rows = np.asarray(rows)
+    names = list(dataset.schema) if names is None else list(names)
+    body = io.BytesIO()
+    header = json.dumps({"columns": names}).encode()
+    body.write(_LENGTH.pack(len(header)) + header)
+    arrays = [dataset.material_ids_of(rows)]
+    for name in names:
+        values, present = dataset.column(name, rows)
+        values = values[present]
+        categories = dataset.categories(name)
+        if categories is not None:
+            decoded = np.empty(len(values), dtype=object)
+            decoded[:] = [categories[code] for code in values.tolist()]
+            values = decoded
+        arrays.extend([present, values])
+    for array in arrays:
+        np.lib.format.write_array(body, np.asanyarray(array), allow_pickle=True)
+    body = body.getvalue()
+    return _LENGTH.pack(len(body)) + body
+
+
+def replay_records(dataset, path):
+    """
+    merge every record of the log segment at path into dataset, in order
+
+    a record cut short at the end of the file (by a crash while appending it) is ignored.
+
+    Returns
+    -------
+        the number of records merged
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an ml4ms change log")
+        data = f.read()
+    position, n_records = 0, 0
+    while position + _LENGTH.size <= len(data):
+        (length,) = _LENGTH.unpack_from(data, position)
+        if position + _LENGTH.size + length > len(data):
+            break
+        body = io.BytesIO(data[position + _LENGTH.size : position + _LENGTH.size + length])
+        (header_length,) = _LENGTH.unpack(body.read(_LENGTH.size))
+        names = json.loads(body.read(header_length))["columns"]
+        material_ids = np.lib.format.read_array(body, allow_pickle=True)
+        # insert the new materials in their original order before setting any attribute
+        dataset.merge_arrays(material_ids, {}, policy="upsert")
+        for name in names:
+            present = np.lib.format.read_array(body, allow_pickle=True)
+            values = np.lib.format.read_array(body, allow_pickle=True)
+            if len(values):
+                dataset.merge_arrays(material_ids[present], {name: values}, policy="strict")
+        position += _LENGTH.size + length
+        n_records += 1
+    return n_records
+
+
+class ChangeLog:
+    """
+    a Dataset saved as a snapshot plus an append-only log of the merges since the snapshot
+
+    every merge into the followed Dataset appends one binary record, holding the values of the
+    attributes it set on the materials it touched, to the current log segment, so saving costs in
+    proportion to the batch rather than to the Dataset. opening replays the log on top of the
+    memory mapped snapshot.
+    compact folds the log into a new snapshot, optionally in a background thread: the current
+    segment is closed and later merges go to a new one, while the snapshot is rebuilt from the old
+    snapshot and the closed segments without touching the followed Dataset.
+
+    only merges are logged. attributes set or deleted directly through Dataset.dataset are not
+    saved until the next compact, which must also follow replacing Dataset.dataset as a whole.
+
+    Parameters
+    ----------
+    path: str
+        the directory holding the snapshot and the log, created if it does not exist
+    sync: bool
+        whether to flush every record to disk (os.fsync) before the merge returns
+
+    Examples
+    --------
+    >>> log = ChangeLog("materials.log")
+    >>> dataset = log.open()
+    >>> dataset.merge_new_data(new_data, policy="upsert")  # appended to the log
+    >>> log.compact(background=True)
+    """
+
+    def __init__(self, path, sync=False):
+        self.path = path
+        self.sync = sync
+        self.dataset = None
+        self._file = None
+        self._lock = threading.Lock()
+        self._compacting = None
+        os.makedirs(path, exist_ok=True)
+        state_path = os.path.join(path, STATE_FILE)
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                self._state = json.load(f)
+            if self._state.get("format") != FORMAT_VERSION:
+                raise ValueError(f"{path} is not an ml4ms change log of format {FORMAT_VERSION}")
+        else:
+            self._state = {"format": FORMAT_VERSION, "base": None, "generation": 0, "first_segment": 0}
+            self._write_state(self._state)
+
+    def _write_state(self, state):
+        temporary = os.path.join(self.path, STATE_FILE + ".tmp")
+        with open(temporary, "w") as f:
+            json.dump(state, f)
+        os.replace(temporary, os.path.join(self.path, STATE_FILE))
+
+    def _segments(self, last=None):
+        """the numbers of the segments not folded into the snapshot, up to last"""
+        numbers = sorted(
+            int(name[4:10]) for name in os.listdir(self.path) if name.startswith("log-") and name.endswith(".bin")
+        )
+        return [n for n in numbers if n >= self._state["first_segment"] and (last is None or n <= last)]
+
+    def _load(self, last=None):
+        """the snapshot, opened copy-on-write, with the segments up to last replayed on top of it"""
+        if self._state["base"] is None:
+            dataset = Dataset()
+        else:
+            dataset = Dataset.open(os.path.join(self.path, self._state["base"]), mode="c")
+        for number in self._segments(last):
+            replay_records(dataset, os.path.join(self.path, _segment_name(number)))
+        return dataset
+
+    def _start_segment(self):
+        segments = self._segments()
+        number = max(segments[-1] + 1 if segments else 0, self._state["first_segment"])
+        self._number = number
+        self._file = open(os.path.join(self.path, _segment_name(number)), "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+            self._file.flush()
+
+    def open(self):
+        """
+        the saved Dataset, following its merges from now on
+
+        the snapshot is opened copy-on-write, so its columns are read from disk as they are used.
+
+        Returns
+        -------
+            the Dataset, empty when nothing was saved yet
+        """
+        # a running compaction replaces the snapshot and removes segments, so it is waited for first
+        self.close()
+        return self._follow(self._load())
+
+    def follow(self, dataset):
+        """
+        make dataset the saved Dataset, writing it as the new snapshot, and log its merges from now on
+
+        Returns
+        -------
+            dataset
+        """
+        self.close()
+        self._save_snapshot(dataset, self._segments())
+        return self._follow(dataset)
+
+    def _follow(self, dataset):
+        self.dataset = dataset
+        self._start_segment()
+        dataset.add_merge_listener(self._append, attributes=True)
+        return dataset
+
+    def _append(self, dataset, rows, names):
+        record = encode_record(dataset, rows, names)
+        with self._lock:
+            self._file.write(record)
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        """stop logging the merges into the followed Dataset, waiting for a running compaction"""
+        self.wait()
+        if self.dataset is not None:
+            self.dataset.remove_merge_listener(self._append)
+            self.dataset = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def compact(self, background=False):
+        """
+        fold the log into a new snapshot
+
+        Parameters
+        ----------
+        background: bool
+            whether to build the snapshot in a background thread, merges carrying on meanwhile
+
+        Returns
+        -------
+            nothing
+        """
+        self.wait()
+        with self._lock:
+            last = self._number if self._file is not None else None
+            if self._file is not None:
+                self._file.close()
+                self._start_segment()
+        if background:
+            self._compacting = threading.Thread(target=self._compact, args=(last,), daemon=True)
+            self._compacting.start()
+        else:
+            self._compact(last)
+
+    def _compact(self, last):
+        self._save_snapshot(self._load(last), self._segments(last))
+
+    def _save_snapshot(self, dataset, folded):
+        """write dataset as the new snapshot, replacing the old one and the folded segments"""
+        old_state = self._state
+        generation = old_state["generation"] + 1
+        name = f"base-{generation:06d}"
+        dataset.save(os.path.join(self.path, name))
+        first_segment = folded[-1] + 1 if folded else old_state["first_segment"]
+        state = dict(old_state, base=name, generation=generation, first_segment=first_segment)
+        self._write_state(state)
+        self._state = state
+        if old_state["base"] is not None:
+            shutil.rmtree(os.path.join(self.path, old_state["base"]), ignore_errors=True)
+        for number in folded:
+            os.remove(os.path.join(self.path, _segment_name(number)))
+
+    def wait(self):
+        """wait for a background compaction to finish"""
+        if self._compacting is not None:
+            self._compacting.join()
+            self._compacting = None
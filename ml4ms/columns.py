@@ -0,0 +1,740 @@
+from collections.abc import MutableMapping
+from functools import reduce
+
+import numpy as np
+
+from ml4ms.ids import ROW_DTYPE, IdTable
+from ml4ms.schema import (
+    CATEGORY,
+    CATEGORY_LIMIT,
+    KINDS,
+    OBJECT,
+    accepts,
+    array_kind,
+    code_dtype,
+    common_kind,
+    infer_kind,
+)
+
+# a column is stored sparse while fewer than this fraction of the rows have a value, once the
+# store has SPARSE_MIN_ROWS rows
+SPARSE_DENSITY = 0.25
+SPARSE_MIN_ROWS = 1024
+# values set one at a time on rows new to a sparse column are buffered until there are this many
+SPARSE_PENDING = 4096
+
+
+def as_column_array(values):
+    """
+    values as a one dimensional array
+
+    anything that does not make a one dimensional array of scalars (e.g. a list of spectra) becomes
+    an object array holding one entry per row.
+    """
+    try:
+        array = np.asarray(values)
+    except ValueError:
+        # a ragged sequence, e.g. spectra of different lengths
+        array = None
+    if array is None or array.ndim != 1:
+        array = np.empty(len(values), dtype=object)
+        array[:] = [value for value in values]
+    return array
+
+
+def _equal(a, b):
+    try:
+        return bool(a == b)
+    except (TypeError, ValueError):
+        # e.g. arrays, which do not compare to a single truth value
+        return False
+
+
+def _empty(kind, capacity):
+    if kind == CATEGORY:
+        return np.zeros(capacity, dtype=code_dtype(0))
+    values = np.zeros(capacity, dtype=kind)
+    if kind == OBJECT:
+        values.fill(None)
+    return values
+
+
+class Column:
+    """
+    a growable array of attribute values of one kind with a mask of which rows have a value
+
+    the kinds are those of ml4ms.schema. a categorical column stores, for every row, an integer
+    code into its list of categories.
+
+    Parameters
+    ----------
+    kind: str
+        the kind of the stored values, one of ml4ms.schema.KINDS
+    capacity: int
+        the number of rows to allocate up front
+    """
+
+    def __init__(self, kind, capacity=0):
+        self.values = _empty(kind, capacity)
+        self.present = np.zeros(capacity, dtype=bool)
+        self.categories = [] if kind == CATEGORY else None
+        self._codes = None
+
+    @classmethod
+    def from_arrays(cls, values, present, categories=None):
+        """a Column wrapping existing values and present arrays (e.g. memory maps) without copying"""
+        column = cls.__new__(cls)
+        column.values = values
+        column.present = present
+        column.categories = categories
+        column._codes = None
+        return column
+
+    sparse = False
+
+    @property
+    def kind(self):
+        return CATEGORY if self.categories is not None else self.values.dtype.name
+
+    def has(self, row):
+        """whether row has a value"""
+        return bool(self.present[row])
+
+    def count(self, n_rows):
+        """the number of the first n_rows rows that have a value"""
+        return int(np.count_nonzero(self.present[:n_rows]))
+
+    def rows(self, n_rows):
+        """the sorted rows, of the first n_rows, that have a value"""
+        return np.flatnonzero(self.present[:n_rows]).astype(ROW_DTYPE)
+
+    def dense(self, n_rows):
+        """(values, present) of the first n_rows rows, views of the stored arrays"""
+        return self.values[:n_rows], self.present[:n_rows]
+
+    def take(self, rows):
+        """(values, present) of rows"""
+        return self.values[rows], self.present[rows]
+
+    @property
+    def codes(self):
+        """{category: code} of a categorical column"""
+        if self._codes is None:
+            self._codes = {category: code for code, category in enumerate(self.categories)}
+        return self._codes
+
+    def resize(self, capacity):
+        """grow (or shrink) the allocated storage to capacity rows"""
+        values = np.zeros(capacity, dtype=self.values.dtype)
+        if values.dtype == object:
+            values.fill(None)
+        present = np.zeros(capacity, dtype=bool)
+        n = min(capacity, len(self.values))
+        values[:n] = self.values[:n]
+        present[:n] = self.present[:n]
+        self.values, self.present = values, present
+
+    def decoded(self):
+        """the values with categorical codes replaced by their categories"""
+        if self.categories is None:
+            return self.values
+        values = np.empty(len(self.values), dtype=object)
+        values[self.present] = np.array(self.categories, dtype=object)[self.values[self.present]]
+        return values
+
+    def astype(self, kind):
+        """convert the stored values to kind in place"""
+        if kind == self.kind:
+            return
+        old = self.decoded()[self.present]
+        self.values = _empty(kind, len(self.values))
+        self.categories = [] if kind == CATEGORY else None
+        self._codes = None
+        if kind == CATEGORY:
+            self.values[self.present] = self._encode(old)
+        elif kind == OBJECT:
+            self.values[self.present] = old.tolist() if old.dtype != object else old
+        else:
+            self.values[self.present] = np.array(old.tolist(), dtype=kind)
+
+    def _code(self, category):
+        code = self.codes.get(category)
+        if code is None:
+            code = self.codes[category] = len(self.categories)
+            self.categories.append(category)
+            if code_dtype(len(self.categories)) != self.values.dtype:
+                self.values = self.values.astype(code_dtype(len(self.categories)))
+        return code
+
+    def _encode(self, categories):
+        categories = np.asarray(categories, dtype=object)
+        if not len(categories):
+            return np.zeros(0, dtype=self.values.dtype)
+        unique, inverse = np.unique(categories, return_inverse=True)
+        return np.array([self._code(category) for category in unique], dtype=self.values.dtype)[inverse]
+
+    def get(self, row):
+        if not self.present[row]:
+            raise KeyError(row)
+        value = self.values[row]
+        if self.categories is not None:
+            return self.categories[value]
+        if self.values.dtype == object:
+            return value
+        return value.item()
+
+    def set(self, row, value):
+        """
+        set the value at row, which must be of a kind the column holds
+
+        Returns
+        -------
+            True if the row gained or changed a value
+        """
+        if self.categories is not None:
+            value = self._code(value)
+        changed = not self.present[row] or not _equal(self.values[row], value)
+        self.values[row] = value
+        self.present[row] = True
+        return changed
+
+    def set_many(self, rows, values):
+        """
+        set the values at rows from the array values, which must be of a kind the column holds
+
+        Returns
+        -------
+            a boolean array, True where the row gained or changed a value
+        """
+        if self.categories is not None:
+            values = self._encode(values)
+        try:
+            changed = ~self.present[rows] | np.asarray(self.values[rows] != values, dtype=bool)
+        except ValueError:
+            # object values such as arrays do not compare to a single truth value
+            changed = np.ones(len(rows), dtype=bool)
+        self.values[rows] = values
+        self.present[rows] = True
+        return changed
+
+    def clear(self, row):
+        self.present[row] = False
+        if self.values.dtype == object:
+            self.values[row] = None
+
+    def compact_kind(self, n_rows):
+        """the most compact kind that holds every present value of the column without loss"""
+        present = self.present[:n_rows]
+        if not present.any():
+            return self.kind
+        if self.categories is not None:
+            kind = CATEGORY
+        elif self.values.dtype == object:
+            kind = reduce(common_kind, {infer_kind(value) for value in self.values[:n_rows][present]})
+        else:
+            kind = array_kind(self.values[:n_rows][present])
+        if kind == CATEGORY:
+            n_categories = len(np.unique(self.decoded()[:n_rows][present]))
+            if n_categories > CATEGORY_LIMIT and 2 * n_categories > present.sum():
+                kind = OBJECT
+        return kind
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.present.nbytes
+
+
+class SparseColumn:
+    """
+    a column that only stores the rows that have a value
+
+    the rows with a value are kept as a sorted array with their values, in the same order, in a
+    Column, and a bitmap records which rows have a value. memory grows with the number of values
+    (plus one bit per row) rather than with the number of rows. values set one at a time on rows
+    that had none are buffered and merged into the sorted arrays in batches.
+
+    Parameters
+    ----------
+    kind: str
+        the kind of the stored values, one of ml4ms.schema.KINDS
+    capacity: int
+        the number of rows to allocate the bitmap for
+    """
+
+    sparse = True
+
+    def __init__(self, kind, capacity=0):
+        self.row_array = np.zeros(0, dtype=ROW_DTYPE)
+        self.data = Column(kind)
+        self.bits = np.zeros((capacity + 7) // 8, dtype=np.uint8)
+        self._pending = {}
+
+    @classmethod
+    def from_arrays(cls, rows, data, bits):
+        """a SparseColumn wrapping existing arrays (e.g. memory maps) without copying"""
+        column = cls.__new__(cls)
+        column.row_array = rows
+        column.data = data
+        column.bits = bits
+        column._pending = {}
+        return column
+
+    @classmethod
+    def from_dense(cls, column, n_rows):
+        """a SparseColumn holding the values of the first n_rows rows of a Column"""
+        rows = column.rows(n_rows)
+        data = Column.from_arrays(column.values[rows], np.ones(len(rows), dtype=bool), column.categories)
+        bits = np.packbits(column.present, bitorder="little")
+        return cls.from_arrays(rows, data, bits)
+
+    def to_dense(self, capacity):
+        """a Column of capacity rows holding the same values"""
+        self.flush()
+        column = Column(self.kind, capacity)
+        column.values = column.values.astype(self.data.values.dtype)
+        column.values[self.row_array] = self.data.values[: len(self.row_array)]
+        column.present[self.row_array] = True
+        column.categories = self.data.categories
+        return column
+
+    @property
+    def kind(self):
+        return self.data.kind
+
+    @property
+    def categories(self):
+        return self.data.categories
+
+    @property
+    def present(self):
+        """a dense boolean array of which rows have a value (a copy)"""
+        return np.unpackbits(self.bits, bitorder="little").view(bool)
+
+    def has(self, row):
+        return bool(self.bits[row >> 3] >> (row & 7) & 1)
+
+    def count(self, n_rows):
+        return len(self.row_array) + len(self._pending)
+
+    def rows(self, n_rows):
+        self.flush()
+        return self.row_array
+
+    def dense(self, n_rows):
+        """(values, present) of the first n_rows rows, copied out into dense arrays"""
+        column = self.to_dense(n_rows)
+        return column.values, column.present
+
+    def take(self, rows):
+        """(values, present) of rows, found by a sorted search of the rows that have a value"""
+        self.flush()
+        rows = np.asarray(rows)
+        slots = np.searchsorted(self.row_array, rows)
+        slots[slots == len(self.row_array)] = 0
+        present = self.row_array[slots] == rows if len(self.row_array) else np.zeros(len(rows), dtype=bool)
+        values = _empty(self.kind, len(rows)).astype(self.data.values.dtype)
+        values[present] = self.data.values[slots[present]]
+        return values, present
+
+    def flush(self):
+        """merge the buffered values into the sorted arrays"""
+        if not self._pending:
+            return
+        rows = np.fromiter(self._pending, dtype=ROW_DTYPE, count=len(self._pending))
+        if self.kind == OBJECT:
+            # np.asarray would turn a mix of e.g. str and int values into strings
+            values = np.empty(len(rows), dtype=object)
+            values[:] = list(self._pending.values())
+        else:
+            values = as_column_array(list(self._pending.values()))
+        self._pending = {}
+        self._insert(rows, values)
+
+    def _insert(self, rows, values):
+        """add values on rows that have none, rows being unique"""
+        n = len(self.row_array)
+        self.data.resize(n + len(rows))
+        self.data.set_many(np.arange(n, n + len(rows)), values)
+        rows = np.concatenate([self.row_array, rows.astype(ROW_DTYPE)])
+        order = np.argsort(rows, kind="stable")
+        self.row_array = rows[order]
+        self.data.values = self.data.values[order]
+        self._set_bits(self.row_array)
+
+    def _set_bits(self, rows):
+        np.bitwise_or.at(self.bits, rows >> 3, (1 << (rows & 7)).astype(np.uint8))
+
+    def _slot(self, row):
+        return int(np.searchsorted(self.row_array, row))
+
+    def resize(self, capacity):
+        bits = np.zeros((capacity + 7) // 8, dtype=np.uint8)
+        n = min(len(bits), len(self.bits))
+        bits[:n] = self.bits[:n]
+        self.bits = bits
+
+    def astype(self, kind):
+        self.flush()
+        self.data.astype(kind)
+
+    def get(self, row):
+        if not self.has(row):
+            raise KeyError(row)
+        if row in self._pending:
+            self.flush()
+        return self.data.get(self._slot(row))
+
+    def set(self, row, value):
+        if row in self._pending:
+            changed = not _equal(self._pending[row], value)
+            self._pending[row] = value
+            return changed
+        if self.has(row):
+            return self.data.set(self._slot(row), value)
+        self._pending[row] = value
+        self.bits[row >> 3] |= np.uint8(1 << (row & 7))
+        if len(self._pending) >= SPARSE_PENDING:
+            self.flush()
+        return True
+
+    def set_many(self, rows, values):
+        self.flush()
+        rows = np.asarray(rows)
+        changed = np.ones(len(rows), dtype=bool)
+        slots = np.searchsorted(self.row_array, rows)
+        slots[slots == len(self.row_array)] = 0
+        existing = self.row_array[slots] == rows if len(self.row_array) else np.zeros(len(rows), dtype=bool)
+        if existing.any():
+            changed[existing] = self.data.set_many(slots[existing], values[existing])
+        if not existing.all():
+            new_rows, new_values = rows[~existing], values[~existing]
+            # keep the last value of a row that appears more than once
+            _, last = np.unique(new_rows[::-1], return_index=True)
+            last = len(new_rows) - 1 - last
+            self._insert(new_rows[last], new_values[last])
+        return changed
+
+    def clear(self, row):
+        if row in self._pending:
+            del self._pending[row]
+        else:
+            slot = self._slot(row)
+            self.row_array = np.delete(self.row_array, slot)
+            self.data.values = np.delete(self.data.values, slot)
+            self.data.present = np.delete(self.data.present, slot)
+        self.bits[row >> 3] &= np.uint8(~(1 << (row & 7)) & 0xFF)
+
+    def compact_kind(self, n_rows):
+        self.flush()
+        return self.data.compact_kind(len(self.row_array))
+
+    @property
+    def nbytes(self):
+        return self.row_array.nbytes + self.data.nbytes + self.bits.nbytes
+
+
+class ColumnStore:
+    """
+    struct-of-arrays storage for a collection of materials
+
+    every attribute is held in its own typed Column and materials are addressed by a row number
+    through an index from material_id to row. the kind of each column is inferred from the values
+    merged into it, as the most compact one that holds them all, unless it has been pinned.
+    """
+
+    def __init__(self):
+        self.columns = {}
+        self.ids = IdTable()
+        self.pinned = {}
+        self._capacity = 0
+
+    @classmethod
+    def from_arrays(cls, ids, columns, pinned=None):
+        """
+        a store wrapping existing arrays, e.g. memory maps of a saved store, without copying them
+
+        Parameters
+        ----------
+        ids: IdTable
+            the material_id of every row
+        columns: dict
+            {name: Column} with arrays the same length as ids
+        pinned: dict or None
+            {name: kind} of the columns whose kind is pinned
+        """
+        store = cls()
+        store.ids = ids
+        store.columns = dict(columns)
+        store.pinned = dict(pinned or {})
+        store._capacity = len(ids)
+        return store
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, material_id):
+        """
+        append an empty row for material_id
+
+        Returns
+        -------
+            the row number of the new material
+        """
+        if len(self.ids) == self._capacity:
+            self.reserve(max(16, 2 * self._capacity))
+        return self.ids.add(material_id)
+
+    def add_many(self, material_ids):
+        """
+        append an empty row for each of material_ids
+
+        Returns
+        -------
+            an int32 array of the new row numbers
+        """
+        material_ids = list(material_ids)
+        capacity = max(self._capacity, 16)
+        while capacity < len(self.ids) + len(material_ids):
+            capacity *= 2
+        self.reserve(capacity)
+        return self.ids.add_many(material_ids)
+
+    def reserve(self, capacity):
+        """make room for at least capacity rows without reallocating"""
+        if capacity <= self._capacity:
+            return
+        for column in self.columns.values():
+            column.resize(capacity)
+        self._capacity = capacity
+
+    def check_kind(self, name, kind):
+        """raise a ValueError when attribute name is pinned to a kind that does not take values of kind"""
+        pinned = self.pinned.get(name)
+        if pinned is not None and not accepts(pinned, kind):
+            raise ValueError(f"attribute {name!r} is pinned to {pinned} and cannot take {kind} values")
+
+    def _column_for(self, name, kind, n_values=1):
+        """the column of name, created or converted as needed to take n_values values of kind"""
+        column = self.columns.get(name)
+        pinned = self.pinned.get(name)
+        if pinned is not None:
+            self.check_kind(name, kind)
+            target = pinned
+        else:
+            target = kind if column is None else common_kind(column.kind, kind)
+        if column is None:
+            n = len(self)
+            layout = SparseColumn if n >= SPARSE_MIN_ROWS and n_values < SPARSE_DENSITY * n else Column
+            column = self.columns[name] = layout(target, self._capacity)
+        elif column.kind != target:
+            column.astype(target)
+        return column
+
+    def _check_column(self, name, column):
+        """
+        fall back from categories to objects when nearly every value is different, and from a
+        sparse to a dense layout when enough rows have a value
+        """
+        if column.categories is not None and name not in self.pinned:
+            n_categories = len(column.categories)
+            if n_categories > CATEGORY_LIMIT and 2 * n_categories > len(self):
+                column.astype(OBJECT)
+        if column.sparse and column.count(len(self)) > SPARSE_DENSITY * len(self):
+            self.columns[name] = column.to_dense(self._capacity)
+
+    def set(self, row, name, value):
+        column = self._column_for(name, infer_kind(value))
+        changed = column.set(row, value)
+        self._check_column(name, column)
+        return changed
+
+    def set_column(self, name, rows, values):
+        """
+        set attribute name for many rows at once
+
+        Parameters
+        ----------
+        name: str
+            the attribute
+        rows: numpy.ndarray
+            the rows to set
+        values: array_like
+            the new values, aligned with rows
+
+        Returns
+        -------
+            a boolean array, True where the row gained or changed a value
+        """
+        values = as_column_array(values)
+        column = self._column_for(name, array_kind(values), len(values))
+        changed = column.set_many(rows, values)
+        self._check_column(name, column)
+        return changed
+
+    @property
+    def schema(self):
+        """{name: kind} of every column"""
+        return {name: column.kind for name, column in self.columns.items()}
+
+    def pin(self, name, kind):
+        """
+        fix the kind of column name, converting the values it already holds
+
+        Parameters
+        ----------
+        name: str
+            the attribute
+        kind: str or None
+            one of ml4ms.schema.KINDS, or None to let the kind be inferred again
+        """
+        if kind is None:
+            self.pinned.pop(name, None)
+            return
+        if kind not in KINDS:
+            raise ValueError(f"kind must be one of {KINDS}, not {kind!r}")
+        column = self.columns.get(name)
+        if column is not None:
+            current = column.compact_kind(len(self))
+            if not accepts(kind, current):
+                raise ValueError(f"attribute {name!r} holds {current} values that do not fit {kind}")
+            column.astype(kind)
+        self.pinned[name] = kind
+
+    def compact(self):
+        """
+        convert every column that is not pinned to the most compact kind that holds its values,
+        and store sparse those where few rows have a value
+        """
+        n = len(self)
+        for name, column in list(self.columns.items()):
+            if name not in self.pinned:
+                column.astype(column.compact_kind(n))
+            if not column.sparse and n >= SPARSE_MIN_ROWS and column.count(n) < SPARSE_DENSITY * n:
+                self.columns[name] = SparseColumn.from_dense(column, n)
+
+    def get(self, row, name):
+        column = self.columns.get(name)
+        if column is None:
+            raise KeyError(name)
+        try:
+            return column.get(row)
+        except KeyError:
+            raise KeyError(name) from None
+
+    def clear(self, row, name):
+        column = self.columns.get(name)
+        if column is None or not column.has(row):
+            raise KeyError(name)
+        column.clear(row)
+
+    def update_row(self, row, attributes):
+        """
+        set every {name: value} of attributes on row
+
+        Returns
+        -------
+            True if any of the attributes was gained or changed
+        """
+        changed = False
+        for name, value in attributes.items():
+            changed |= self.set(row, name, value)
+        return changed
+
+    def attributes(self, row):
+        """the names of the attributes that row has a value for"""
+        return [name for name, column in self.columns.items() if column.has(row)]
+
+    def column(self, name, rows=None):
+        """
+        the values and presence mask of attribute name over all rows, or over rows
+
+        Returns
+        -------
+            (values, present) of length len(self), views into the stored arrays of a dense column
+            and copies for a sparse one, or copies of length len(rows)
+        """
+        if rows is not None:
+            return self.columns[name].take(rows)
+        return self.columns[name].dense(len(self))
+
+    def having(self, name):
+        """the sorted rows that have a value of attribute name"""
+        column = self.columns.get(name)
+        if column is None:
+            return np.zeros(0, dtype=ROW_DTYPE)
+        return column.rows(len(self))
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+
+class RowView(MutableMapping):
+    """dict-like access to the attributes of one row of a ColumnStore"""
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, name):
+        return self._store.get(self._row, name)
+
+    def __setitem__(self, name, value):
+        self._store.set(self._row, name, value)
+
+    def __delitem__(self, name):
+        self._store.clear(self._row, name)
+
+    def __iter__(self):
+        return iter(self._store.attributes(self._row))
+
+    def __len__(self):
+        return len(self._store.attributes(self._row))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class DatasetView(MutableMapping):
+    """
+    the {material_id: {attribute: value, ...}} view of a ColumnStore
+
+    assigning a dict to a material_id adds the material (or replaces its attributes), and update
+    and setdefault work as for a dict. materials cannot be removed (del, pop, popitem and clear
+    raise TypeError), as that would renumber the rows after them under the indexes built on the
+    Dataset; their attributes can be deleted one by one.
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, material_id):
+        return RowView(self._store, self._store.ids.row_of(material_id))
+
+    def __setitem__(self, material_id, attributes):
+        attributes = dict(attributes)
+        row = self._store.ids.get(material_id)
+        if row is None:
+            row = self._store.add(material_id)
+        else:
+            for name in self._store.attributes(row):
+                self._store.clear(row, name)
+        self._store.update_row(row, attributes)
+
+    def __delitem__(self, material_id):
+        raise TypeError(
+            "materials cannot be removed from a Dataset, build a new one without them, e.g. "
+            "dataset.dataset = {key: dict(value) for key, value in dataset.dataset.items() if ...}"
+        )
+
+    def __contains__(self, material_id):
+        return material_id in self._store.ids
+
+    def __iter__(self):
+        return iter(self._store.ids)
+
+    def __len__(self):
+        return len(self._store)
+
+    def __repr__(self):
+        return repr({material_id: dict(row) for material_id, row in self.items()})
@@ -1,20 +1,487 @@
-class Dataset:
+from collections import namedtuple
+from itertools import islice
+
+import numpy as np
+
+from ml4ms.columns import ColumnStore, DatasetView, RowView, as_column_array
+from ml4ms.ids import ROW_DTYPE, id_array
+from ml4ms.schema import NUMERIC_KINDS, array_kind, infer_kind
+from ml4ms.storage import open_store, save_store
+
+POLICIES = ("strict", "upsert", "skip")
+
+MergeReport = namedtuple("MergeReport", ["matched", "updated", "inserted", "missing"])
+MergeReport.__doc__ = """
+the outcome of a merge
+
+matched is the number of input rows whose material_id was already in the Dataset, updated the
+number of those where at least one attribute gained or changed a value, inserted the number of
+new materials added by an "upsert" merge and missing the material_ids that were not in the
+Dataset and were skipped.
+"""
+
+FeatureArrays = namedtuple("FeatureArrays", ["X", "y", "material_ids", "missing", "y_missing"])
+FeatureArrays.__doc__ = """
+attributes of a Dataset as numpy arrays, from Dataset.to_arrays
+
+X is the (n, n_features) feature matrix and y the target vector (None without a target), with
+material_ids the material_id of every row of them. missing and y_missing are boolean masks, True
+where a material has no value for the feature or target. missing features are nan in X, while the
+values of y where y_missing is True are meaningless.
+"""
+
+
+def _check_policy(policy):
+    if policy not in POLICIES:
+        raise ValueError(f"policy must be one of {POLICIES}, not {policy!r}")
+
+
+class BaseDataset:
+    """
+    the parts of a Dataset that do not depend on how its attributes are stored
+
+    a subclass provides the merges (merge_new_data, merge_arrays) and the read access (len,
+    material_ids, column, schema, ...), and calls self._notify(rows, names) after every merge.
+    """
+
+    def __init__(self):
+        self._listeners = []
+
+    def add_merge_listener(self, listener, attributes=False):
+        """
+        call listener(dataset, rows) after every merge, e.g. to keep an index up to date
+
+        rows is an int32 array of the row numbers of the materials the merge inserted or updated.
+        changes made through the self.dataset view are not reported.
+
+        Parameters
+        ----------
+        listener: callable
+            the function to call
+        attributes: bool
+            whether to call listener(dataset, rows, names) instead, names being the list of the
+            attributes the merge set a value of
+
+        Returns
+        -------
+            nothing
+        """
+        self._listeners.append((listener, attributes))
+
+    def remove_merge_listener(self, listener):
+        """stop calling a listener added with add_merge_listener"""
+        for i, (added, _) in enumerate(self._listeners):
+            if added == listener:
+                del self._listeners[i]
+                return
+        raise ValueError(f"{listener!r} is not a merge listener")
+
+    def _notify(self, rows, names):
+        for listener, attributes in self._listeners:
+            if attributes:
+                listener(self, rows, names)
+            else:
+                listener(self, rows)
+
+    def _numeric_column(self, name, rows):
+        """(values, present) of attribute name at rows, raising for attributes that are not numeric"""
+        kind = self.schema.get(name)
+        if kind is None:
+            raise KeyError(f"no material has attribute {name!r}")
+        if kind not in NUMERIC_KINDS:
+            raise TypeError(f"attribute {name!r} is of kind {kind}, not a numeric kind")
+        return self.column(name, rows)
+
+    def to_arrays(self, features, target=None, rows=None, dtype=None):
+        """
+        numeric attributes as a feature matrix and a target vector, e.g. for training a model
+
+        the arrays are built straight from the attribute columns without going through python
+        objects. the target is a view of its column, sharing memory with the Dataset, when it is a
+        dense column of dtype over all rows; X is filled column by column into a single new
+        C-contiguous array.
+
+        Parameters
+        ----------
+        features: sequence of str
+            the attributes that make up the columns of X
+        target: str or None
+            the attribute to return as y
+        rows: array_like or None
+            the row numbers to export, in order, all rows when None
+        dtype: numpy.dtype or None
+            the float dtype of X and y. when None, the smallest of float32 and float64 that holds
+            every value of the attributes exactly
+
+        Returns
+        -------
+            a FeatureArrays (X, y, material_ids, missing, y_missing)
+        """
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.intp)
+        columns = [self._numeric_column(name, rows) for name in features]
+        target_column = None if target is None else self._numeric_column(target, rows)
+        if dtype is None:
+            dtypes = [values.dtype for values, _ in columns]
+            if target_column is not None:
+                dtypes.append(target_column[0].dtype)
+            dtype = np.result_type(np.float32, *dtypes)
+        dtype = np.dtype(dtype)
+        if dtype.kind != "f":
+            raise ValueError(f"dtype must be a float dtype, not {dtype}")
+        n = len(self) if rows is None else len(rows)
+        X = np.empty((n, len(columns)), dtype=dtype)
+        missing = np.empty((n, len(columns)), dtype=bool)
+        for i, (values, present) in enumerate(columns):
+            X[:, i] = values
+            np.logical_not(present, out=missing[:, i])
+        X[missing] = np.nan
+        y = y_missing = None
+        if target_column is not None:
+            values, present = target_column
+            y = values if values.dtype == dtype else values.astype(dtype)
+            y_missing = ~present
+        material_ids = self.material_ids if rows is None else self.material_ids[rows]
+        return FeatureArrays(X, y, material_ids, missing, y_missing)
+
+    def merge_stream(self, records, chunk_size=10000, policy="strict"):
+        """
+        merge an iterable of (material_id, attributes) pairs into self.dataset (in place)
+
+        records are consumed lazily, chunk_size at a time, and each chunk is merged with
+        merge_new_data, so the extra memory needed is bounded by the chunk size rather than by the
+        size of the source. every chunk is atomic, chunks merged before a failing one stay merged.
+
+        Parameters
+        ----------
+        records: iterable
+            (mat_id, {attribute_1: , attribute_2:, ...}) pairs, e.g. a generator reading a
+            JSON-lines file. a material_id may appear more than once.
+        chunk_size: int
+            the number of records merged at a time
+        policy: str
+            what to do with a material_id that is not in self.dataset, as for merge_new_data
+
+        Returns
+        -------
+            a MergeReport summed over all of the chunks
+        """
+        if chunk_size < 1:
+            raise ValueError(f"chunk_size must be at least 1, not {chunk_size}")
+        _check_policy(policy)
+        records = iter(records)
+        matched = updated = inserted = 0
+        missing = []
+        while True:
+            chunk = {}
+            for key, value in islice(records, chunk_size):
+                chunk.setdefault(key, {}).update(value)
+            if not chunk:
+                break
+            report = self.merge_new_data(chunk, policy=policy)
+            matched += report.matched
+            updated += report.updated
+            inserted += report.inserted
+            missing.extend(report.missing)
+        return MergeReport(matched, updated, inserted, missing)
+
+
+class Dataset(BaseDataset):
+    """
+    a collection of materials, each a dictionary of attributes keyed by its material_id
+
+    the attributes are held column-wise in a ColumnStore (one typed numpy array per attribute)
+    and self.dataset is a dict-like {material_id: {attribute: value, ...}} view on top of it.
+    """
+
     def __init__(self):
-        self.dataset = {}
+        super().__init__()
+        self._store = ColumnStore()
+
+    @property
+    def dataset(self):
+        return DatasetView(self._store)
+
+    @dataset.setter
+    def dataset(self, data):
+        store = ColumnStore()
+        store.reserve(len(data))
+        for key, value in data.items():
+            store.update_row(store.add(key), value)
+        self._store = store
+        self._notify(np.arange(len(store), dtype=ROW_DTYPE), list(store.schema))
+
+    def __len__(self):
+        return len(self._store)
+
+    @property
+    def material_ids(self):
+        """the material_id of every row, as a numpy array indexed by row number"""
+        return self._store.ids.array()
+
+    def material_ids_of(self, rows):
+        """the material_ids of rows, as a numpy array, at a cost proportional to their number"""
+        return self._store.ids.take(rows)
+
+    def row_of(self, material_id):
+        """the row number of material_id, raising KeyError when it is not in self.dataset"""
+        return self._store.ids.row_of(material_id)
+
+    def rows_of(self, material_ids):
+        """
+        the row numbers of many material_ids at once
+
+        Parameters
+        ----------
+        material_ids: array_like
+            the ids to look up
+
+        Returns
+        -------
+            an int32 array of row numbers, -1 where the material_id is not in self.dataset
+        """
+        return self._store.ids.lookup(material_ids)
+
+    def row(self, row):
+        """the dict-like {attribute: value, ...} of the material at row number row"""
+        if not 0 <= row < len(self._store):
+            raise IndexError(f"row {row} is out of range for a Dataset of {len(self._store)} materials")
+        return RowView(self._store, row)
+
+    def column(self, name, rows=None):
+        """
+        every value of attribute name, indexed by row number
+
+        Parameters
+        ----------
+        name: str
+            the attribute
+        rows: array_like or None
+            the row numbers to return the values of, at a cost proportional to their number, or
+            None for every row
+
+        Returns
+        -------
+            (values, present), views of the stored arrays (copies for a sparse attribute or given
+            rows). values is only meaningful where present is True, and holds the codes into
+            self.categories(name) for a categorical attribute.
+        """
+        return self._store.column(name, rows)
+
+    def categories(self, name):
+        """
+        the categories of a categorical attribute, which the values returned by column index into
+
+        Returns
+        -------
+            the list of categories, None when attribute name is not categorical
+        """
+        column = self._store.columns.get(name)
+        if column is None:
+            raise KeyError(f"no material has attribute {name!r}")
+        return column.categories
+
+    def having(self, name):
+        """
+        the materials that have a value for attribute name
+
+        Returns
+        -------
+            a sorted int32 array of their row numbers
+        """
+        return self._store.having(name)
+
+    @property
+    def schema(self):
+        """
+        the kind of every attribute
+
+        kinds are inferred on merge as the most compact ones that hold the merged values without
+        loss: bool, int8 to int64, float32 or float64, category (integer codes into a list of
+        strings) or object for anything else (e.g. lists). independently of its kind, an attribute
+        that only few materials have is stored sparse, holding just the values that are there.
+
+        Returns
+        -------
+            {attribute: kind}
+        """
+        return self._store.schema
+
+    def pin_schema(self, schema):
+        """
+        fix the kinds of attributes instead of inferring them
+
+        values merged into a pinned attribute are converted to its kind, and ValueError is raised
+        for those that would not fit (e.g. a string for an int16 attribute). floats are rounded to
+        a pinned float32.
+
+        Parameters
+        ----------
+        schema: dict
+            {attribute: kind} with kind one of ml4ms.schema.KINDS, or None to unpin the attribute
+
+        Returns
+        -------
+            nothing
+        """
+        for name, kind in schema.items():
+            self._store.pin(name, kind)
+
+    def compact(self):
+        """
+        convert every attribute that is not pinned to the most compact kind that holds its values
+
+        merges only ever widen the kinds, so this recovers memory after, e.g., the only values that
+        needed float64 have been replaced. attributes that few materials have are made sparse.
+
+        Returns
+        -------
+            nothing
+        """
+        self._store.compact()
+
+    @property
+    def nbytes(self):
+        """the number of bytes held in the attribute columns"""
+        return self._store.nbytes
 
-    def merge_new_data(self, new_data):
+    def save(self, path):
+        """
+        write self.dataset to the directory path as raw numpy columns plus an id index
+
+        Parameters
+        ----------
+        path: str
+            the directory to write, created if it does not exist
+
+        Returns
+        -------
+            nothing
+        """
+        save_store(self._store, path)
+
+    @classmethod
+    def open(cls, path, mode="r"):
+        """
+        open a Dataset written by Dataset.save with its columns memory mapped
+
+        opening takes the same time however big the Dataset is and only the pages that are touched
+        are read from disk. read-only Datasets opened from the same path by several processes share
+        the same memory.
+
+        Parameters
+        ----------
+        path: str
+            the directory written by Dataset.save
+        mode: str
+            "r" (read-only), "c" (copy-on-write, changes are not saved) or "r+" (changes to existing
+            values are written back to the files)
+
+        Returns
+        -------
+            the Dataset
+        """
+        dataset = cls()
+        dataset._store = open_store(path, mode=mode)
+        return dataset
+
+    def merge_new_data(self, new_data, policy="strict"):
         """
         merge new_data into self.dataset (in place) based on matching "material_id"
 
+        new_data is read in a single pass and only written once every material_id has been
+        resolved and every value checked against the pinned kinds, so a merge that raises leaves
+        self.dataset untouched.
+
         Parameters
         ----------
         new_data: dict
             the first argument is a dictionary with the same format as self.dataset
             {mat_id_1 : {attribute_1: , attribute_2:, ...}, ...}
+        policy: str
+            what to do with a material_id that is not in self.dataset. "strict" raises a KeyError,
+            "upsert" adds it as a new material and "skip" leaves it out.
 
         Returns
         -------
-            nothing
+            a MergeReport of the merge
         """
+        _check_policy(policy)
+        ids = self._store.ids
+        pinned = self._store.pinned
+        matched, inserts, missing = [], [], []
         for key, value in new_data.items():
-            self.dataset[key].update(value)
+            row = ids.get(key)
+            if row is not None:
+                matched.append((row, value))
+            elif policy == "upsert":
+                inserts.append((key, value))
+            elif policy == "skip":
+                missing.append(key)
+                continue
+            else:
+                raise KeyError(key)
+            for name in pinned.keys() & value.keys():
+                self._store.check_kind(name, infer_kind(value[name]))
+        updated = sum(self._store.update_row(row, value) for row, value in matched)
+        rows = self._store.add_many(key for key, _ in inserts)
+        for row, (_, value) in zip(rows, inserts):
+            self._store.update_row(row, value)
+        if self._listeners:
+            rows = np.concatenate([np.array([row for row, _ in matched], dtype=ROW_DTYPE), rows])
+            self._notify(rows, list(dict.fromkeys(name for _, value in matched + inserts for name in value)))
+        return MergeReport(len(matched), updated, len(inserts), missing)
+
+    def merge_arrays(self, material_ids, columns, policy="skip"):
+        """
+        merge aligned arrays of attribute values into self.dataset (in place) based on matching "material_id"
+
+        this is the bulk counterpart of merge_new_data: the ids are joined against the Dataset in a
+        single sorted pass and every attribute is written with one vectorized assignment.
+
+        Parameters
+        ----------
+        material_ids: array_like
+            the material_id of each input row, all str or all int
+        columns: dict
+            {attribute_1: values_1, ...} where each values array is aligned with material_ids.
+            when an id appears more than once the last of its rows wins.
+        policy: str
+            what to do with a material_id that is not in self.dataset, as for merge_new_data
+
+        Returns
+        -------
+            a MergeReport of the merge, with missing as an array
+        """
+        _check_policy(policy)
+        material_ids = id_array(material_ids)
+        columns = {name: as_column_array(values) for name, values in columns.items()}
+        for name, values in columns.items():
+            if len(values) != len(material_ids):
+                raise ValueError(
+                    f"column {name!r} has {len(values)} values but there are {len(material_ids)} material_ids"
+                )
+        rows = self._store.ids.lookup(material_ids)
+        matched = rows >= 0
+        inserted = 0
+        if not matched.all() and policy == "strict":
+            raise KeyError(material_ids[~matched][0])
+        written = matched if policy == "skip" else slice(None)
+        for name, values in columns.items():
+            if name in self._store.pinned and len(values[written]):
+                self._store.check_kind(name, array_kind(values[written]))
+        if not matched.all() and policy == "upsert":
+            new_ids, first, inverse = np.unique(material_ids[~matched], return_index=True, return_inverse=True)
+            order = np.argsort(first)
+            rank = np.empty_like(order)
+            rank[order] = np.arange(len(order))
+            rows[~matched] = self._store.add_many(new_ids[order].tolist())[rank[inverse]]
+            inserted = len(new_ids)
+        found = rows >= 0
+        changed = np.zeros(int(found.sum()), dtype=bool)
+        for name, values in columns.items():
+            changed |= self._store.set_column(name, rows[found], values[found])
+        updated = int(changed[matched[found]].sum())
+        if self._listeners:
+            self._notify(np.unique(rows[found]), list(columns))
+        return MergeReport(int(matched.sum()), updated, inserted, material_ids[~found])
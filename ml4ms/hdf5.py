@@ -0,0 +1,231 @@
+import numpy as np
+
+from ml4ms.schema import CATEGORY, NUMERIC_KINDS
+from ml4ms.spectra import Spectra
+
+FORMAT_VERSION = 1
+# the uncompressed size of a chunk: small enough that reading one spectrum decompresses little
+# more than the spectrum, big enough that a scan of the whole collection is a few large reads
+CHUNK_BYTES = 1 << 18
+# the chunk cache of a file opened for reading, holding several chunks of every dataset
+CACHE_BYTES = 1 << 24
+
+
+def _h5py():
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError("reading and writing HDF5 files needs h5py, e.g. pip install h5py") from None
+    return h5py
+
+
+def _chunks(shape, itemsize, chunk_bytes):
+    """the chunk shape of an array: whole rows of a 2-D array, chunk_bytes worth of either"""
+    if len(shape) == 2:
+        return (int(min(shape[0], max(1, chunk_bytes // max(1, shape[1] * itemsize)))), shape[1])
+    return (int(min(shape[0], max(1, chunk_bytes // itemsize))),)
+
+
+def _create(group, name, data, chunk_bytes=CHUNK_BYTES, compression="gzip", compression_opts=4):
+    """write data to a chunked, compressed dataset of group, or a plain one when it is empty"""
+    if data.size == 0:
+        return group.create_dataset(name, data=data)
+    return group.create_dataset(
+        name,
+        data=data,
+        chunks=_chunks(data.shape, data.itemsize, chunk_bytes),
+        compression=compression,
+        compression_opts=compression_opts,
+        shuffle=compression is not None,
+    )
+
+
+def _id_array(material_ids, h5py):
+    ids = np.asarray(material_ids)
+    if ids.dtype.kind == "U" or ids.dtype == object and all(isinstance(i, str) for i in material_ids):
+        return np.array(material_ids, dtype=h5py.string_dtype())
+    if ids.dtype.kind in "iu":
+        return ids.astype(np.int64)
+    raise TypeError("only spectra whose material_ids are all str or all int can be written")
+
+
+def write_hdf5(
+    path, spectra, dataset=None, attributes=(), compression="gzip", compression_opts=4, chunk_bytes=CHUNK_BYTES
+):
+    """
+    write a collection of spectra, and attributes of their materials, to an HDF5 file
+
+    the spectra are written as a whole rather than one HDF5 dataset per material. spectra that are
+    all the same length are a 2-D dataset of one spectrum per row, with a single x-grid when they
+    share one, and other spectra are the flat arrays and offsets of Spectra. every attribute is a
+    column aligned with the spectra, under /attributes/<name>, with its values, a mask of which
+    materials have it and, for a categorical attribute, its categories. the arrays are chunked and
+    compressed, a chunk holding chunk_bytes of whole spectra.
+
+    Parameters
+    ----------
+    path: str
+        the file, overwritten if it exists
+    spectra: Spectra
+        the spectra, e.g. Spectra.from_dataset(dataset, y="intensity", x="q")
+    dataset: Dataset or None
+        the Dataset to read attributes from
+    attributes: sequence of str
+        the numeric or categorical attributes of dataset to write for the materials of spectra
+    compression: str or None
+        the h5py compression filter, e.g. "gzip" or "lzf", or None to write uncompressed arrays
+    compression_opts: int or None
+        the level of the compression filter
+    chunk_bytes: int
+        the uncompressed size of a chunk
+
+    Returns
+    -------
+        nothing
+    """
+    h5py = _h5py()
+    lengths = spectra.lengths
+    uniform = len(spectra) > 0 and (lengths == lengths[0]).all()
+    options = {"chunk_bytes": chunk_bytes, "compression": compression, "compression_opts": compression_opts}
+    with h5py.File(path, "w") as f:
+        f.attrs["format"] = FORMAT_VERSION
+        f.attrs["layout"] = "2d" if uniform else "ragged"
+        f.create_dataset("material_ids", data=_id_array(spectra.material_ids, h5py))
+        y = np.asarray(spectra.y)
+        x = None if spectra.x is None else np.asarray(spectra.x)
+        if uniform:
+            shape = (len(spectra), int(lengths[0]))
+            _create(f, "y", y.reshape(shape), **options)
+            if x is not None:
+                x = x.reshape(shape)
+                # a grid shared by every spectrum is written once
+                _create(f, "x", x[0] if (x == x[0]).all() else x, **options)
+        else:
+            _create(f, "offsets", spectra.offsets)
+            _create(f, "y", y, **options)
+            if x is not None:
+                _create(f, "x", x, **options)
+        if attributes:
+            rows = dataset.rows_of(spectra.material_ids)
+            found = rows >= 0
+            group = f.create_group("attributes")
+            for name in attributes:
+                kind = dataset.schema.get(name)
+                if kind is None:
+                    raise KeyError(f"no material has attribute {name!r}")
+                if kind not in NUMERIC_KINDS + (CATEGORY,):
+                    raise TypeError(f"attribute {name!r} is of kind {kind}, which cannot be written to HDF5")
+                categories = dataset.categories(name)
+                values, present = dataset.column(name, np.where(found, rows, 0))
+                present = present & found
+                column = group.create_group(name)
+                _create(column, "values", np.where(present, values, 0).astype(values.dtype), **options)
+                _create(column, "present", present, **options)
+                if categories is not None:
+                    column.create_dataset("categories", data=np.array(categories, dtype=h5py.string_dtype()))
+
+
+def read_hdf5(path, material_ids=None):
+    """
+    read spectra, and the attributes of their materials, written by write_hdf5
+
+    with material_ids only the chunks holding their spectra and attributes are read and
+    decompressed, so reading a few materials from a big file is fast.
+
+    Parameters
+    ----------
+    path: str
+        the file
+    material_ids: sequence or None
+        the materials to read, in that order, or None for every material
+
+    Returns
+    -------
+        (spectra, columns) with spectra the Spectra and columns {attribute: (values, present)}
+        aligned with them, the values of a categorical attribute being its categories
+    """
+    h5py = _h5py()
+    with h5py.File(path, "r", rdcc_nbytes=CACHE_BYTES) as f:
+        if f.attrs.get("format") != FORMAT_VERSION:
+            raise ValueError(f"{path} is not an ml4ms HDF5 file of format {FORMAT_VERSION}")
+        ids = f["material_ids"]
+        ids = (ids.asstr()[()] if h5py.check_string_dtype(ids.dtype) else ids[()]).tolist()
+        if material_ids is None:
+            indices, order = slice(None), None
+        else:
+            position = {material_id: i for i, material_id in enumerate(ids)}
+            wanted = np.array([position[material_id] for material_id in material_ids], dtype=np.int64)
+            # h5py reads increasing indices, the requested order is restored afterwards
+            indices, order = np.unique(wanted, return_inverse=True)
+            ids = list(material_ids)
+
+        def take(name, group=f):
+            if order is None:
+                return group[name][()]
+            return group[name][indices][order] if len(indices) else group[name][:0]
+
+        if f.attrs["layout"] == "2d":
+            y = take("y")
+            x = None
+            if "x" in f:
+                x = f["x"][()] if f["x"].ndim == 1 else take("x")
+                x = np.broadcast_to(x, y.shape)
+            offsets = np.arange(len(y) + 1, dtype=np.int64) * y.shape[1]
+            spectra = Spectra(ids, y.ravel(), offsets, x=None if x is None else x.ravel())
+        else:
+            offsets = f["offsets"][()]
+            if order is None:
+                spectra = Spectra(ids, f["y"][()], offsets, x=f["x"][()] if "x" in f else None)
+            else:
+                # each spectrum is one contiguous slice, read in file order
+                ys = {i: f["y"][offsets[i] : offsets[i + 1]] for i in indices.tolist()}
+                xs = {i: f["x"][offsets[i] : offsets[i + 1]] for i in indices.tolist()} if "x" in f else None
+                spectra = Spectra.from_arrays(
+                    ids,
+                    [ys[i] for i in wanted.tolist()],
+                    xs=None if xs is None else [xs[i] for i in wanted.tolist()],
+                    dtype=f["y"].dtype,
+                )
+        columns = {}
+        for name, column in f.get("attributes", {}).items():
+            values, present = take("values", column), take("present", column)
+            if "categories" in column:
+                categories = np.array(column["categories"].asstr()[()].tolist() + [None], dtype=object)
+                values = categories[np.where(present, values, -1)]
+            columns[name] = (values, present)
+    return spectra, columns
+
+
+def ingest_hdf5(path, dataset, y="intensity", x=None, material_ids=None, policy="upsert"):
+    """
+    merge the spectra and attributes of a file written by write_hdf5 into a Dataset, in bulk
+
+    Parameters
+    ----------
+    path: str
+        the file
+    dataset: Dataset
+        the Dataset to merge into
+    y: str
+        the attribute to hold the intensities of each spectrum
+    x: str or None
+        the attribute to hold the x-grid of each spectrum, which is not merged when None
+    material_ids: sequence or None
+        the materials to read, or None for every material, as for read_hdf5
+    policy: str
+        what to do with a material_id that is not in the Dataset, as for Dataset.merge_arrays
+
+    Returns
+    -------
+        the MergeReport of merging the spectra
+    """
+    spectra, columns = read_hdf5(path, material_ids)
+    report = spectra.merge_into(dataset, y=y, x=x, policy=policy)
+    ids = np.array(spectra.material_ids)
+    if policy == "skip":
+        keep = dataset.rows_of(ids) >= 0
+        ids = ids[keep]
+        columns = {name: (values[keep], present[keep]) for name, (values, present) in columns.items()}
+    for name, (values, present) in columns.items():
+        dataset.merge_arrays(ids[present], {name: values[present]}, policy="strict")
+    return report
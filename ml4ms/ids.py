@@ -0,0 +1,207 @@
+import sys
+
+import numpy as np
+
+ROW_DTYPE = np.int32
+
+
+def id_array(material_ids):
+    """
+    material_ids as a numpy array
+
+    numpy turns a mix of str and int ids into strings, which would let the int 5 stand for the id
+    "5", so such a mix raises TypeError instead.
+    """
+    if isinstance(material_ids, np.ndarray):
+        return material_ids
+    array = np.asarray(material_ids)
+    if array.dtype.kind == "U" and not all(isinstance(i, str) for i in material_ids):
+        raise TypeError("material_ids must be all str or all int, not a mix of both")
+    return array
+
+
+class IdTable:
+    """
+    the material_ids of a collection, numbered by dense int32 row numbers
+
+    str ids are interned, so equal ids coming from different sources share one object and
+    compare by identity. ids are looked up either through a {material_id: row} dict or, for many
+    ids at once or for a table opened from disk, by a sorted search of a numpy array of the ids.
+
+    Parameters
+    ----------
+    material_ids: iterable
+        the initial ids, numbered from 0 in order
+    """
+
+    def __init__(self, material_ids=()):
+        self._list = []
+        self._index = {}
+        self._array = None
+        self._sorted = None
+        self.add_many(material_ids)
+
+    @classmethod
+    def from_array(cls, array, sorted_ids=None):
+        """
+        a table over an existing array of ids (e.g. a memory map) without copying it
+
+        the python list and dict of the ids are only built when something needs them, such as
+        adding an id.
+
+        Parameters
+        ----------
+        array: numpy.ndarray
+            the material_id of every row
+        sorted_ids: tuple or None
+            (array[order], order) with order the argsort of array, if already known
+        """
+        table = cls()
+        table._list = table._index = None
+        table._array = array
+        table._sorted = sorted_ids
+        return table
+
+    @property
+    def _ids(self):
+        if self._list is None:
+            self._list = [sys.intern(i) if isinstance(i, str) else i for i in self._array.tolist()]
+        return self._list
+
+    @property
+    def _dict(self):
+        if self._index is None:
+            self._index = dict(zip(self._ids, range(len(self._ids))))
+        return self._index
+
+    def __len__(self):
+        return len(self._array) if self._list is None else len(self._list)
+
+    def __getitem__(self, row):
+        """the material_id of row"""
+        if self._list is None:
+            return self._array[row].item()
+        return self._list[row]
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __contains__(self, material_id):
+        return self.get(material_id) is not None
+
+    def get(self, material_id, default=None):
+        """the row of material_id, or default when it is not in the table"""
+        if self._index is None:
+            row = self.lookup([material_id])[0]
+            return default if row < 0 else int(row)
+        return self._index.get(material_id, default)
+
+    def row_of(self, material_id):
+        """the row of material_id, raising KeyError when it is not in the table"""
+        row = self.get(material_id)
+        if row is None:
+            raise KeyError(material_id)
+        return row
+
+    def add(self, material_id):
+        """
+        number a new material_id
+
+        Returns
+        -------
+            its row
+        """
+        if material_id in self._dict:
+            raise ValueError(f"material_id {material_id!r} is already in the store")
+        if isinstance(material_id, str):
+            material_id = sys.intern(material_id)
+        row = len(self._ids)
+        self._ids.append(material_id)
+        self._index[material_id] = row
+        self._array = self._sorted = None
+        return row
+
+    def add_many(self, material_ids):
+        """
+        number each of a sequence of new material_ids
+
+        Returns
+        -------
+            an int32 array of their rows
+        """
+        material_ids = [sys.intern(i) if isinstance(i, str) else i for i in material_ids]
+        if len(set(material_ids)) != len(material_ids):
+            raise ValueError("material_ids to add must be unique")
+        index = self._dict
+        for material_id in material_ids:
+            if material_id in index:
+                raise ValueError(f"material_id {material_id!r} is already in the store")
+        start = len(self._ids)
+        self._ids.extend(material_ids)
+        index.update(zip(material_ids, range(start, start + len(material_ids))))
+        if material_ids:
+            self._array = self._sorted = None
+        return np.arange(start, len(self._ids), dtype=ROW_DTYPE)
+
+    def array(self):
+        """the material_id of every row as a numpy array"""
+        if self._array is None:
+            self._array = np.asarray(self._list)
+        return self._array
+
+    def mixed(self):
+        """whether the ids mix str with other types, which array() turns into strings"""
+        if self._list is None:
+            # an array read from disk holds ids of one type
+            return False
+        return self.array().dtype.kind == "U" and not all(isinstance(i, str) for i in self._list)
+
+    def take(self, rows):
+        """the material_ids of rows as a numpy array, at a cost proportional to their number"""
+        if self._list is None:
+            return self._array[rows]
+        ids = self._list
+        return np.array([ids[row] for row in np.asarray(rows).tolist()])
+
+    def sorted(self):
+        """
+        the ids in sorted order
+
+        Returns
+        -------
+            (sorted_ids, order) where sorted_ids is self.array()[order]
+        """
+        if self._sorted is None:
+            ids = self.array()
+            order = np.argsort(ids, kind="stable").astype(ROW_DTYPE)
+            self._sorted = (ids[order], order)
+        return self._sorted
+
+    def lookup(self, material_ids):
+        """
+        the rows of many material_ids at once, found by a sorted join against the table
+
+        Parameters
+        ----------
+        material_ids: array_like
+            the ids to look up
+
+        Returns
+        -------
+            an int32 array of rows, -1 where the id is not in the table
+        """
+        material_ids = np.asarray(material_ids)
+        rows = np.full(len(material_ids), -1, dtype=ROW_DTYPE)
+        if not len(self) or not len(material_ids):
+            return rows
+        if self._index is not None and self._sorted is None and len(material_ids) * 8 < len(self):
+            # a few ids are cheaper to look up one by one than to sort the whole table for
+            get = self._index.get
+            rows[:] = [get(material_id, -1) for material_id in material_ids.tolist()]
+            return rows
+        sorted_ids, order = self.sorted()
+        position = np.searchsorted(sorted_ids, material_ids)
+        position[position == len(sorted_ids)] = 0
+        found = sorted_ids[position] == material_ids
+        rows[found] = order[position[found]]
+        return rows
@@ -0,0 +1,354 @@
+import hashlib
+import json
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ml4ms.spectra import Spectra
+
+SPECTRUM_SUFFIXES = (".xy", ".chi", ".gr")
+ERROR_MODES = ("raise", "skip")
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def _is_data(line):
+    """whether a line of a spectrum file holds at least two numbers"""
+    tokens = line.split()
+    if len(tokens) < 2:
+        return False
+    try:
+        float(tokens[0]), float(tokens[1])
+    except ValueError:
+        return False
+    return True
+
+
+def read_spectrum(path):
+    """
+    read a two-column spectrum file such as an .xy, .chi or .gr file
+
+    header lines (comments, column names, the point counts of .chi files, ...) are skipped up to
+    the first line that starts with two numbers, and only the first two columns are read.
+
+    Parameters
+    ----------
+    path: str
+        the file
+
+    Returns
+    -------
+        (x, y) float64 arrays
+    """
+    with open(path, "rb") as f:
+        return _parse(f.read(), path)
+
+
+def _parse(content, path):
+    """(x, y) of the bytes content of the spectrum file path"""
+    lines = content.splitlines()
+    start = next((i for i, line in enumerate(lines) if _is_data(line)), len(lines))
+    lines = [line for line in lines[start:] if line.strip() and not line.lstrip().startswith(b"#")]
+    if not lines:
+        raise ValueError(f"{path} holds no data")
+    n_columns = len(lines[0].split())
+    data = np.array(b" ".join(lines).split(), dtype=np.float64)
+    if len(data) != n_columns * len(lines):
+        # rows with differing numbers of columns
+        data = np.array([line.split()[:2] for line in lines], dtype=np.float64)
+        n_columns = 2
+    data = data.reshape(-1, n_columns)
+    return data[:, 0].copy(), data[:, 1].copy()
+
+
+def find_spectra(root, suffixes=SPECTRUM_SUFFIXES):
+    """
+    the spectrum files in the directory tree under root
+
+    Parameters
+    ----------
+    root: str
+        the top directory
+    suffixes: sequence of str
+        the file name suffixes of spectrum files
+
+    Returns
+    -------
+        the sorted list of paths
+    """
+    suffixes = tuple(suffix.lower() for suffix in suffixes)
+    paths = []
+    for directory, _, files in os.walk(root):
+        paths.extend(os.path.join(directory, name) for name in files if name.lower().endswith(suffixes))
+    return sorted(paths)
+
+
+def _digest(content):
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def _read_chunk(paths, errors):
+    """
+    the spectra of paths packed as (lengths, x, y, failed, digests), failed being {path: error}
+    and digests the content hash of every file
+    """
+    xs, ys, failed, digests = [], [], {}, []
+    for path in paths:
+        digest = None
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+            digest = _digest(content)
+            x, y = _parse(content, path)
+        except (OSError, ValueError) as error:
+            if errors == "raise":
+                raise
+            failed[path] = str(error)
+            x = y = np.zeros(0)
+        digests.append(digest)
+        xs.append(x)
+        ys.append(y)
+    lengths = np.array([len(y) for y in ys], dtype=np.int64)
+    return lengths, np.concatenate(xs + [np.zeros(0)]), np.concatenate(ys + [np.zeros(0)]), failed, digests
+
+
+def _read_all(paths, material_ids, processes, chunk_size, errors):
+    """the Spectra of every one of paths, with the content hash of every file and {path: error}"""
+    if errors not in ERROR_MODES:
+        raise ValueError(f"errors must be one of {ERROR_MODES}, not {errors!r}")
+    if len(paths) != len(material_ids):
+        raise ValueError("there must be one material_id for every path")
+    chunks = [paths[start : start + chunk_size] for start in range(0, len(paths), chunk_size)]
+    if processes == 0:
+        results = [_read_chunk(chunk, errors) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(_read_chunk, chunks, [errors] * len(chunks)))
+    failed, digests = {}, []
+    for result in results:
+        failed.update(result[3])
+        digests.extend(result[4])
+    lengths = np.concatenate([result[0] for result in results] + [np.zeros(0, dtype=np.int64)])
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    x = np.concatenate([result[1] for result in results] + [np.zeros(0)])
+    y = np.concatenate([result[2] for result in results] + [np.zeros(0)])
+    if failed:
+        warnings.warn(f"skipped {len(failed)} unreadable files, e.g. {next(iter(failed.items()))}")
+    return Spectra(material_ids, y, offsets, x=x), digests, failed
+
+
+def read_spectra(paths, material_ids, processes=None, chunk_size=256, errors="raise"):
+    """
+    read many spectrum files in a pool of processes into one Spectra
+
+    every worker reads a chunk of files at a time and sends them back packed into three arrays, so
+    the results cost a few pickles per chunk rather than a few per file.
+
+    Parameters
+    ----------
+    paths: sequence of str
+        the files
+    material_ids: sequence
+        the material_id of the spectrum of every file
+    processes: int or None
+        the number of worker processes, os.cpu_count() when None and 0 to read in this process
+    chunk_size: int
+        the number of files read by a worker at a time
+    errors: str
+        "raise" to raise on the first file that cannot be read, or "skip" to leave it out with a
+        warning
+
+    Returns
+    -------
+        the Spectra, in the order of paths, with x-grids
+    """
+    spectra, _, failed = _read_all(paths, material_ids, processes, chunk_size, errors)
+    if failed:
+        spectra = spectra.take([i for i, path in enumerate(paths) if path not in failed])
+    return spectra
+
+
+class Manifest:
+    """
+    the fingerprint of every file under a directory the last time it was ingested
+
+    a fingerprint is the size, modification time and content hash of a file. a file whose size and
+    modification time are unchanged is taken to be unchanged without being read, and one whose
+    content hash is unchanged is not merged again. the manifest is a json file, best kept in the
+    directory a Dataset is saved to.
+
+    Parameters
+    ----------
+    path: str
+        the manifest file, read when it exists, or a directory to keep it in as MANIFEST_FILE
+    """
+
+    def __init__(self, path):
+        if os.path.isdir(path):
+            path = os.path.join(path, MANIFEST_FILE)
+        self.path = path
+        self.files = {}
+        self.removed = []
+        if os.path.exists(path):
+            with open(path) as f:
+                meta = json.load(f)
+            if meta.get("format") != MANIFEST_VERSION:
+                raise ValueError(f"{path} is not a manifest of format version {MANIFEST_VERSION}")
+            self.files = meta["files"]
+
+    def save(self):
+        """
+        write the manifest, replacing the file only once it is complete
+
+        Returns
+        -------
+            nothing
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump({"format": MANIFEST_VERSION, "files": self.files}, f)
+        os.replace(temporary, self.path)
+
+    def stale(self, paths, root):
+        """
+        the paths that are new or whose size or modification time changed since they were recorded
+
+        the files recorded under root that are no longer in paths are forgotten and listed in
+        self.removed.
+
+        Parameters
+        ----------
+        paths: sequence of str
+            the files found under root
+        root: str
+            the top directory, the files being recorded by their paths relative to it
+
+        Returns
+        -------
+            (stale, stats) with stale the list of stale paths and stats {path: [size, mtime_ns]}
+            of each of them
+        """
+        stale, stats, found = [], {}, set()
+        for path in paths:
+            relative = os.path.relpath(path, root)
+            found.add(relative)
+            stat = os.stat(path)
+            fingerprint = self.files.get(relative)
+            if fingerprint is None or fingerprint[:2] != [stat.st_size, stat.st_mtime_ns]:
+                stale.append(path)
+                stats[path] = [stat.st_size, stat.st_mtime_ns]
+        self.removed = sorted(set(self.files) - found)
+        for relative in self.removed:
+            del self.files[relative]
+        return stale, stats
+
+    def changed(self, path, root, digest):
+        """whether the content of a file that was read changed since it was recorded (True for a new file)"""
+        fingerprint = self.files.get(os.path.relpath(path, root))
+        return fingerprint is None or fingerprint[2] != digest
+
+    def record(self, path, root, stat, digest):
+        """
+        record the fingerprint of a file whose content is in the Dataset
+
+        Returns
+        -------
+            nothing
+        """
+        self.files[os.path.relpath(path, root)] = stat + [digest]
+
+
+def material_id_of(path, root):
+    """the default material_id of a spectrum file: its path relative to root without the suffix"""
+    relative = os.path.splitext(os.path.relpath(path, root))[0]
+    return relative.replace(os.sep, "/")
+
+
+def ingest_directory(
+    root,
+    dataset=None,
+    suffixes=SPECTRUM_SUFFIXES,
+    material_id=None,
+    y="intensity",
+    x="q",
+    policy="upsert",
+    processes=None,
+    chunk_size=256,
+    errors="raise",
+    manifest=None,
+    save=None,
+):
+    """
+    read every spectrum file under a directory, in parallel, and merge them into a Dataset in bulk
+
+    with a manifest only the files that are new or changed since the last ingest are parsed and
+    merged. a file is recorded in the manifest once its spectrum is in the Dataset, so files left
+    out by policy="skip" are read again by the next ingest. the manifest is written after the
+    merge, and after saving the Dataset to save when it is given: without save the Dataset must be
+    saved before the manifest is used again, or the files merged since its last save are skipped.
+    without a Dataset the manifest only selects the files to read and is not written.
+
+    Parameters
+    ----------
+    root: str
+        the top directory
+    dataset: Dataset or None
+        the Dataset to merge the spectra into, with a single Dataset.merge_arrays. the spectra are
+        only returned when None.
+    suffixes: sequence of str
+        the file name suffixes of spectrum files
+    material_id: callable or None
+        material_id(path) gives the material_id of the spectrum in a file, the path relative to
+        root without its suffix when None
+    y: str
+        the attribute to hold the intensities (the second column) of each spectrum
+    x: str
+        the attribute to hold the x-grid (the first column) of each spectrum
+    policy: str
+        what to do with a material_id that is not in the Dataset, as for Dataset.merge_arrays
+    processes: int or None
+        the number of worker processes, as for read_spectra
+    chunk_size: int
+        the number of files read by a worker at a time
+    errors: str
+        "raise" or "skip" files that cannot be read, as for read_spectra
+    manifest: str or Manifest or None
+        the manifest (or the path of its file) of the previous ingest of root. the files it lists
+        that are gone are left in the Dataset and listed in its removed attribute.
+    save: str or None
+        the directory to save dataset to with Dataset.save once the spectra are merged, before the
+        manifest is written
+
+    Returns
+    -------
+        the Spectra read, those of new or changed files only when there is a manifest
+    """
+    if isinstance(manifest, str):
+        manifest = Manifest(manifest)
+    paths = find_spectra(root, suffixes)
+    if manifest is not None:
+        paths, stats = manifest.stale(paths, root)
+    ids = [material_id(path) if material_id is not None else material_id_of(path, root) for path in paths]
+    spectra, digests, failed = _read_all(paths, ids, processes, chunk_size, errors)
+    read = [i for i, path in enumerate(paths) if path not in failed]
+    keep = read
+    if manifest is not None:
+        keep = [i for i in read if manifest.changed(paths[i], root, digests[i])]
+    if len(keep) < len(paths):
+        spectra = spectra.take(keep)
+    missing = set()
+    if dataset is not None:
+        missing = set(spectra.merge_into(dataset, y=y, x=x, policy=policy).missing.tolist())
+        if save is not None:
+            dataset.save(save)
+    if manifest is not None and dataset is not None:
+        for i in read:
+            if ids[i] not in missing:
+                manifest.record(paths[i], root, stats[paths[i]], digests[i])
+        manifest.save()
+    return spectra
@@ -0,0 +1,171 @@
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+Batch = namedtuple("Batch", ["rows", "material_ids", "X", "y", "missing", "y_missing", "spectra", "lengths"])
+Batch.__doc__ = """
+one mini-batch from a BatchLoader
+
+rows are the row numbers of the materials in the batch and material_ids their ids. X, y, missing
+and y_missing are as in Dataset.to_arrays (None when the loader has no features or target).
+spectra is the (batch_size, longest) array of the ragged spectra of the batch padded at the end,
+and lengths the number of points of each, zero for materials without a spectrum (both None when
+the loader has no spectra).
+"""
+
+
+class BatchLoader:
+    """
+    mini-batches of the materials of a Dataset, assembled in background threads
+
+    iterating over the loader runs one epoch: the rows are (re)shuffled, cut into batches and the
+    next prefetch batches are assembled by a thread pool while the current one is being consumed.
+    assembling a batch only touches the rows in it, so a whole epoch is never held in memory. the
+    Dataset must not be merged into while an epoch is running.
+
+    Parameters
+    ----------
+    dataset: Dataset
+        the materials
+    features: sequence of str
+        the numeric attributes returned as the X of every batch
+    target: str or None
+        the numeric attribute returned as the y of every batch
+    spectra: str or None
+        an attribute holding a ragged array (e.g. the intensities of a spectrum) per material,
+        returned padded to the longest one in the batch
+    batch_size: int
+        the number of materials in a batch
+    shuffle: bool
+        whether to visit the rows in a new random order every epoch
+    seed: int or None
+        the seed of the shuffling
+    drop_last: bool
+        whether to drop the last batch of an epoch when it is smaller than batch_size
+    bucket_size: int or None
+        when given, every bucket_size consecutive batches' worth of (shuffled) rows are sorted by
+        the length of their spectra before being cut into batches, so that the spectra of a batch
+        have similar lengths and need little padding. the order of the batches is then shuffled.
+    pad_value: float
+        the value the spectra are padded with
+    dtype: numpy.dtype or None
+        the float dtype of the arrays, as for Dataset.to_arrays. padded spectra are float64 when None
+    rows: array_like or None
+        the row numbers to draw batches from (e.g. a training split), all rows when None
+    prefetch: int
+        the number of batches assembled ahead of the one being consumed, 0 to assemble every batch
+        in the iterating thread
+    workers: int
+        the number of threads assembling batches
+    """
+
+    def __init__(
+        self,
+        dataset,
+        features=(),
+        target=None,
+        spectra=None,
+        batch_size=256,
+        shuffle=False,
+        seed=None,
+        drop_last=False,
+        bucket_size=None,
+        pad_value=0.0,
+        dtype=None,
+        rows=None,
+        prefetch=2,
+        workers=2,
+    ):
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be at least 1, not {batch_size}")
+        if bucket_size is not None and spectra is None:
+            raise ValueError("bucket_size needs spectra to bucket by")
+        self.dataset = dataset
+        self.features = list(features)
+        self.target = target
+        self.spectra = spectra
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.bucket_size = bucket_size
+        self.pad_value = pad_value
+        self.dtype = dtype
+        self.rows = np.arange(len(dataset)) if rows is None else np.asarray(rows, dtype=np.intp)
+        self.prefetch = prefetch
+        self.workers = workers
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        """the number of batches in an epoch"""
+        if self.drop_last:
+            return len(self.rows) // self.batch_size
+        return -(-len(self.rows) // self.batch_size)
+
+    def _order(self, lengths):
+        """the rows of every batch of one epoch"""
+        order = self.rows
+        if not len(order):
+            return []
+        if self.shuffle:
+            order = order[self._rng.permutation(len(order))]
+        if self.bucket_size is not None:
+            chunk = self.bucket_size * self.batch_size
+            order = np.concatenate(
+                [
+                    part[np.argsort(lengths[part], kind="stable")]
+                    for part in np.split(order, range(chunk, len(order), chunk))
+                ]
+            )
+        batches = np.split(order, range(self.batch_size, len(order), self.batch_size))
+        if self.drop_last and len(batches[-1]) < self.batch_size:
+            batches.pop()
+        if self.bucket_size is not None and self.shuffle:
+            batches = [batches[i] for i in self._rng.permutation(len(batches))]
+        return batches
+
+    def _assemble(self, rows, spectra, lengths):
+        X = y = missing = y_missing = padded = batch_lengths = None
+        if self.features or self.target is not None:
+            X, y, _, missing, y_missing = self.dataset.to_arrays(
+                self.features, target=self.target, rows=rows, dtype=self.dtype
+            )
+        if spectra is not None:
+            batch_lengths = lengths[rows]
+            padded = np.full(
+                (len(rows), batch_lengths.max(initial=0)), self.pad_value, dtype=self.dtype or np.float64
+            )
+            for i, row in enumerate(rows):
+                padded[i, : batch_lengths[i]] = spectra[row]
+        return Batch(rows, self.dataset.material_ids[rows], X, y, missing, y_missing, padded, batch_lengths)
+
+    def __iter__(self):
+        spectra = lengths = None
+        if self.spectra is not None:
+            spectra, present = self.dataset.column(self.spectra)
+            lengths = np.zeros(len(spectra), dtype=np.int64)
+            lengths[present] = [len(spectrum) for spectrum in spectra[present]]
+        batches = self._order(lengths)
+        if not self.prefetch:
+            for rows in batches:
+                yield self._assemble(rows, spectra, lengths)
+            return
+        # reading a sparse column first merges the values buffered on it into its arrays, which is not
+        # safe in several threads at once, so every column the workers read is flushed here
+        schema = self.dataset.schema
+        for name in self.features + [self.target]:
+            if name in schema:
+                self.dataset.column(name, rows=np.zeros(0, dtype=np.intp))
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as pool:
+            try:
+                for rows in batches:
+                    pending.append(pool.submit(self._assemble, rows, spectra, lengths))
+                    if len(pending) > self.prefetch:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                # stop early without waiting for batches that will never be consumed
+                for future in pending:
+                    future.cancel()
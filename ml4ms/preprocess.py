@@ -0,0 +1,243 @@
+import numpy as np
+
+from ml4ms.spectra import Spectra
+
+NORMALIZE_METHODS = ("max", "area")
+
+
+def _writable(spectra):
+    """spectra whose intensities can be changed in place, copying them only when they cannot be"""
+    y = spectra.y
+    if y.dtype.kind != "f" or not y.flags.writeable or isinstance(y, np.memmap):
+        spectra = Spectra(spectra.material_ids, np.array(y, dtype=np.float64), spectra.offsets, x=spectra.x)
+    return spectra
+
+
+def _x(spectra):
+    """the x values of spectra, the point index within each spectrum when they have no x-grids"""
+    if spectra.x is not None:
+        return np.asarray(spectra.x, dtype=np.float64)
+    return np.arange(len(spectra.y), dtype=np.float64) - spectra.broadcast(spectra.offsets[:-1])
+
+
+def _same_spectrum(segments, shift):
+    """for every point, whether the point shift places further along is in the same spectrum"""
+    same = np.zeros(len(segments), dtype=bool)
+    if shift < len(segments):
+        same[: len(segments) - shift] = segments[shift:] == segments[:-shift]
+    return same
+
+
+class Normalize:
+    """
+    scale every spectrum so that its maximum, or its area, is one
+
+    spectra whose maximum or area is zero are left as they are.
+
+    Parameters
+    ----------
+    method: str
+        "max" or "area". the area is integrated with the trapezoid rule over the x-grid, or over
+        unit spacing for spectra without x-grids.
+    """
+
+    def __init__(self, method="max"):
+        if method not in NORMALIZE_METHODS:
+            raise ValueError(f"method must be one of {NORMALIZE_METHODS}, not {method!r}")
+        self.method = method
+
+    def __call__(self, spectra):
+        spectra = _writable(spectra)
+        if self.method == "max":
+            scale = spectra.max()
+        else:
+            x = _x(spectra)
+            # the trapezoid between every point and the next, zero where the next point starts
+            # another spectrum
+            trapezoids = np.zeros_like(spectra.y)
+            trapezoids[:-1] = np.diff(x) * (spectra.y[1:] + spectra.y[:-1]) / 2
+            trapezoids[~_same_spectrum(spectra.segment_ids, 1)] = 0.0
+            scale = spectra.reduce(np.add, values=trapezoids, empty=0.0)
+        scale[(scale == 0) | ~np.isfinite(scale)] = 1.0
+        spectra.y /= spectra.broadcast(scale)
+        return spectra
+
+
+class Crop:
+    """
+    keep only the points of every spectrum whose x lies in [xmin, xmax]
+
+    Parameters
+    ----------
+    xmin: float or None
+        the lowest x kept, no lower limit when None
+    xmax: float or None
+        the highest x kept, no upper limit when None
+    """
+
+    def __init__(self, xmin=None, xmax=None):
+        self.xmin = xmin
+        self.xmax = xmax
+
+    def __call__(self, spectra):
+        x = _x(spectra)
+        keep = np.ones(len(x), dtype=bool)
+        if self.xmin is not None:
+            keep &= x >= self.xmin
+        if self.xmax is not None:
+            keep &= x <= self.xmax
+        if keep.all():
+            return spectra
+        lengths = np.bincount(spectra.segment_ids[keep], minlength=len(spectra))
+        offsets = np.zeros(len(spectra) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        cropped_x = None if spectra.x is None else spectra.x[keep]
+        return Spectra(spectra.material_ids, spectra.y[keep], offsets, x=cropped_x)
+
+
+class PolynomialBaseline:
+    """
+    subtract from every spectrum the least-squares polynomial fit to it
+
+    the fits of whole chunks of spectra are solved together: the normal equations of every
+    spectrum are accumulated with one reduceat per power of x, building the powers one at a time,
+    and solved as a stack. the polynomials are evaluated with Horner's rule, so the temporary
+    memory is a few arrays the size of a chunk however high the degree and however many spectra
+    there are.
+
+    Parameters
+    ----------
+    degree: int
+        the degree of the polynomial
+    chunk_size: int
+        the number of spectra fitted at a time
+    """
+
+    def __init__(self, degree=2, chunk_size=1024):
+        if degree < 0:
+            raise ValueError(f"degree must not be negative, not {degree}")
+        if chunk_size < 1:
+            raise ValueError(f"chunk_size must be at least 1, not {chunk_size}")
+        self.degree = degree
+        self.chunk_size = chunk_size
+
+    def _chunks(self, spectra):
+        """(low, high, baseline) of every chunk of spectra, low:high being its points in y"""
+        for first in range(0, len(spectra), self.chunk_size):
+            last = min(first + self.chunk_size, len(spectra))
+            low, high = spectra.offsets[first], spectra.offsets[last]
+            x = None if spectra.x is None else spectra.x[low:high]
+            chunk = Spectra(
+                spectra.material_ids[first:last], spectra.y[low:high], spectra.offsets[first : last + 1] - low, x=x
+            )
+            yield low, high, self._fit(chunk)
+
+    def _fit(self, spectra):
+        x = _x(spectra)
+        y = np.asarray(spectra.y, dtype=np.float64)
+        # scale x to [-1, 1] in every spectrum to keep the normal equations well conditioned
+        low = spectra.reduce(np.minimum, values=x, empty=0.0)
+        high = spectra.reduce(np.maximum, values=x, empty=0.0)
+        t = spectra.broadcast((high + low) / 2)
+        np.subtract(x, t, out=t)
+        t /= spectra.broadcast(np.where(high > low, (high - low) / 2, 1.0))
+        power = np.ones_like(t)
+        moments = [spectra.reduce(np.add, values=power, empty=0.0)]
+        rhs = [spectra.reduce(np.add, values=y, empty=0.0)]
+        for k in range(1, 2 * self.degree + 1):
+            power *= t
+            moments.append(spectra.reduce(np.add, values=power, empty=0.0))
+            if k <= self.degree:
+                rhs.append(spectra.reduce(np.add, values=power * y, empty=0.0))
+        del power
+        moments, rhs = np.stack(moments, axis=-1), np.stack(rhs, axis=-1)
+        index = np.arange(self.degree + 1)
+        normal = moments[:, index[:, None] + index[None, :]]
+        coefficients = np.einsum("sij,sj->si", np.linalg.pinv(normal), rhs)
+        baseline = spectra.broadcast(coefficients[:, self.degree])
+        for k in range(self.degree - 1, -1, -1):
+            baseline *= t
+            baseline += spectra.broadcast(coefficients[:, k])
+        return baseline
+
+    def baseline(self, spectra):
+        """the fitted polynomial evaluated at every point, in the layout of spectra.y"""
+        baseline = np.empty(len(spectra.y), dtype=np.float64)
+        for low, high, chunk in self._chunks(spectra):
+            baseline[low:high] = chunk
+        return baseline
+
+    def __call__(self, spectra):
+        spectra = _writable(spectra)
+        for low, high, chunk in self._chunks(spectra):
+            spectra.y[low:high] -= chunk
+        return spectra
+
+
+class RollingMinimumBaseline:
+    """
+    subtract from every spectrum its minimum over a sliding window of points
+
+    the window never reaches across into a neighbouring spectrum. the work grows with the window
+    size but the extra memory does not.
+
+    Parameters
+    ----------
+    window: int
+        the number of points in the window, centered on each point
+    """
+
+    def __init__(self, window=51):
+        if window < 1:
+            raise ValueError(f"window must be at least 1, not {window}")
+        self.window = window
+
+    def baseline(self, spectra):
+        """the rolling minimum at every point, in the layout of spectra.y"""
+        y = spectra.y
+        segments = spectra.segment_ids
+        baseline = np.array(y, dtype=np.float64)
+        for shift in range(1, self.window // 2 + 1):
+            n = len(y) - shift
+            if n <= 0:
+                break
+            same = _same_spectrum(segments, shift)
+            # the point shift places ahead, and the one shift places behind, where they are in
+            # the same spectrum
+            np.minimum(baseline[:n], y[shift:], out=baseline[:n], where=same[:n])
+            np.minimum(baseline[shift:], y[:n], out=baseline[shift:], where=same[:n])
+        return baseline
+
+    def __call__(self, spectra):
+        spectra = _writable(spectra)
+        spectra.y -= self.baseline(spectra)
+        return spectra
+
+
+class Pipeline:
+    """
+    preprocessing stages applied one after another to a whole collection of spectra
+
+    every stage is a callable taking a Spectra and returning one, and works on the flat arrays of
+    the whole collection at once. stages change the intensities in place where they can (a
+    read-only or integer collection is copied once, by the first stage that changes it), and Crop
+    returns the smaller collection. a Pipeline is itself a stage, so pipelines compose.
+
+    Parameters
+    ----------
+    stages: sequence
+        the stages, in the order they are applied
+
+    Examples
+    --------
+    >>> pipeline = Pipeline([Crop(1.0, 25.0), RollingMinimumBaseline(31), Normalize("max")])
+    >>> processed = pipeline(Spectra.from_dataset(dataset, y="intensity", x="q"))
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+
+    def __call__(self, spectra):
+        for stage in self.stages:
+            spectra = stage(spectra)
+        return spectra
@@ -0,0 +1,742 @@
+import re
+
+import numpy as np
+
+from ml4ms.ids import ROW_DTYPE
+from ml4ms.schema import CATEGORY, NUMERIC_KINDS
+
+INDEX_KINDS = ("sorted", "hash", "elements")
+
+_NO_ROWS = np.zeros(0, dtype=ROW_DTYPE)
+_SYMBOL = re.compile(r"[A-Z][a-z]?")
+# the number of bits set in every byte
+_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.int64)
+
+
+def _intersect(rows, hits):
+    """the sorted rows that are also in the sorted hits"""
+    if rows is None:
+        return hits
+    return rows[np.isin(rows, hits, assume_unique=True)] if len(rows) < len(hits) else np.intersect1d(rows, hits)
+
+
+class SortedIndex:
+    """
+    the rows that have a numeric attribute, sorted by its value, for range lookups by bisection
+
+    rows whose value is nan are left out, as no range holds them.
+
+    Parameters
+    ----------
+    dataset: Dataset
+        the materials
+    name: str
+        the attribute
+    """
+
+    kind = "sorted"
+
+    def __init__(self, dataset, name):
+        values, present = dataset.column(name)
+        if values.dtype.kind == "f":
+            # nan is in no range, and would sort after every value
+            present = present & ~np.isnan(values)
+        rows = np.flatnonzero(present).astype(ROW_DTYPE)
+        values = values[rows]
+        order = np.argsort(values, kind="stable")
+        self.values = values[order]
+        self.rows = rows[order]
+
+    def _bounds(self, low, high, low_inclusive=True, high_inclusive=True):
+        start = 0 if low is None else np.searchsorted(self.values, low, side="left" if low_inclusive else "right")
+        stop = (
+            len(self.values)
+            if high is None
+            else np.searchsorted(self.values, high, side="right" if high_inclusive else "left")
+        )
+        return start, max(start, stop)
+
+    def count(self, low, high, low_inclusive=True, high_inclusive=True):
+        """the number of rows whose value lies between low and high"""
+        start, stop = self._bounds(low, high, low_inclusive, high_inclusive)
+        return stop - start
+
+    def lookup(self, low, high, low_inclusive=True, high_inclusive=True):
+        """the sorted rows whose value lies between low and high, without a limit where one is None"""
+        start, stop = self._bounds(low, high, low_inclusive, high_inclusive)
+        return np.sort(self.rows[start:stop])
+
+
+class HashIndex:
+    """
+    the rows that have every value of an attribute, for equality lookups
+
+    the rows are grouped by value in one array, with a {value: group} dict. categorical attributes
+    are grouped by their codes, other attributes must have hashable values.
+
+    Parameters
+    ----------
+    dataset: Dataset
+        the materials
+    name: str
+        the attribute
+    """
+
+    kind = "hash"
+
+    def __init__(self, dataset, name):
+        values, present = dataset.column(name)
+        if values.dtype.kind == "f":
+            # nan != nan, so no lookup can ever find a nan, and every nan would be a key of its own
+            present = present & ~np.isnan(values)
+        rows = np.flatnonzero(present).astype(ROW_DTYPE)
+        categories = dataset.categories(name)
+        if categories is not None:
+            self.keys = {category: code for code, category in enumerate(categories)}
+            keys = values[rows].astype(np.int64)
+        else:
+            self.keys = {}
+            keys = np.array([self.keys.setdefault(value, len(self.keys)) for value in values[rows].tolist()])
+            keys = keys.astype(np.int64)
+        order = np.argsort(keys, kind="stable")
+        self.rows = rows[order]
+        self.offsets = np.zeros(len(self.keys) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys, minlength=len(self.keys)), out=self.offsets[1:])
+
+    def count(self, value):
+        """the number of rows with value"""
+        key = self.keys.get(value)
+        return 0 if key is None else int(self.offsets[key + 1] - self.offsets[key])
+
+    def lookup(self, value):
+        """the sorted rows with value"""
+        key = self.keys.get(value)
+        if key is None:
+            return _NO_ROWS
+        return self.rows[self.offsets[key] : self.offsets[key + 1]]
+
+
+def elements_of(composition):
+    """
+    the element symbols of a composition
+
+    Parameters
+    ----------
+    composition: str or iterable
+        a formula such as "LiFePO4", a collection of symbols or a {symbol: amount} dict
+
+    Returns
+    -------
+        the set of symbols
+    """
+    if isinstance(composition, str):
+        return set(_SYMBOL.findall(composition))
+    return {str(symbol) for symbol in composition}
+
+
+class ElementIndex:
+    """
+    a bitmap of the rows whose composition holds every element, for chemical system lookups
+
+    the bitmaps of all elements are the rows of one uint8 array, bit row % 8 of byte row // 8
+    standing for row. update re-reads the compositions of just the rows a merge touched, so the
+    index follows merges without being rebuilt.
+
+    Parameters
+    ----------
+    dataset: Dataset
+        the materials
+    name: str
+        the attribute holding the composition of every material, as for elements_of
+    """
+
+    kind = "elements"
+
+    def __init__(self, dataset, name):
+        self.name = name
+        self._clear()
+        self.update(dataset, np.arange(len(dataset), dtype=ROW_DTYPE))
+
+    def _clear(self):
+        self.symbols = {}
+        # {composition: the numbers of its symbols} of every composition string parsed so far
+        self._parsed = {}
+        self.bitmaps = np.zeros((0, 0), dtype=np.uint8)
+        self.present = np.zeros(0, dtype=np.uint8)
+        self._n = 0
+
+    def _grow(self, n_rows, n_symbols):
+        n_bytes = max(-(-n_rows // 8), self.bitmaps.shape[1])
+        if n_bytes > self.bitmaps.shape[1]:
+            n_bytes = max(n_bytes, 2 * self.bitmaps.shape[1])
+        if n_bytes > self.bitmaps.shape[1] or n_symbols > len(self.bitmaps):
+            bitmaps = np.zeros((max(n_symbols, len(self.bitmaps)), n_bytes), dtype=np.uint8)
+            bitmaps[: len(self.bitmaps), : self.bitmaps.shape[1]] = self.bitmaps
+            self.bitmaps = bitmaps
+            present = np.zeros(n_bytes, dtype=np.uint8)
+            present[: len(self.present)] = self.present
+            self.present = present
+
+    def update(self, dataset, rows):
+        """
+        re-read the compositions of rows
+
+        Parameters
+        ----------
+        dataset: Dataset
+            the materials
+        rows: numpy.ndarray
+            the rows whose composition may have changed or been added
+
+        Returns
+        -------
+            nothing
+        """
+        if len(dataset) < self._n:
+            # the materials were replaced by fewer ones
+            self._clear()
+            rows = np.arange(len(dataset))
+        self._n = len(dataset)
+        self._grow(self._n, len(self.symbols))
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows):
+            return
+        # clear the rows from every bitmap
+        keep = np.full(len(self.present), 0xFF, dtype=np.uint8)
+        np.bitwise_and.at(keep, rows >> 3, (0xFF ^ (1 << (rows & 7))).astype(np.uint8))
+        touched = np.unique(rows >> 3)
+        self.bitmaps[:, touched] &= keep[touched]
+        self.present[touched] &= keep[touched]
+        if self.name not in dataset.schema:
+            return
+        values, present = dataset.column(self.name, rows)
+        rows, values = rows[present], values[present]
+        categories = dataset.categories(self.name)
+        # only the distinct categories of the rows are looked up, and a composition string is only
+        # ever parsed once
+        if categories is not None:
+            codes, keys = np.unique(values.astype(np.int64), return_inverse=True)
+            compositions = [self._symbol_numbers(categories[code]) for code in codes.tolist()]
+            keys = keys.reshape(-1)
+        else:
+            compositions = [self._symbol_numbers(composition) for composition in values.tolist()]
+            keys = np.arange(len(rows))
+        self._grow(self._n, len(self.symbols))
+        sizes = np.array([len(composition) for composition in compositions], dtype=np.int64)
+        starts = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=starts[1:])
+        flat = np.concatenate(compositions + [np.zeros(0, dtype=np.int64)])
+        # the (symbol, row) pair of every element of every row
+        counts = sizes[keys]
+        element_rows = np.repeat(rows, counts)
+        within = np.arange(len(element_rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        symbols = flat[np.repeat(starts[keys], counts) + within]
+        np.bitwise_or.at(self.bitmaps, (symbols, element_rows >> 3), (1 << (element_rows & 7)).astype(np.uint8))
+        np.bitwise_or.at(self.present, rows >> 3, (1 << (rows & 7)).astype(np.uint8))
+
+    def _symbol_numbers(self, composition):
+        """the numbers of the symbols of composition, numbering new symbols"""
+        cacheable = isinstance(composition, str)
+        numbers = self._parsed.get(composition) if cacheable else None
+        if numbers is None:
+            numbers = np.array(
+                [self.symbols.setdefault(symbol, len(self.symbols)) for symbol in elements_of(composition)],
+                dtype=np.int64,
+            )
+            if cacheable:
+                self._parsed[composition] = numbers
+        return numbers
+
+    def bitmap(self, include=(), exclude=(), exact=False):
+        """
+        the bitmap of the rows whose composition holds every one of include and none of exclude
+
+        Parameters
+        ----------
+        include: iterable of str
+            the elements that must be present
+        exclude: iterable of str
+            the elements that must be absent
+        exact: bool
+            whether every element outside include must be absent, i.e. the composition is exactly
+            the chemical system of include
+
+        Returns
+        -------
+            a uint8 bitmap, as self.present
+        """
+        bits = self.present.copy()
+        include = set(include)
+        for symbol in include:
+            if symbol not in self.symbols:
+                return np.zeros_like(bits)
+            bits &= self.bitmaps[self.symbols[symbol]]
+        if exact:
+            exclude = set(self.symbols) - include
+        absent = [self.symbols[symbol] for symbol in exclude if symbol in self.symbols]
+        if absent:
+            bits &= ~np.bitwise_or.reduce(self.bitmaps[absent], axis=0)
+        return bits
+
+    def count(self, include=(), exclude=(), exact=False):
+        """the number of rows matching, as for bitmap"""
+        return int(_POPCOUNT[self.bitmap(include, exclude, exact)].sum())
+
+    def lookup(self, include=(), exclude=(), exact=False):
+        """the sorted rows matching, as for bitmap"""
+        bits = np.unpackbits(self.bitmap(include, exclude, exact), bitorder="little")[: self._n]
+        return np.flatnonzero(bits).astype(ROW_DTYPE)
+
+
+class Predicate:
+    """
+    a condition on the attributes of a material, combined with &, | and ~
+
+    select(engine, rows) returns the sorted rows, out of rows (all rows when None), that satisfy the
+    condition, and estimate(engine) a cheap upper bound of how many rows of the whole Dataset do.
+    """
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    def estimate(self, engine):
+        return len(engine.dataset)
+
+    def plan(self, engine, depth=0):
+        return ["  " * depth + f"scan {self!r}"]
+
+
+class _Leaf(Predicate):
+    """a predicate on a single attribute, evaluated through an index of it or by a scan"""
+
+    index_kinds = ()
+
+    def __init__(self, name):
+        self.name = name
+
+    def _index(self, engine):
+        index = engine.index(self.name)
+        return index if index is not None and index.kind in self.index_kinds else None
+
+    def estimate(self, engine):
+        index = self._index(engine)
+        return len(engine.dataset) if index is None else self._count(index)
+
+    def _use_index(self, engine, rows):
+        """the index to select with, None to scan rows instead when there are fewer of them than hits"""
+        index = self._index(engine)
+        if index is None or (rows is not None and len(rows) < self._count(index)):
+            return None
+        return index
+
+    def select(self, engine, rows):
+        index = self._use_index(engine, rows)
+        if index is not None:
+            return _intersect(rows, self._lookup(index))
+        if self.name not in engine.dataset.schema:
+            return _NO_ROWS
+        values, present = engine.dataset.column(self.name)
+        rows = np.flatnonzero(present).astype(ROW_DTYPE) if rows is None else rows[present[rows]]
+        return rows[self._test(values[rows], engine.dataset.categories(self.name))]
+
+    def plan(self, engine, depth=0):
+        index = self._index(engine)
+        how = "scan" if index is None else f"{index.kind} index, ~{self.estimate(engine)} rows"
+        return ["  " * depth + f"{how}: {self!r}"]
+
+    def _test(self, values, categories):
+        """whether each of values (codes into categories for a categorical attribute) satisfies self"""
+        raise NotImplementedError
+
+
+def _decoded(values, categories):
+    return values if categories is None else np.asarray(categories, dtype=object)[values]
+
+
+class Range(_Leaf):
+    """low <= attribute <= high, either limit missing when None and strict when not inclusive"""
+
+    index_kinds = ("sorted",)
+
+    def __init__(self, name, low=None, high=None, low_inclusive=True, high_inclusive=True):
+        super().__init__(name)
+        self.low, self.high = low, high
+        self.low_inclusive, self.high_inclusive = low_inclusive, high_inclusive
+
+    def __repr__(self):
+        low = "" if self.low is None else f"{self.low!r} {'<=' if self.low_inclusive else '<'} "
+        high = "" if self.high is None else f" {'<=' if self.high_inclusive else '<'} {self.high!r}"
+        return f"{low}{self.name}{high}"
+
+    def _count(self, index):
+        return index.count(self.low, self.high, self.low_inclusive, self.high_inclusive)
+
+    def _lookup(self, index):
+        return index.lookup(self.low, self.high, self.low_inclusive, self.high_inclusive)
+
+    def _test(self, values, categories):
+        values = _decoded(values, categories)
+        keep = np.ones(len(values), dtype=bool)
+        if self.low is not None:
+            keep &= values >= self.low if self.low_inclusive else values > self.low
+        if self.high is not None:
+            keep &= values <= self.high if self.high_inclusive else values < self.high
+        return keep
+
+
+class In(_Leaf):
+    """attribute equal to one of values"""
+
+    index_kinds = ("hash", "sorted")
+
+    def __init__(self, name, values):
+        super().__init__(name)
+        self.values = list(values)
+
+    def __repr__(self):
+        if len(self.values) == 1:
+            return f"{self.name} == {self.values[0]!r}"
+        return f"{self.name} in {self.values!r}"
+
+    def _count(self, index):
+        if index.kind == "hash":
+            return sum(index.count(value) for value in self.values)
+        return sum(index.count(value, value) for value in self.values)
+
+    def _lookup(self, index):
+        if index.kind == "hash":
+            hits = [index.lookup(value) for value in self.values]
+        else:
+            hits = [index.lookup(value, value) for value in self.values]
+        return hits[0] if len(hits) == 1 else np.unique(np.concatenate(hits + [_NO_ROWS]))
+
+    def _test(self, values, categories):
+        if categories is not None:
+            codes = {category: code for code, category in enumerate(categories)}
+            wanted = [codes[value] for value in self.values if value in codes]
+            return np.isin(values, np.array(wanted, dtype=values.dtype))
+        if values.dtype == object:
+            wanted = self.values
+            return np.fromiter((value in wanted for value in values.tolist()), dtype=bool, count=len(values))
+        return np.isin(values, self.values)
+
+
+class Contains(_Leaf):
+    """attribute, a collection such as a list of elements, containing item"""
+
+    def __init__(self, name, item):
+        super().__init__(name)
+        self.item = item
+
+    def __repr__(self):
+        return f"{self.item!r} in {self.name}"
+
+    def _test(self, values, categories):
+        values = _decoded(values, categories)
+        return np.fromiter((self.item in value for value in values.tolist()), dtype=bool, count=len(values))
+
+
+class Elements(_Leaf):
+    """
+    attribute, a composition as for elements_of, holding every one of include and none of exclude
+
+    with exact, the composition must hold exactly the elements of include.
+    """
+
+    index_kinds = ("elements",)
+
+    def __init__(self, name, include=(), exclude=(), exact=False):
+        super().__init__(name)
+        self.include = sorted(set(include))
+        self.exclude = sorted(set(exclude))
+        self.exact = exact
+
+    def __repr__(self):
+        if self.exact:
+            return f"{self.name} is {'-'.join(self.include)}"
+        excluded = f" and none of {self.exclude}" if self.exclude else ""
+        return f"{self.name} has {self.include}{excluded}"
+
+    def _count(self, index):
+        return index.count(self.include, self.exclude, self.exact)
+
+    def _lookup(self, index):
+        return index.lookup(self.include, self.exclude, self.exact)
+
+    def _test(self, values, categories):
+        include, exclude = set(self.include), set(self.exclude)
+        parsed = None if categories is None else [elements_of(category) for category in categories]
+        keep = np.empty(len(values), dtype=bool)
+        for i, value in enumerate(values.tolist()):
+            elements = elements_of(value) if parsed is None else parsed[value]
+            keep[i] = elements == include if self.exact else include <= elements and not exclude & elements
+        return keep
+
+
+class Has(_Leaf):
+    """the material has a value for attribute"""
+
+    def __repr__(self):
+        return f"has {self.name}"
+
+    def _test(self, values, categories):
+        return np.ones(len(values), dtype=bool)
+
+
+class And(Predicate):
+    """
+    every one of predicates
+
+    the most selective predicate (by estimate) is selected first over every row and each following
+    one only over the rows that are left, scanning them rather than looking up an index when there
+    are fewer of them than the index would return.
+    """
+
+    def __init__(self, *predicates):
+        self.predicates = [
+            p
+            for predicate in predicates
+            for p in (predicate.predicates if isinstance(predicate, And) else [predicate])
+        ]
+
+    def __repr__(self):
+        return "(" + " & ".join(map(repr, self.predicates)) + ")"
+
+    def _ordered(self, engine):
+        return sorted(self.predicates, key=lambda predicate: predicate.estimate(engine))
+
+    def estimate(self, engine):
+        return min(predicate.estimate(engine) for predicate in self.predicates)
+
+    def select(self, engine, rows):
+        for predicate in self._ordered(engine):
+            rows = predicate.select(engine, rows)
+            if not len(rows):
+                break
+        return rows
+
+    def plan(self, engine, depth=0):
+        lines = ["  " * depth + "and, most selective first:"]
+        for predicate in self._ordered(engine):
+            lines.extend(predicate.plan(engine, depth + 1))
+        return lines
+
+
+class Or(Predicate):
+    """any one of predicates"""
+
+    def __init__(self, *predicates):
+        self.predicates = [
+            p
+            for predicate in predicates
+            for p in (predicate.predicates if isinstance(predicate, Or) else [predicate])
+        ]
+
+    def __repr__(self):
+        return "(" + " | ".join(map(repr, self.predicates)) + ")"
+
+    def estimate(self, engine):
+        return min(len(engine.dataset), sum(predicate.estimate(engine) for predicate in self.predicates))
+
+    def select(self, engine, rows):
+        hits = [predicate.select(engine, rows) for predicate in self.predicates]
+        return np.unique(np.concatenate(hits + [_NO_ROWS])).astype(ROW_DTYPE)
+
+    def plan(self, engine, depth=0):
+        lines = ["  " * depth + "or:"]
+        for predicate in self.predicates:
+            lines.extend(predicate.plan(engine, depth + 1))
+        return lines
+
+
+class Not(Predicate):
+    """not predicate"""
+
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    def __repr__(self):
+        return f"~{self.predicate!r}"
+
+    def select(self, engine, rows):
+        if rows is None:
+            rows = np.arange(len(engine.dataset), dtype=ROW_DTYPE)
+        return np.setdiff1d(rows, self.predicate.select(engine, rows), assume_unique=True)
+
+    def plan(self, engine, depth=0):
+        return ["  " * depth + "not:"] + self.predicate.plan(engine, depth + 1)
+
+
+class Field:
+    """
+    an attribute to build predicates on, e.g. (Field("band_gap") >= 1) & Field("elements").contains("Li")
+
+    Parameters
+    ----------
+    name: str
+        the attribute
+    """
+
+    __hash__ = None
+
+    def __init__(self, name):
+        self.name = name
+
+    def __eq__(self, value):
+        return In(self.name, [value])
+
+    def __ne__(self, value):
+        return Has(self.name) & ~In(self.name, [value])
+
+    def __lt__(self, value):
+        return Range(self.name, high=value, high_inclusive=False)
+
+    def __le__(self, value):
+        return Range(self.name, high=value)
+
+    def __gt__(self, value):
+        return Range(self.name, low=value, low_inclusive=False)
+
+    def __ge__(self, value):
+        return Range(self.name, low=value)
+
+    def between(self, low, high):
+        """low <= attribute <= high"""
+        return Range(self.name, low, high)
+
+    def isin(self, values):
+        """attribute equal to one of values"""
+        return In(self.name, values)
+
+    def contains(self, item):
+        """attribute, a collection, containing item"""
+        return Contains(self.name, item)
+
+    def has_elements(self, include, exclude=()):
+        """attribute, a composition, holding every element of include and none of exclude"""
+        return Elements(self.name, include, exclude)
+
+    def chemical_system(self, system):
+        """attribute, a composition, holding exactly the elements of system, "Li-Fe-O" or ["Li", "Fe", "O"]"""
+        return Elements(self.name, system.split("-") if isinstance(system, str) else system, exact=True)
+
+    def exists(self):
+        """the material has a value for attribute"""
+        return Has(self.name)
+
+
+class QueryEngine:
+    """
+    filter the materials of a Dataset by predicates on their attributes, through attribute indexes
+
+    indexes are built on request with create_index. every merge into the Dataset updates the
+    element indexes for the rows it touched and marks the other indexes out of date, to be rebuilt
+    by the next query that needs them. values set directly through Dataset.dataset are not seen
+    until a merge touches them or an explicit refresh.
+
+    Parameters
+    ----------
+    dataset: Dataset
+        the materials
+
+    Examples
+    --------
+    >>> engine = QueryEngine(dataset)
+    >>> engine.create_index("band_gap")
+    >>> engine.create_index("elements", kind="elements")
+    >>> engine.material_ids(Field("band_gap").between(1, 3) & Field("elements").has_elements(["Li"]))
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.indexes = {}
+        self._kinds = {}
+        self._stale = set()
+        dataset.add_merge_listener(self._on_merge)
+
+    def _on_merge(self, dataset, rows):
+        for name in self._kinds:
+            index = self.indexes.get(name)
+            if index is not None and index.kind == "elements":
+                index.update(dataset, rows)
+            else:
+                self._stale.add(name)
+
+    def close(self):
+        """stop following the merges into the Dataset"""
+        self.dataset.remove_merge_listener(self._on_merge)
+
+    def create_index(self, name, kind=None):
+        """
+        index attribute name
+
+        Parameters
+        ----------
+        name: str
+            the attribute
+        kind: str or None
+            "sorted" for range and equality lookups, "hash" for equality lookups only or "elements"
+            for the element lookups of a composition attribute. when None, sorted for numeric
+            attributes and hash for the others.
+
+        Returns
+        -------
+            nothing
+        """
+        if kind is None:
+            kind = "sorted" if self.dataset.schema.get(name) in NUMERIC_KINDS else "hash"
+        if kind not in INDEX_KINDS:
+            raise ValueError(f"kind must be one of {INDEX_KINDS}, not {kind!r}")
+        if kind == "sorted" and self.dataset.schema.get(name) in (CATEGORY, "object"):
+            raise TypeError(f"a sorted index needs a numeric attribute, {name!r} is not")
+        self._kinds[name] = kind
+        self._build(name)
+
+    def _build(self, name):
+        index_class = {"sorted": SortedIndex, "hash": HashIndex, "elements": ElementIndex}[self._kinds[name]]
+        if name in self.dataset.schema:
+            self.indexes[name] = index_class(self.dataset, name)
+        else:
+            self.indexes.pop(name, None)
+        self._stale.discard(name)
+
+    def drop_index(self, name):
+        """remove the index of attribute name"""
+        self._kinds.pop(name, None)
+        self.indexes.pop(name, None)
+        self._stale.discard(name)
+
+    def refresh(self):
+        """rebuild every index, e.g. after values were set directly rather than merged"""
+        for name in self._kinds:
+            self._build(name)
+
+    def index(self, name):
+        """the up to date index of attribute name, None when it is not indexed"""
+        if name not in self._kinds:
+            return None
+        if name in self._stale or name not in self.indexes:
+            self._build(name)
+        return self.indexes.get(name)
+
+    def rows(self, predicate):
+        """the sorted int32 row numbers of the materials satisfying predicate"""
+        return np.asarray(predicate.select(self, None), dtype=ROW_DTYPE)
+
+    def material_ids(self, predicate):
+        """the material_ids of the materials satisfying predicate"""
+        return self.dataset.material_ids[self.rows(predicate)]
+
+    def count(self, predicate):
+        """the number of materials satisfying predicate"""
+        return len(self.rows(predicate))
+
+    def explain(self, predicate):
+        """the plan predicate is selected with, as text"""
+        return "\n".join(predicate.plan(self))
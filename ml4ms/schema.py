@@ -0,0 +1,121 @@
+import numbers
+
+import numpy as np
+
+CATEGORY = "category"
+OBJECT = "object"
+INT_KINDS = ("int8", "int16", "int32", "int64")
+NUMERIC_KINDS = ("bool",) + INT_KINDS + ("float32", "float64")
+KINDS = NUMERIC_KINDS + (CATEGORY, OBJECT)
+
+# a column of strings stays categorical while it has at most this many categories or, above that,
+# while it has fewer categories than half of its values
+CATEGORY_LIMIT = 1 << 15
+
+
+def _int_kind(low, high):
+    for kind in INT_KINDS:
+        info = np.iinfo(kind)
+        if info.min <= low and high <= info.max:
+            return kind
+    return OBJECT
+
+
+def _fits_float32(values):
+    with np.errstate(over="ignore"):
+        return bool(np.all((values.astype(np.float32) == values) | np.isnan(values)))
+
+
+def infer_kind(value):
+    """
+    the most compact kind of column that holds value without losing anything
+
+    Parameters
+    ----------
+    value: object
+        a single attribute value
+
+    Returns
+    -------
+        one of KINDS: bool, the smallest int that holds the value, float32 when the value survives
+        the round trip through float32 and float64 when it does not, category for strings and
+        object for anything else
+    """
+    if isinstance(value, (bool, np.bool_)):
+        return "bool"
+    if isinstance(value, numbers.Integral):
+        return _int_kind(int(value), int(value))
+    if isinstance(value, numbers.Real):
+        return "float32" if _fits_float32(np.array([float(value)])) else "float64"
+    if isinstance(value, str):
+        return CATEGORY
+    return OBJECT
+
+
+def array_kind(array):
+    """
+    the most compact kind of column that holds every value of array, as for infer_kind
+
+    Parameters
+    ----------
+    array: numpy.ndarray
+        a one dimensional array of values
+
+    Returns
+    -------
+        one of KINDS
+    """
+    kind = array.dtype.kind
+    if kind == "b":
+        return "bool"
+    if kind in "iu":
+        if not len(array):
+            return "int8"
+        return _int_kind(int(array.min()), int(array.max()))
+    if kind == "f":
+        return "float32" if _fits_float32(array) else "float64"
+    if kind == "U":
+        return CATEGORY
+    if kind == "O" and all(isinstance(value, str) for value in array):
+        return CATEGORY
+    return OBJECT
+
+
+def common_kind(current, new):
+    """
+    the kind a column of kind current must become to also hold values of kind new
+
+    ints widen to the larger int, and to a float that holds them exactly when mixed with floats.
+    every other mix falls back to object so that no value is silently converted (e.g. True into 1).
+    """
+    if current == new:
+        return current
+    if current in INT_KINDS and new in INT_KINDS:
+        return max(current, new, key=INT_KINDS.index)
+    if {current, new} <= {"float32", "float64"}:
+        return "float64"
+    if current.startswith(("int", "float")) and new.startswith(("int", "float")):
+        integer = current if current in INT_KINDS else new
+        floating = new if integer == current else current
+        if floating == "float32" and integer in ("int8", "int16"):
+            return "float32"
+        return "float64"
+    return OBJECT
+
+
+def accepts(pinned, kind):
+    """
+    whether a column pinned to kind pinned takes values of kind, converting them to pinned
+
+    object takes anything and floats take any number, otherwise the value must fit without loss.
+    """
+    if pinned == OBJECT:
+        return True
+    if pinned.startswith("float"):
+        return kind.startswith(("int", "float"))
+    return common_kind(pinned, kind) == pinned
+
+
+def code_dtype(n_categories):
+    """the smallest int dtype for the codes of a column with n_categories"""
+    return np.dtype(_int_kind(0, max(n_categories - 1, 0)))
@@ -0,0 +1,528 @@
+import json
+import os
+
+import numpy as np
+
+from ml4ms.ids import ROW_DTYPE
+from ml4ms.spectra import Spectra
+
+METRICS = ("cosine", "pearson")
+# the most rows the coarse centroids of an IVFIndex are trained on
+TRAIN_SAMPLE = 65536
+FORMAT_VERSION = 1
+META_FILE = "index.json"
+
+
+def normalize_rows(vectors, metric, out=None):
+    """
+    rows scaled so that the dot product of two of them is their cosine (or pearson) similarity
+
+    Parameters
+    ----------
+    vectors: numpy.ndarray
+        a (n, d) array, or a single vector of length d
+    metric: str
+        "cosine", or "pearson" to also center every row on its mean
+    out: numpy.ndarray or None
+        where to write the result, which may be vectors itself
+
+    Returns
+    -------
+        the normalized rows. rows that are all zero (all constant for pearson) stay zero.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"metric must be one of {METRICS}, not {metric!r}")
+    vectors = np.asarray(vectors)
+    if out is None:
+        out = np.array(vectors, dtype=np.result_type(vectors.dtype, np.float32))
+    elif out is not vectors:
+        out[...] = vectors
+    if metric == "pearson":
+        out -= out.mean(axis=-1, keepdims=True)
+    norms = np.linalg.norm(out, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    out /= norms
+    return out
+
+
+def top_k(scores, k):
+    """
+    the columns of the k largest scores of every row, largest first
+
+    Returns
+    -------
+        (columns, scores), each of shape (len(scores), min(k, scores.shape[1]))
+    """
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        columns = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        columns = np.broadcast_to(np.arange(k), scores.shape).copy()
+    selected = np.take_along_axis(scores, columns, axis=1)
+    order = np.argsort(-selected, axis=1, kind="stable")
+    return np.take_along_axis(columns, order, axis=1), np.take_along_axis(selected, order, axis=1)
+
+
+class SpectralIndex:
+    """
+    exact k-nearest-neighbour search over a library of spectra sampled on a common grid
+
+    the library is kept as a matrix of normalized rows, so the similarities of a batch of queries
+    to every entry are one matrix product. the library is multiplied in blocks, keeping a running
+    top k, so the temporary memory is bounded whatever its size.
+
+    Parameters
+    ----------
+    vectors: numpy.ndarray
+        the (n, d) library, one spectrum per row
+    material_ids: sequence
+        the material_id of every row
+    metric: str
+        "cosine" or "pearson"
+    normalized: bool
+        True when vectors already went through normalize_rows for this metric (e.g. when opened
+        from disk), in which case they are used as they are, without a copy
+    dtype: numpy.dtype
+        the dtype the library is stored in
+    """
+
+    def __init__(self, vectors, material_ids, metric="cosine", normalized=False, dtype=np.float32):
+        if metric not in METRICS:
+            raise ValueError(f"metric must be one of {METRICS}, not {metric!r}")
+        if len(vectors) != len(material_ids):
+            raise ValueError("there must be one material_id for every row of vectors")
+        if not normalized:
+            vectors = normalize_rows(np.asarray(vectors, dtype=dtype), metric)
+        self.vectors = vectors
+        self.material_ids = np.asarray(material_ids)
+        self.metric = metric
+
+    @classmethod
+    def from_spectra(cls, spectra, grid, metric="cosine", kind="linear", dtype=np.float32):
+        """
+        an index of a Spectra collection, interpolated onto grid
+
+        Parameters
+        ----------
+        spectra: Spectra
+            the library spectra, with x-grids
+        grid: array_like
+            the common grid to compare spectra on
+        metric: str
+            "cosine" or "pearson"
+        kind: str
+            the interpolation used by Spectra.regrid
+        dtype: numpy.dtype
+            the dtype the library is stored in
+
+        Returns
+        -------
+            the SpectralIndex
+        """
+        vectors = spectra.regrid(grid, kind=kind, fill=0.0)
+        return cls(vectors.astype(dtype, copy=False), spectra.material_ids, metric=metric, dtype=dtype)
+
+    @classmethod
+    def from_dataset(cls, dataset, grid, y="intensity", x="q", metric="cosine", kind="linear", dtype=np.float32):
+        """
+        an index of the spectra held as attributes of the materials of a Dataset
+
+        Parameters
+        ----------
+        dataset: Dataset
+            the library
+        grid: array_like
+            the common grid to compare spectra on
+        y: str
+            the attribute holding the intensities of each spectrum
+        x: str
+            the attribute holding the x-grid of each spectrum
+        metric: str
+            "cosine" or "pearson"
+        kind: str
+            the interpolation used by Spectra.regrid
+        dtype: numpy.dtype
+            the dtype the library is stored in
+
+        Returns
+        -------
+            the SpectralIndex
+        """
+        spectra = Spectra.from_dataset(dataset, y=y, x=x)
+        return cls.from_spectra(spectra, grid, metric=metric, kind=kind, dtype=dtype)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def query(self, queries, k=10, block_size=65536):
+        """
+        the k library entries most similar to each query
+
+        Parameters
+        ----------
+        queries: array_like
+            a single spectrum of length d or a (q, d) batch, on the grid of the library
+        k: int
+            the number of matches returned per query
+        block_size: int
+            the number of library rows multiplied at a time
+
+        Returns
+        -------
+            (material_ids, scores), most similar first, of shape (q, k), or (k,) for a single query
+        """
+        queries = np.asarray(queries)
+        single = queries.ndim == 1
+        queries = normalize_rows(np.atleast_2d(queries).astype(self.vectors.dtype), self.metric)
+        k = min(k, len(self))
+        rows = np.zeros((len(queries), 0), dtype=np.int64)
+        scores = np.zeros((len(queries), 0), dtype=self.vectors.dtype)
+        for start in range(0, len(self), block_size):
+            block = queries @ self.vectors[start : start + block_size].T
+            block_rows, block_scores = top_k(block, k)
+            candidates = np.concatenate([scores, block_scores], axis=1)
+            candidate_rows = np.concatenate([rows, block_rows + start], axis=1)
+            best, scores = top_k(candidates, k)
+            rows = np.take_along_axis(candidate_rows, best, axis=1)
+        ids = self.material_ids[rows]
+        if single:
+            return ids[0], scores[0]
+        return ids, scores
+
+    def save(self, path):
+        """
+        write the normalized library to the directory path
+
+        Parameters
+        ----------
+        path: str
+            the directory to write, created if it does not exist
+
+        Returns
+        -------
+            nothing
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "vectors.npy"), np.ascontiguousarray(self.vectors))
+        np.save(os.path.join(path, "material_ids.npy"), self.material_ids, allow_pickle=False)
+        with open(os.path.join(path, META_FILE), "w") as f:
+            json.dump({"format": FORMAT_VERSION, "metric": self.metric}, f)
+
+    @classmethod
+    def open(cls, path, mode="r"):
+        """
+        open an index written by SpectralIndex.save with its library memory mapped
+
+        Parameters
+        ----------
+        path: str
+            the directory written by SpectralIndex.save
+        mode: str
+            the numpy.load mmap_mode, "r" for read-only
+
+        Returns
+        -------
+            the SpectralIndex
+        """
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a saved ml4ms spectral index of format {FORMAT_VERSION}")
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode=mode)
+        material_ids = np.load(os.path.join(path, "material_ids.npy"))
+        return cls(vectors, material_ids, metric=meta["metric"], normalized=True)
+
+
+def recall(approximate_ids, exact_ids):
+    """
+    the recall of an approximate search: the mean fraction of the exact top k it also found
+
+    Parameters
+    ----------
+    approximate_ids: numpy.ndarray
+        the (q, k) material_ids found by the approximate search
+    exact_ids: numpy.ndarray
+        the (q, k) material_ids found by the exact search for the same queries
+
+    Returns
+    -------
+        a float between 0 and 1
+    """
+    approximate_ids, exact_ids = np.atleast_2d(approximate_ids), np.atleast_2d(exact_ids)
+    found = [len(set(a.tolist()) & set(e.tolist())) / max(len(e), 1) for a, e in zip(approximate_ids, exact_ids)]
+    return float(np.mean(found)) if found else 1.0
+
+
+def _kmeans(vectors, n_clusters, n_iter, rng):
+    """spherical k-means of normalized rows, returning the normalized centroids"""
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = ~np.isin(np.arange(n_clusters), assignment)
+        # restart empty clusters on random vectors
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize_rows(sums, "cosine", out=sums)
+    return centroids
+
+
+class IVFIndex:
+    """
+    approximate k-nearest-neighbour search over a large library of spectra
+
+    the library is split into n_lists inverted lists around coarse centroids (spherical k-means
+    of the normalized rows) and a query only scores the rows of the nprobe lists whose centroids
+    are most similar to it. nprobe trades speed for recall: with nprobe equal to n_lists the search
+    is exact. rows are added (or replaced) incrementally. an index that was not trained explicitly
+    is trained on the first rows added and retrained whenever the library has doubled since, until
+    it was trained on TRAIN_SAMPLE rows, so an index that starts from a few rows does not keep a
+    few lists forever.
+
+    Parameters
+    ----------
+    n_lists: int
+        the number of inverted lists
+    metric: str
+        "cosine" or "pearson"
+    nprobe: int
+        the number of lists scored per query, when query is not given another
+    dtype: numpy.dtype
+        the dtype the library is stored in
+    """
+
+    def __init__(self, n_lists=256, metric="cosine", nprobe=8, dtype=np.float32):
+        if metric not in METRICS:
+            raise ValueError(f"metric must be one of {METRICS}, not {metric!r}")
+        self.n_lists = n_lists
+        self.metric = metric
+        self.nprobe = nprobe
+        self.dtype = np.dtype(dtype)
+        self.centroids = None
+        self.vectors = None
+        self.material_ids = []
+        # self.material_ids as an object array, grown with self.vectors, for indexing by query results
+        self._ids = np.zeros(0, dtype=object)
+        self.assignment = np.zeros(0, dtype=np.int64)
+        self._rows = {}
+        self._n = 0
+        self._lists = None
+        # the number of rows the centroids were fitted to, and whether add did the fitting
+        self._trained_on = 0
+        self._auto_trained = False
+
+    @classmethod
+    def from_spectra(cls, spectra, grid, n_lists=256, metric="cosine", nprobe=8, kind="linear", dtype=np.float32):
+        """
+        an index of a Spectra collection, interpolated onto grid
+
+        Parameters
+        ----------
+        spectra: Spectra
+            the library
+        grid: array_like
+            the common grid to compare spectra on
+        n_lists: int
+            the number of inverted lists
+        metric: str
+            "cosine" or "pearson"
+        nprobe: int
+            the number of lists scored per query
+        kind: str
+            the interpolation used by Spectra.regrid
+        dtype: numpy.dtype
+            the dtype the library is stored in
+
+        Returns
+        -------
+            the IVFIndex
+        """
+        index = cls(n_lists=n_lists, metric=metric, nprobe=nprobe, dtype=dtype)
+        index.add(spectra.regrid(grid, kind=kind, fill=0.0), list(spectra.material_ids))
+        return index
+
+    def __len__(self):
+        return self._n
+
+    def train(self, vectors, n_iter=10, sample_size=TRAIN_SAMPLE, seed=0):
+        """
+        fit the coarse centroids to (a sample of) vectors
+
+        Parameters
+        ----------
+        vectors: array_like
+            (n, d) representative library rows. with fewer than n_lists rows, there are only n lists
+        n_iter: int
+            the number of k-means iterations
+        sample_size: int
+            the most rows the k-means runs on
+        seed: int
+            the seed of the random sampling
+
+        Returns
+        -------
+            nothing
+        """
+        vectors = np.atleast_2d(np.asarray(vectors))
+        if not len(vectors):
+            raise ValueError("the index needs at least one vector to train on")
+        self._trained_on = len(vectors)
+        self._auto_trained = False
+        rng = np.random.default_rng(seed)
+        if len(vectors) > sample_size:
+            vectors = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+        vectors = normalize_rows(vectors.astype(self.dtype), self.metric)
+        self.centroids = _kmeans(vectors, min(self.n_lists, len(vectors)), n_iter, rng)
+        if self._n:
+            # the rows already in the library move to the lists of the new centroids
+            self.assignment[: self._n] = np.argmax(self.vectors[: self._n] @ self.centroids.T, axis=1)
+            self._lists = None
+
+    def add(self, vectors, material_ids):
+        """
+        add rows to the library, replacing those of material_ids that are already in it
+
+        an untrained index is trained on the first rows added, and retrained on the library as it
+        grows.
+
+        Parameters
+        ----------
+        vectors: array_like
+            the (n, d) rows to add
+        material_ids: sequence
+            the material_id of every row
+
+        Returns
+        -------
+            nothing
+        """
+        vectors = np.atleast_2d(np.asarray(vectors))
+        if len(vectors) != len(material_ids):
+            raise ValueError("there must be one material_id for every row of vectors")
+        if not len(vectors):
+            return
+        if self.centroids is None:
+            self.train(vectors)
+            self._auto_trained = True
+        vectors = normalize_rows(vectors.astype(self.dtype), self.metric)
+        if self.vectors is None:
+            self.vectors = np.zeros((0, vectors.shape[1]), dtype=self.dtype)
+        rows = np.empty(len(vectors), dtype=np.int64)
+        before = len(self.material_ids)
+        for i, material_id in enumerate(material_ids):
+            row = self._rows.get(material_id)
+            if row is None:
+                row = self._rows[material_id] = len(self.material_ids)
+                self.material_ids.append(material_id)
+            rows[i] = row
+        n = len(self.material_ids)
+        if n > len(self.vectors):
+            capacity = max(n, 2 * len(self.vectors))
+            self.vectors = np.concatenate(
+                [self.vectors, np.zeros((capacity - len(self.vectors), vectors.shape[1]), self.dtype)]
+            )
+            self.assignment = np.concatenate(
+                [self.assignment, np.zeros(capacity - len(self.assignment), np.int64)]
+            )
+            self._ids = np.concatenate([self._ids, np.full(capacity - len(self._ids), None, dtype=object)])
+        for row in range(before, n):
+            self._ids[row] = self.material_ids[row]
+        self._n = n
+        self.vectors[rows] = vectors
+        self.assignment[rows] = np.argmax(vectors @ self.centroids.T, axis=1)
+        self._lists = None
+        if self._auto_trained and self._trained_on < TRAIN_SAMPLE and n >= 2 * self._trained_on:
+            self.train(self.vectors[:n])
+            self._auto_trained = True
+
+    def _inverted_lists(self):
+        """(rows sorted by list, offsets of every list in them)"""
+        if self._lists is None:
+            assignment = self.assignment[: self._n]
+            order = np.argsort(assignment, kind="stable")
+            n_lists = len(self.centroids)
+            offsets = np.zeros(n_lists + 1, dtype=np.int64)
+            np.cumsum(np.bincount(assignment, minlength=n_lists), out=offsets[1:])
+            self._lists = (order, offsets)
+        return self._lists
+
+    def query(self, queries, k=10, nprobe=None):
+        """
+        approximately the k library entries most similar to each query
+
+        Parameters
+        ----------
+        queries: array_like
+            a single spectrum of length d or a (q, d) batch, on the grid of the library
+        k: int
+            the number of matches returned per query
+        nprobe: int or None
+            the number of lists scored, self.nprobe when None
+
+        Returns
+        -------
+            (material_ids, scores), most similar first, of shape (q, k), or (k,) for a single query.
+            rows are padded with None and -inf when the probed lists hold fewer than k entries.
+        """
+        if not self._n:
+            raise ValueError("the index is empty")
+        queries = np.asarray(queries)
+        single = queries.ndim == 1
+        queries = normalize_rows(np.atleast_2d(queries).astype(self.dtype), self.metric)
+        nprobe = min(self.nprobe if nprobe is None else nprobe, len(self.centroids))
+        probes, _ = top_k(queries @ self.centroids.T, nprobe)
+        order, offsets = self._inverted_lists()
+        ids = np.full((len(queries), k), None, dtype=object)
+        scores = np.full((len(queries), k), -np.inf, dtype=self.dtype)
+        for i, (query, lists) in enumerate(zip(queries, probes)):
+            rows = np.concatenate([order[offsets[j] : offsets[j + 1]] for j in lists])
+            if not len(rows):
+                continue
+            best, best_scores = top_k((self.vectors[rows] @ query)[None, :], k)
+            ids[i, : best.shape[1]] = self._ids[rows[best[0]]]
+            scores[i, : best.shape[1]] = best_scores[0]
+        if single:
+            return ids[0], scores[0]
+        return ids, scores
+
+    def watch(self, dataset, grid, y="intensity", x="q", kind="linear"):
+        """
+        add the spectra of a Dataset to the index, and keep adding them as merges bring new ones
+
+        every merge only reads the spectra of the materials it touched. materials without y or x,
+        or a Dataset with neither yet, are skipped.
+
+        Parameters
+        ----------
+        dataset: Dataset
+            the library
+        grid: array_like
+            the common grid to compare spectra on
+        y: str
+            the attribute holding the intensities of each spectrum
+        x: str
+            the attribute holding the x-grid of each spectrum
+        kind: str
+            the interpolation used by Spectra.regrid
+
+        Returns
+        -------
+            the listener added to the Dataset, to pass to Dataset.remove_merge_listener
+        """
+        grid = np.asarray(grid, dtype=np.float64)
+
+        def listener(dataset, rows):
+            schema = dataset.schema
+            if y not in schema or x not in schema or not len(rows):
+                return
+            y_values, y_present = dataset.column(y, rows)
+            x_values, x_present = dataset.column(x, rows)
+            keep = y_present & x_present
+            if keep.any():
+                ids = dataset.material_ids_of(rows[keep]).tolist()
+                spectra = Spectra.from_arrays(ids, y_values[keep], xs=x_values[keep])
+                self.add(spectra.regrid(grid, kind=kind, fill=0.0), ids)
+
+        listener(dataset, np.arange(len(dataset), dtype=ROW_DTYPE))
+        dataset.add_merge_listener(listener)
+        return listener
@@ -0,0 +1,444 @@
+import json
+import os
+
+import numpy as np
+
+FORMAT_VERSION = 1
+META_FILE = "spectra.json"
+REGRID_KINDS = ("linear", "cubic")
+
+
+def _slopes(x, y, starts, ends):
+    """
+    the finite-difference slope at every point of the packed spectra, for cubic hermite
+    interpolation: central differences inside a spectrum and one-sided ones at its ends
+    """
+    slopes = np.zeros_like(y, dtype=np.float64)
+    if len(x) < 2:
+        return slopes
+    with np.errstate(divide="ignore", invalid="ignore"):
+        secant = np.diff(y) / np.diff(x)
+        central = (y[2:] - y[:-2]) / (x[2:] - x[:-2])
+    secant[~np.isfinite(secant)] = 0.0
+    central[~np.isfinite(central)] = 0.0
+    slopes[1:-1] = central
+    first = starts[ends - starts >= 2]
+    last = ends[ends - starts >= 2] - 1
+    slopes[first] = secant[first]
+    slopes[last] = secant[last - 1]
+    slopes[starts[ends - starts == 1]] = 0.0
+    return slopes
+
+
+def _linear_coefficients(x, y, starts, ends):
+    """
+    the coefficients, highest power first, of the straight line on the interval from every point
+    of the packed spectra to the next, in powers of the distance from the point
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        secant = np.append(np.diff(y) / np.diff(x), 0.0)
+    secant[~np.isfinite(secant)] = 0.0
+    return [secant, y]
+
+
+def _cubic_coefficients(x, y, starts, ends):
+    """
+    the coefficients, highest power first, of the cubic hermite interpolant on the interval from
+    every point of the packed spectra to the next, in powers of the distance from the point
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        h = np.append(np.diff(x), 0.0)
+        secant = np.append(np.diff(y), 0.0) / h
+    secant[~np.isfinite(secant)] = 0.0
+    slopes = _slopes(x, y, starts, ends)
+    next_slopes = np.append(slopes[1:], 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        c2 = (3 * secant - 2 * slopes - next_slopes) / h
+        c3 = (slopes + next_slopes - 2 * secant) / (h * h)
+    c2[~np.isfinite(c2)] = 0.0
+    c3[~np.isfinite(c3)] = 0.0
+    return [c3, c2, slopes, y]
+
+
+class Spectra:
+    """
+    a collection of spectra packed into flat arrays, CSR-style
+
+    the intensities of every spectrum are stored one after another in the flat array y, and those
+    of spectrum i are y[offsets[i]:offsets[i + 1]]. x, when given, holds the matching x-grid values
+    in the same layout. per-spectrum access returns views into the flat arrays and the batch
+    operations work on the whole collection at once.
+
+    Parameters
+    ----------
+    material_ids: sequence
+        the material_id of each spectrum
+    y: numpy.ndarray
+        the flat array of intensities
+    offsets: numpy.ndarray
+        the len(material_ids) + 1 start positions of the spectra in y, the last being len(y)
+    x: numpy.ndarray or None
+        the flat array of x values, the same shape as y
+    """
+
+    def __init__(self, material_ids, y, offsets, x=None):
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if len(offsets) != len(material_ids) + 1 or offsets[0] != 0 or offsets[-1] != len(y):
+            raise ValueError("offsets must run from 0 to len(y) with one entry more than material_ids")
+        if np.any(np.diff(offsets) < 0):
+            raise ValueError("offsets must not decrease")
+        if x is not None and np.shape(x) != np.shape(y):
+            raise ValueError("x and y must have the same shape")
+        self.material_ids = list(material_ids)
+        self.y = y
+        self.x = x
+        self.offsets = offsets
+        self._index = None
+
+    @classmethod
+    def from_arrays(cls, material_ids, ys, xs=None, dtype=np.float64):
+        """
+        pack separate per-material arrays into a Spectra
+
+        Parameters
+        ----------
+        material_ids: sequence
+            the material_id of each spectrum
+        ys: sequence of array_like
+            the intensities of each spectrum
+        xs: sequence of array_like or None
+            the x-grid of each spectrum, each the same length as its intensities
+        dtype: numpy.dtype
+            the dtype of the packed arrays
+
+        Returns
+        -------
+            the Spectra
+        """
+        lengths = np.array([len(y) for y in ys], dtype=np.int64)
+        if len(lengths) != len(material_ids):
+            raise ValueError("there must be one spectrum for each material_id")
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        y = np.empty(offsets[-1], dtype=dtype)
+        for i, values in enumerate(ys):
+            y[offsets[i] : offsets[i + 1]] = values
+        x = None
+        if xs is not None:
+            if [len(values) for values in xs] != lengths.tolist():
+                raise ValueError("each x-grid must be the same length as its intensities")
+            x = np.empty(offsets[-1], dtype=dtype)
+            for i, values in enumerate(xs):
+                x[offsets[i] : offsets[i + 1]] = values
+        return cls(material_ids, y, offsets, x=x)
+
+    @classmethod
+    def from_dataset(cls, dataset, y="intensity", x=None, dtype=np.float64):
+        """
+        pack the spectra held as attributes of the materials of a Dataset
+
+        materials that do not have the y attribute are left out.
+
+        Parameters
+        ----------
+        dataset: Dataset
+            the Dataset
+        y: str
+            the attribute holding the intensities of each spectrum
+        x: str or None
+            the attribute holding the x-grid of each spectrum
+        dtype: numpy.dtype
+            the dtype of the packed arrays
+
+        Returns
+        -------
+            the Spectra
+        """
+        values, present = dataset.column(y)
+        rows = np.flatnonzero(present)
+        ids = dataset.material_ids[rows].tolist()
+        xs = None
+        if x is not None:
+            x_values, x_present = dataset.column(x)
+            if not x_present[rows].all():
+                raise ValueError(f"every material with {y!r} must also have {x!r}")
+            xs = x_values[rows]
+        return cls.from_arrays(ids, values[rows], xs=xs, dtype=dtype)
+
+    def __len__(self):
+        return len(self.material_ids)
+
+    def __getitem__(self, i):
+        """the intensities of spectrum i, a view into y"""
+        return self.y[self.offsets[i] : self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def lengths(self):
+        """the number of points in each spectrum"""
+        return np.diff(self.offsets)
+
+    @property
+    def segment_ids(self):
+        """the index of the spectrum each point of y belongs to"""
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    def index(self, material_id):
+        """the position of the spectrum of material_id in the collection"""
+        if self._index is None:
+            self._index = {material_id: i for i, material_id in enumerate(self.material_ids)}
+        return self._index[material_id]
+
+    def x_of(self, i):
+        """the x-grid of spectrum i, a view into x"""
+        if self.x is None:
+            raise ValueError("these spectra have no x-grids")
+        return self.x[self.offsets[i] : self.offsets[i + 1]]
+
+    def spectrum(self, material_id):
+        """
+        the spectrum of material_id
+
+        Returns
+        -------
+            (x, y) views into the flat arrays, x being None when there are no x-grids
+        """
+        i = self.index(material_id)
+        return (None if self.x is None else self.x_of(i)), self[i]
+
+    def reduce(self, ufunc, values=None, empty=np.nan):
+        """
+        reduce every spectrum with a numpy ufunc in one call
+
+        Parameters
+        ----------
+        ufunc: numpy.ufunc
+            e.g. numpy.add or numpy.maximum
+        values: numpy.ndarray or None
+            a flat array in the layout of y to reduce instead of y, e.g. self.x
+        empty: float
+            the result for spectra with no points
+
+        Returns
+        -------
+            an array with one result per spectrum
+        """
+        values = self.y if values is None else values
+        lengths = self.lengths
+        nonempty = lengths > 0
+        out = np.full(len(self), empty, dtype=np.result_type(values.dtype, type(empty)))
+        if values.size:
+            out[nonempty] = ufunc.reduceat(values, self.offsets[:-1][nonempty])
+        return out
+
+    def max(self):
+        """the largest intensity of each spectrum"""
+        return self.reduce(np.maximum)
+
+    def min(self):
+        """the smallest intensity of each spectrum"""
+        return self.reduce(np.minimum)
+
+    def sum(self):
+        """the summed intensity of each spectrum"""
+        return self.reduce(np.add, empty=0.0)
+
+    def mean(self):
+        """the mean intensity of each spectrum"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.sum() / self.lengths
+
+    def broadcast(self, per_spectrum):
+        """expand one value (or row of values) per spectrum to one per point of y"""
+        return np.repeat(np.asarray(per_spectrum), self.lengths, axis=0)
+
+    def regrid(self, grid, kind="linear", out=None, fill=np.nan, chunk_size=1024):
+        """
+        interpolate every spectrum onto a common x-grid
+
+        the interpolation is vectorized over whole chunks of spectra: the interval of each
+        spectrum that holds each grid point is found from one searchsorted of all of their x values
+        into the grid, and the interpolating polynomials (straight lines or cubics) are evaluated
+        for the whole chunk at once.
+
+        Parameters
+        ----------
+        grid: array_like
+            the common grid, in increasing order
+        kind: str
+            "linear", or "cubic" for cubic hermite interpolation with finite-difference slopes
+        out: numpy.ndarray or None
+            a preallocated (len(self), len(grid)) float array to write the result into
+        fill: float
+            the value for grid points outside the x range of a spectrum
+        chunk_size: int
+            the number of spectra interpolated at a time, which bounds the temporary memory
+
+        Returns
+        -------
+            the (len(self), len(grid)) array of interpolated intensities, out if it was given
+        """
+        if kind not in REGRID_KINDS:
+            raise ValueError(f"kind must be one of {REGRID_KINDS}, not {kind!r}")
+        if self.x is None:
+            raise ValueError("spectra without x-grids cannot be regridded")
+        grid = np.asarray(grid, dtype=np.float64)
+        if np.any(np.diff(grid) < 0):
+            raise ValueError("grid must be in increasing order")
+        if out is None:
+            out = np.empty((len(self), len(grid)), dtype=np.float64)
+        elif out.shape != (len(self), len(grid)):
+            raise ValueError(f"out must have shape {(len(self), len(grid))}, not {out.shape}")
+        decreasing = np.diff(self.x) < 0
+        if np.any(decreasing & (self.segment_ids[1:] == self.segment_ids[:-1])):
+            raise ValueError("the x values of every spectrum must be in increasing order")
+        coefficients = _linear_coefficients if kind == "linear" else _cubic_coefficients
+        for first in range(0, len(self), chunk_size):
+            last = min(first + chunk_size, len(self))
+            out[first:last] = self._regrid_chunk(first, last, grid, fill, coefficients)
+        return out
+
+    def _regrid_chunk(self, first, last, grid, fill, coefficients):
+        low, high = self.offsets[first], self.offsets[last]
+        x = np.asarray(self.x[low:high], dtype=np.float64)
+        y = np.asarray(self.y[low:high], dtype=np.float64)
+        starts = self.offsets[first:last] - low
+        ends = self.offsets[first + 1 : last + 1] - low
+        lengths = ends - starts
+        n, m = last - first, len(grid)
+        result = np.full((n, m), fill, dtype=np.float64)
+        if not len(x) or not m:
+            return result
+        segments = np.repeat(np.arange(n), lengths)
+        # the number of points of each spectrum at or below each grid point, which locates the
+        # interval holding the grid point
+        left = np.searchsorted(grid, x, side="left")
+        below = np.bincount(segments * (m + 1) + left, minlength=n * (m + 1)).reshape(n, m + 1)
+        index = np.cumsum(below[:, :m], axis=1)
+        index += (starts - 1)[:, None]
+        last_interval = np.maximum(ends - 2, starts)
+        np.clip(
+            index,
+            np.minimum(starts, len(x) - 1)[:, None],
+            np.minimum(last_interval, len(x) - 1)[:, None],
+            out=index,
+        )
+        x_first = np.where(lengths >= 2, x[np.minimum(starts, len(x) - 1)], np.inf)
+        x_last = x[np.maximum(ends - 1, 0)]
+        inside = (grid[None, :] >= x_first[:, None]) & (grid[None, :] <= x_last[:, None])
+        distance = grid[None, :] - x[index]
+        coefficients = coefficients(x, y, starts, ends)
+        values = coefficients[0][index]
+        for coefficient in coefficients[1:]:
+            values *= distance
+            values += coefficient[index]
+        np.copyto(result, values, where=inside)
+        return result
+
+    def take(self, indices):
+        """
+        a new Spectra holding copies of the spectra at indices, in that order
+
+        Parameters
+        ----------
+        indices: array_like
+            positions of spectra in this collection
+
+        Returns
+        -------
+            the Spectra
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        lengths = self.lengths[indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # the position in y of every point of the selected spectra
+        points = np.repeat(self.offsets[indices] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        x = None if self.x is None else self.x[points]
+        return Spectra([self.material_ids[i] for i in indices], self.y[points], offsets, x=x)
+
+    def merge_into(self, dataset, y="intensity", x=None, policy="upsert"):
+        """
+        merge the spectra into a Dataset as attributes of their materials, in one bulk merge
+
+        the flat arrays are copied once and every material gets views of its own spectrum in the
+        copies, so later changes to this collection do not reach the Dataset.
+
+        Parameters
+        ----------
+        dataset: Dataset
+            the Dataset to merge into
+        y: str
+            the attribute to hold the intensities of each spectrum
+        x: str or None
+            the attribute to hold the x-grid of each spectrum, which is not merged when None
+        policy: str
+            what to do with a material_id that is not in the Dataset, as for Dataset.merge_arrays
+
+        Returns
+        -------
+            the MergeReport of the merge
+        """
+        if x is not None and self.x is None:
+            raise ValueError("these spectra have no x-grids")
+        columns = {}
+        for name, flat in ((y, self.y), (x, self.x)):
+            if name is not None:
+                flat = np.array(flat)
+                columns[name] = np.empty(len(self), dtype=object)
+                for i in range(len(self)):
+                    columns[name][i] = flat[self.offsets[i] : self.offsets[i + 1]]
+        return dataset.merge_arrays(np.array(self.material_ids), columns, policy=policy)
+
+    def save(self, path):
+        """
+        write the spectra to the directory path as raw .npy arrays
+
+        Parameters
+        ----------
+        path: str
+            the directory to write, created if it does not exist
+
+        Returns
+        -------
+            nothing
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "y.npy"), self.y)
+        np.save(os.path.join(path, "offsets.npy"), self.offsets)
+        if self.x is not None:
+            np.save(os.path.join(path, "x.npy"), self.x)
+        meta = {"format": FORMAT_VERSION, "material_ids": self.material_ids, "x": self.x is not None}
+        with open(os.path.join(path, META_FILE), "w") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def open(cls, path, mode="r"):
+        """
+        open spectra written by Spectra.save with the flat arrays memory mapped
+
+        Parameters
+        ----------
+        path: str
+            the directory written by Spectra.save
+        mode: str
+            the numpy.load mmap_mode, "r" for read-only
+
+        Returns
+        -------
+            the Spectra
+        """
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a saved ml4ms spectra collection of format {FORMAT_VERSION}")
+        offsets = np.load(os.path.join(path, "offsets.npy"))
+        if offsets[-1] == 0:
+            # empty files cannot be mapped
+            mode = None
+        y = np.load(os.path.join(path, "y.npy"), mmap_mode=mode)
+        x = np.load(os.path.join(path, "x.npy"), mmap_mode=mode) if meta["x"] else None
+        return cls(meta["material_ids"], y, offsets, x=x)
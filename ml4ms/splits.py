@@ -0,0 +1,200 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+from ml4ms.ids import ROW_DTYPE
+
+SPLIT_NAMES = ("train", "validation", "test")
+
+
+class Split(Mapping):
+    """
+    the parts of a split of a Dataset, e.g. {"train": rows, "test": rows}
+
+    every part is a sorted int32 array of row numbers into the Dataset, so a split holds no copy
+    of any material.
+
+    Parameters
+    ----------
+    dataset: Dataset
+        the Dataset that was split
+    parts: dict
+        {name: rows}
+    """
+
+    def __init__(self, dataset, parts):
+        self.dataset = dataset
+        self.parts = dict(parts)
+
+    def __getitem__(self, name):
+        return self.parts[name]
+
+    def __iter__(self):
+        return iter(self.parts)
+
+    def __len__(self):
+        return len(self.parts)
+
+    def __repr__(self):
+        sizes = ", ".join(f"{name}={len(rows)}" for name, rows in self.parts.items())
+        return f"Split({sizes})"
+
+    def material_ids(self, name):
+        """the material_ids of part name"""
+        return self.dataset.material_ids[self.parts[name]]
+
+    def to_arrays(self, name, features, target=None, dtype=None):
+        """the FeatureArrays of part name, as Dataset.to_arrays with rows=self[name]"""
+        return self.dataset.to_arrays(features, target=target, rows=self.parts[name], dtype=dtype)
+
+
+def _labels(dataset, by, rows, bins=None):
+    """
+    an int label for every one of rows, equal for rows with equal keys
+
+    by is an attribute name or an array of keys for every row of the dataset. materials without
+    the attribute share a label of their own. with bins, a numeric attribute is cut into bins
+    quantiles first.
+    """
+    if isinstance(by, str):
+        values, present = dataset.column(by)
+        values, present = values[rows], present[rows]
+    else:
+        by = np.asarray(by)
+        if len(by) != len(dataset):
+            raise ValueError(f"{len(by)} keys for a Dataset of {len(dataset)} materials")
+        values, present = by[rows], np.ones(len(rows), dtype=bool)
+    if bins is not None:
+        values = np.asarray(values, dtype=np.float64)
+        edges = np.quantile(values[present], np.linspace(0, 1, bins + 1)[1:-1]) if present.any() else []
+        labels = np.searchsorted(edges, values, side="right")
+    elif values.dtype == object:
+        index = {}
+        labels = np.array([index.setdefault(value, len(index)) for value in values.tolist()], dtype=np.int64)
+    else:
+        _, labels = np.unique(values, return_inverse=True)
+        labels = labels.reshape(-1)
+    labels = np.asarray(labels, dtype=np.int64)
+    labels[~present] = labels.max(initial=-1) + 1
+    return labels
+
+
+def _assign(dataset, rows, fractions, stratify, groups, bins, rng):
+    """the part, an index into fractions, of every one of rows"""
+    fractions = np.asarray(fractions, dtype=np.float64)
+    if (fractions < 0).any() or not np.isclose(fractions.sum(), 1.0):
+        raise ValueError(f"fractions must be non-negative and add up to 1, not {fractions.tolist()}")
+    if stratify is not None and groups is not None:
+        raise ValueError("a split is either stratified or grouped, not both")
+    bounds = np.cumsum(fractions)[:-1]
+    n = len(rows)
+    if groups is not None:
+        # whole groups in random order, each going to the part its middle row falls in
+        labels = _labels(dataset, groups, rows)
+        sizes = np.bincount(labels)
+        order = rng.permutation(len(sizes))
+        middles = np.empty(len(sizes))
+        middles[order] = np.cumsum(sizes[order]) - sizes[order] / 2
+        return np.searchsorted(bounds * n, middles, side="right")[labels]
+    if stratify is None:
+        return np.searchsorted(bounds, (rng.permutation(n) + 0.5) / max(n, 1), side="right")
+    # the rows of every stratum in random order, cut in the proportions of fractions from a random
+    # starting offset so that rounding does not always favour the same part
+    labels = _labels(dataset, stratify, rows, bins=bins)
+    sizes = np.bincount(labels)
+    offsets = rng.random(len(sizes))
+    order = np.lexsort((rng.random(n), labels))
+    starts = np.zeros(len(sizes), dtype=np.int64)
+    np.cumsum(sizes[:-1], out=starts[1:])
+    ranks = np.empty(n, dtype=np.int64)
+    ranks[order] = np.arange(n) - starts[labels[order]]
+    return np.searchsorted(bounds, (ranks + offsets[labels]) / sizes[labels], side="right")
+
+
+def _rows(dataset, rows):
+    if rows is None:
+        return np.arange(len(dataset), dtype=ROW_DTYPE)
+    return np.asarray(rows, dtype=ROW_DTYPE)
+
+
+def split(
+    dataset,
+    fractions=(0.8, 0.1, 0.1),
+    names=SPLIT_NAMES,
+    stratify=None,
+    groups=None,
+    bins=None,
+    seed=None,
+    rows=None,
+):
+    """
+    split the materials of a Dataset into parts of the given fractions
+
+    by default materials are assigned at random. a stratified split keeps the proportion of every
+    value of an attribute the same in every part, and a grouped split keeps all of the materials
+    that share a key (e.g. a chemical system) in the same part, so that none of them leaks from
+    training into testing. a grouped split only approximates fractions, as groups are not cut.
+
+    Parameters
+    ----------
+    dataset: Dataset
+        the materials to split
+    fractions: sequence of float
+        the fraction of the materials in every part, adding up to 1
+    names: sequence of str
+        the name of every part
+    stratify: str or array_like or None
+        the attribute, or a key for every row of dataset, to stratify by
+    groups: str or array_like or None
+        the attribute, or a key for every row of dataset, to group by
+    bins: int or None
+        stratify a numeric attribute by this many quantiles of it instead of by its values
+    seed: int or None
+        the seed of the random assignment
+    rows: array_like or None
+        the rows to split, all rows when None
+
+    Returns
+    -------
+        a Split of the row numbers of every part
+    """
+    if len(names) != len(fractions):
+        raise ValueError(f"{len(names)} names for {len(fractions)} fractions")
+    rows = _rows(dataset, rows)
+    parts = _assign(dataset, rows, fractions, stratify, groups, bins, np.random.default_rng(seed))
+    return Split(dataset, {name: np.sort(rows[parts == i]) for i, name in enumerate(names)})
+
+
+def kfold(dataset, n_folds=5, stratify=None, groups=None, bins=None, seed=None, rows=None):
+    """
+    cross-validation folds of the materials of a Dataset
+
+    the materials are assigned to folds once, randomly, stratified or grouped as for split, and
+    every fold's Split is only built when the iteration reaches it.
+
+    Parameters
+    ----------
+    dataset: Dataset
+        the materials to split
+    n_folds: int
+        the number of folds
+    stratify, groups, bins, seed, rows:
+        as for split
+
+    Yields
+    ------
+        a Split with parts "train" and "test" for every fold, the test parts of the folds being
+        disjoint and covering every row
+    """
+    if n_folds < 2:
+        raise ValueError(f"n_folds must be at least 2, not {n_folds}")
+    rows = _rows(dataset, rows)
+    folds = _assign(
+        dataset, rows, np.full(n_folds, 1 / n_folds), stratify, groups, bins, np.random.default_rng(seed)
+    )
+    order = np.argsort(folds, kind="stable")
+    starts = np.searchsorted(folds[order], np.arange(n_folds + 1))
+    for fold in range(n_folds):
+        test = np.sort(rows[order[starts[fold] : starts[fold + 1]]])
+        train = np.sort(np.concatenate([rows[order[: starts[fold]]], rows[order[starts[fold + 1] :]]]))
+        yield Split(dataset, {"train": train, "test": test})
@@ -0,0 +1,449 @@
+import io
+import math
+import pickle
+import sqlite3
+import threading
+from collections.abc import Mapping
+
+import numpy as np
+
+from ml4ms.columns import as_column_array
+from ml4ms.core import BaseDataset, MergeReport, _check_policy
+from ml4ms.ids import ROW_DTYPE, id_array
+from ml4ms.schema import CATEGORY, NUMERIC_KINDS, array_kind, common_kind, infer_kind
+
+# how a value is stored: as itself (None, int, float or str), as an int for a bool, as NULL for a
+# float nan, as .npy bytes for a numpy array and pickled for anything else
+PLAIN, BOOL, NAN, ARRAY, PICKLE = range(5)
+# the most host parameters in one statement on old SQLite builds
+MAX_PARAMETERS = 999
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS materials (row INTEGER PRIMARY KEY, material_id UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS attributes (
+    name TEXT NOT NULL, row INTEGER NOT NULL, tag INTEGER NOT NULL, value,
+    PRIMARY KEY (name, row)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS attributes_by_row ON attributes (row);
+CREATE TABLE IF NOT EXISTS kinds (name TEXT PRIMARY KEY, kind TEXT NOT NULL);
+"""
+
+
+def encode(value):
+    """the (tag, value) a python value is stored as"""
+    if isinstance(value, (bool, np.bool_)):
+        return BOOL, int(value)
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or isinstance(value, str):
+        return PLAIN, value
+    if isinstance(value, float):
+        return (NAN, None) if math.isnan(value) else (PLAIN, value)
+    if isinstance(value, int) and -(1 << 63) <= value < 1 << 63:
+        return PLAIN, value
+    if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        buffer = io.BytesIO()
+        np.save(buffer, value, allow_pickle=False)
+        return ARRAY, buffer.getvalue()
+    return PICKLE, pickle.dumps(value)
+
+
+def decode(tag, value):
+    """the python value stored as (tag, value)"""
+    if tag == PLAIN:
+        return value
+    if tag == BOOL:
+        return bool(value)
+    if tag == NAN:
+        return math.nan
+    if tag == ARRAY:
+        return np.load(io.BytesIO(value), allow_pickle=False)
+    return pickle.loads(value)
+
+
+class SQLiteView(Mapping):
+    """dict-like {material_id: {attribute: value, ...}} read access to a SQLiteDataset"""
+
+    def __init__(self, dataset):
+        self._dataset = dataset
+
+    def __getitem__(self, material_id):
+        return self._dataset.row(self._dataset.row_of(material_id))
+
+    def __iter__(self):
+        return iter(self._dataset.material_ids.tolist())
+
+    def __len__(self):
+        return len(self._dataset)
+
+    def __contains__(self, material_id):
+        return self._dataset.rows_of([material_id])[0] >= 0
+
+
+class SQLiteDataset(BaseDataset):
+    """
+    a Dataset kept in a SQLite database file instead of in memory
+
+    it has the interface of ml4ms.core.Dataset for merging and reading, with the attribute values
+    in a key/attribute/value table. what is about the in-memory columns of a Dataset (pin_schema,
+    compact, save and open, nbytes) is left out: the kinds are always inferred and the database
+    file is already the saved form of the data. every merge is written with executemany in a single
+    transaction, so it is atomic and readers never see half of it. the database is in WAL mode, so
+    readers in other threads and processes are not blocked by a merge, and every thread gets its own
+    connection, kept open for its next call and closed once the thread has ended.
+
+    values are stored as themselves where SQLite can hold them, numpy arrays (e.g. spectra) as .npy
+    bytes and any other objects pickled. the kinds of the attributes are inferred as for Dataset,
+    and a categorical attribute reads as codes into the sorted list of its categories.
+
+    Parameters
+    ----------
+    path: str
+        the database file, created if it does not exist
+    timeout: float
+        how many seconds a merge waits for another writer to finish
+    """
+
+    def __init__(self, path, timeout=30.0):
+        super().__init__()
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        # {thread: connection} of the threads that opened one
+        self._connections = {}
+        self._pool_lock = threading.Lock()
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+
+    def _connection(self):
+        """the connection of the calling thread, opened on its first call"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # only this thread uses it, but close may be called from any thread
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._pool_lock:
+                for thread in [thread for thread in self._connections if not thread.is_alive()]:
+                    self._connections.pop(thread).close()
+                self._connections[threading.current_thread()] = connection
+        return connection
+
+    def close(self):
+        """
+        close the connections of every thread
+
+        Returns
+        -------
+            nothing
+        """
+        with self._pool_lock:
+            for connection in self._connections.values():
+                connection.close()
+            self._connections = {}
+        self._local = threading.local()
+
+    @property
+    def dataset(self):
+        return SQLiteView(self)
+
+    @dataset.setter
+    def dataset(self, data):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM attributes")
+            connection.execute("DELETE FROM materials")
+            connection.execute("DELETE FROM kinds")
+            self._write(connection, [], list(data.items()))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        self._notify(np.arange(len(data), dtype=ROW_DTYPE), list(self.schema))
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM materials").fetchone()[0]
+
+    @property
+    def material_ids(self):
+        """the material_id of every row, as a numpy array indexed by row number"""
+        ids = [
+            material_id
+            for (material_id,) in self._connection().execute("SELECT material_id FROM materials ORDER BY row")
+        ]
+        return np.asarray(ids)
+
+    def material_ids_of(self, rows):
+        """the material_ids of rows, as a numpy array, at a cost proportional to their number"""
+        rows = np.asarray(rows, dtype=np.int64).tolist()
+        found = {}
+        connection = self._connection()
+        for start in range(0, len(rows), MAX_PARAMETERS):
+            chunk = rows[start : start + MAX_PARAMETERS]
+            query = f"SELECT row, material_id FROM materials WHERE row IN ({','.join('?' * len(chunk))})"
+            found.update(connection.execute(query, chunk))
+        return np.asarray([found[row] for row in rows])
+
+    def row_of(self, material_id):
+        """the row number of material_id, raising KeyError when it is not in self.dataset"""
+        row = self.rows_of([material_id])[0]
+        if row < 0:
+            raise KeyError(material_id)
+        return int(row)
+
+    def rows_of(self, material_ids):
+        """
+        the row numbers of many material_ids at once
+
+        Parameters
+        ----------
+        material_ids: array_like
+            the ids to look up
+
+        Returns
+        -------
+            an int32 array of row numbers, -1 where the material_id is not in self.dataset
+        """
+        material_ids = [i.item() if isinstance(i, np.generic) else i for i in material_ids]
+        found = {}
+        connection = self._connection()
+        for start in range(0, len(material_ids), MAX_PARAMETERS):
+            chunk = material_ids[start : start + MAX_PARAMETERS]
+            query = f"SELECT material_id, row FROM materials WHERE material_id IN ({','.join('?' * len(chunk))})"
+            found.update(connection.execute(query, chunk))
+        return np.array([found.get(material_id, -1) for material_id in material_ids], dtype=ROW_DTYPE)
+
+    def row(self, row):
+        """the {attribute: value, ...} of the material at row number row, a copy"""
+        # a material without attributes is a single row of nulls
+        found = (
+            self._connection()
+            .execute(
+                "SELECT a.name, a.tag, a.value FROM materials m "
+                "LEFT JOIN attributes a ON a.row = m.row WHERE m.row = ?",
+                (int(row),),
+            )
+            .fetchall()
+        )
+        if not found:
+            raise IndexError(f"row {row} is out of range for a Dataset of {len(self)} materials")
+        return {name: decode(tag, value) for name, tag, value in found if name is not None}
+
+    @property
+    def schema(self):
+        """
+        the kind of every attribute, as for Dataset.schema
+
+        Returns
+        -------
+            {attribute: kind}
+        """
+        return dict(self._connection().execute("SELECT name, kind FROM kinds ORDER BY rowid"))
+
+    def categories(self, name):
+        """
+        the categories of a categorical attribute, which the values returned by column index into
+
+        Returns
+        -------
+            the sorted list of categories, None when attribute name is not categorical
+        """
+        kind = self.schema.get(name)
+        if kind is None:
+            raise KeyError(f"no material has attribute {name!r}")
+        if kind != CATEGORY:
+            return None
+        cursor = self._connection().execute(
+            "SELECT DISTINCT value FROM attributes WHERE name = ? ORDER BY value", (name,)
+        )
+        return [value for (value,) in cursor]
+
+    def column(self, name, rows=None):
+        """
+        every value of attribute name, indexed by row number
+
+        Parameters
+        ----------
+        name: str
+            the attribute
+        rows: array_like or None
+            the row numbers to return the values of, read by key at a cost proportional to their
+            number, or None for every row
+
+        Returns
+        -------
+            (values, present) arrays read from the database, as for Dataset.column
+        """
+        kind = self.schema.get(name)
+        if kind is None:
+            raise KeyError(f"no material has attribute {name!r}")
+        connection = self._connection()
+        if rows is None:
+            n, inverse = len(self), None
+            query = "SELECT row, tag, value FROM attributes WHERE name = ? ORDER BY row"
+            stored = connection.execute(query, (name,)).fetchall()
+            found = np.array([row for row, _, _ in stored], dtype=np.int64)
+        else:
+            # the values are read for the distinct rows, in order, and spread back over rows at the end
+            wanted, inverse = np.unique(np.asarray(rows, dtype=np.int64), return_inverse=True)
+            n, stored = len(wanted), []
+            for start in range(0, n, MAX_PARAMETERS - 1):
+                chunk = wanted[start : start + MAX_PARAMETERS - 1].tolist()
+                query = "SELECT row, tag, value FROM attributes WHERE name = ? AND row IN ({})"
+                stored.extend(connection.execute(query.format(",".join("?" * len(chunk))), [name] + chunk))
+            found = np.searchsorted(wanted, np.array([row for row, _, _ in stored], dtype=np.int64))
+        present = np.zeros(n, dtype=bool)
+        present[found] = True
+        if kind == CATEGORY:
+            codes = {category: code for code, category in enumerate(self.categories(name))}
+            values = np.zeros(n, dtype=np.int64)
+            values[found] = [codes[value] for _, _, value in stored]
+        elif kind in NUMERIC_KINDS:
+            values = np.zeros(n, dtype=kind)
+            values[found] = [decode(tag, value) for _, tag, value in stored]
+        else:
+            values = np.full(n, None, dtype=object)
+            for position, (_, tag, value) in zip(found.tolist(), stored):
+                values[position] = decode(tag, value)
+        if inverse is not None:
+            values, present = values[inverse], present[inverse]
+        return values, present
+
+    def having(self, name):
+        """
+        the materials that have a value for attribute name
+
+        Returns
+        -------
+            a sorted int32 array of their row numbers
+        """
+        cursor = self._connection().execute("SELECT row FROM attributes WHERE name = ? ORDER BY row", (name,))
+        return np.array([row for (row,) in cursor], dtype=ROW_DTYPE)
+
+    def _write(self, connection, matched, inserts, kinds=None):
+        """
+        write the attributes of matched (row, attributes) and new (material_id, attributes) pairs
+
+        kinds, the {attribute: kind} of the values when already known, saves inferring it value by
+        value.
+
+        Returns
+        -------
+            the new rows and the number of matched rows where an attribute gained or changed a value
+        """
+        start = connection.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM materials").fetchone()[0]
+        rows = np.arange(start, start + len(inserts), dtype=ROW_DTYPE)
+        connection.executemany(
+            "INSERT INTO materials (row, material_id) VALUES (?, ?)",
+            [(int(row), material_id) for row, (material_id, _) in zip(rows, inserts)],
+        )
+        infer = kinds is None
+        kinds = {} if infer else kinds
+        values = []
+        for row, attributes in matched + [(int(row), attributes) for row, (_, attributes) in zip(rows, inserts)]:
+            for name, value in attributes.items():
+                if infer:
+                    kind = infer_kind(value)
+                    kinds[name] = kind if name not in kinds else common_kind(kinds[name], kind)
+                values.append((name, row) + encode(value))
+        connection.execute("CREATE TEMP TABLE IF NOT EXISTS batch (name TEXT, row INTEGER, tag INTEGER, value)")
+        connection.execute("DELETE FROM batch")
+        connection.executemany("INSERT INTO batch VALUES (?, ?, ?, ?)", values)
+        updated = connection.execute(
+            "SELECT COUNT(DISTINCT b.row) FROM batch b "
+            "LEFT JOIN attributes a ON a.name = b.name AND a.row = b.row "
+            "WHERE b.row < ? AND (a.tag IS NOT b.tag OR a.value IS NOT b.value)",
+            (start,),
+        ).fetchone()[0]
+        connection.execute(
+            "INSERT OR REPLACE INTO attributes SELECT name, row, tag, value FROM batch ORDER BY rowid"
+        )
+        stored = dict(connection.execute("SELECT name, kind FROM kinds"))
+        connection.executemany(
+            "INSERT OR REPLACE INTO kinds (name, kind) VALUES (?, ?)",
+            [(name, common_kind(stored[name], kind) if name in stored else kind) for name, kind in kinds.items()],
+        )
+        return rows, updated
+
+    def merge_new_data(self, new_data, policy="strict"):
+        """
+        merge new_data into the database based on matching "material_id", as for Dataset.merge_new_data
+
+        the merge is a single transaction, so one that raises leaves the database untouched.
+
+        Parameters
+        ----------
+        new_data: dict
+            {mat_id_1 : {attribute_1: , attribute_2:, ...}, ...}
+        policy: str
+            "strict", "upsert" or "skip", as for Dataset.merge_new_data
+
+        Returns
+        -------
+            a MergeReport of the merge
+        """
+        return self._merge(new_data, policy)
+
+    def _merge(self, new_data, policy, kinds=None):
+        _check_policy(policy)
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            found = self.rows_of(list(new_data))
+            matched, inserts, missing = [], [], []
+            for row, (key, value) in zip(found.tolist(), new_data.items()):
+                if row >= 0:
+                    matched.append((row, value))
+                elif policy == "upsert":
+                    inserts.append((key, value))
+                elif policy == "skip":
+                    missing.append(key)
+                else:
+                    raise KeyError(key)
+            rows, updated = self._write(connection, matched, inserts, kinds)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        if self._listeners:
+            rows = np.concatenate([np.array([row for row, _ in matched], dtype=ROW_DTYPE), rows])
+            self._notify(rows, list(dict.fromkeys(name for _, value in matched + inserts for name in value)))
+        return MergeReport(len(matched), updated, len(inserts), missing)
+
+    def merge_arrays(self, material_ids, columns, policy="skip"):
+        """
+        merge aligned arrays of attribute values into the database, as for Dataset.merge_arrays
+
+        Parameters
+        ----------
+        material_ids: array_like
+            the material_id of each input row
+        columns: dict
+            {attribute_1: values_1, ...} where each values array is aligned with material_ids.
+            when an id appears more than once the last of its rows wins.
+        policy: str
+            what to do with a material_id that is not in the database, as for merge_new_data
+
+        Returns
+        -------
+            a MergeReport of the merge, with missing as an array
+        """
+        material_ids = id_array(material_ids)
+        columns = {name: as_column_array(values) for name, values in columns.items()}
+        for name, values in columns.items():
+            if len(values) != len(material_ids):
+                raise ValueError(
+                    f"column {name!r} has {len(values)} values but there are {len(material_ids)} material_ids"
+                )
+        # the kind of a whole column at once, and its values as python scalars
+        kinds = {name: array_kind(values) for name, values in columns.items()}
+        columns = {name: values if values.dtype.hasobject else values.tolist() for name, values in columns.items()}
+        new_data = {}
+        for i, material_id in enumerate(material_ids.tolist()):
+            new_data.setdefault(material_id, {}).update((name, values[i]) for name, values in columns.items())
+        report = self._merge(new_data, policy, kinds)
+        return report._replace(missing=np.asarray(report.missing, dtype=material_ids.dtype))
@@ -0,0 +1,135 @@
+import json
+import os
+
+import numpy as np
+
+from ml4ms.columns import Column, ColumnStore, SparseColumn
+from ml4ms.ids import IdTable
+from ml4ms.schema import CATEGORY
+
+FORMAT_VERSION = 1
+META_FILE = "meta.json"
+
+
+def _save_array(path, array):
+    """
+    save array as .npy, pickling it only when it holds python objects
+
+    the array is written to a temporary file that then replaces path, so a store memory mapped from
+    path (e.g. the one being saved) keeps reading the old file rather than a truncated one.
+    """
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        np.save(f, array, allow_pickle=array.dtype == object)
+    os.replace(temporary, path)
+
+
+def _load_array(path, mode):
+    """open a .npy file as a memory map, or read it in when it holds python objects"""
+    with open(path, "rb") as f:
+        if np.lib.format.read_magic(f) == (1, 0):
+            shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+    if dtype.hasobject or 0 in shape:
+        # empty arrays cannot be mapped either
+        return np.load(path, allow_pickle=dtype.hasobject)
+    return np.load(path, mmap_mode=mode)
+
+
+def save_store(store, path):
+    """
+    write a ColumnStore to the directory path as raw .npy columns plus an id index
+
+    Parameters
+    ----------
+    store: ColumnStore
+        the store to save
+    path: str
+        the directory to write, created if it does not exist. files of an earlier save are
+        replaced, which is safe when store was opened from path: the meta file is written last, and
+        the old files stay readable through the maps of store until they are closed.
+
+    Returns
+    -------
+        nothing
+    """
+    os.makedirs(path, exist_ok=True)
+    n = len(store)
+    ids = store.ids.array()
+    if ids.dtype == object or store.ids.mixed():
+        raise TypeError("only datasets whose material_ids are all str or all int can be saved")
+    sorted_ids, order = store.ids.sorted()
+    _save_array(os.path.join(path, "ids.npy"), ids)
+    _save_array(os.path.join(path, "sorted_ids.npy"), sorted_ids)
+    _save_array(os.path.join(path, "order.npy"), order)
+    columns = {}
+    for i, (name, column) in enumerate(store.columns.items()):
+        stem = f"column_{i}"
+        if column.sparse:
+            column.flush()
+            _save_array(os.path.join(path, stem + ".rows.npy"), column.row_array)
+            _save_array(os.path.join(path, stem + ".bits.npy"), column.bits[: (n + 7) // 8])
+            values, present = column.data.values, column.data.present
+        else:
+            values, present = column.values[:n], column.present[:n]
+        _save_array(os.path.join(path, stem + ".values.npy"), values)
+        _save_array(os.path.join(path, stem + ".present.npy"), present)
+        if column.categories is not None:
+            _save_array(os.path.join(path, stem + ".categories.npy"), np.array(column.categories, dtype=str))
+        columns[name] = {"file": stem, "kind": column.kind, "sparse": column.sparse}
+    meta = {"format": FORMAT_VERSION, "length": n, "columns": columns, "pinned": store.pinned}
+    temporary = os.path.join(path, META_FILE + ".tmp")
+    with open(temporary, "w") as f:
+        json.dump(meta, f, indent=1)
+    os.replace(temporary, os.path.join(path, META_FILE))
+
+
+def open_store(path, mode="r"):
+    """
+    open a ColumnStore written by save_store with its columns memory mapped
+
+    opening only reads the array headers, so it takes the same time however big the store is, and
+    pages of a column are read from disk when they are first touched. every process that opens
+    the same directory read-only shares one copy of the data in the page cache.
+
+    Parameters
+    ----------
+    path: str
+        the directory written by save_store
+    mode: str
+        "r" for read-only maps (writing raises), "c" for copy-on-write maps whose changes stay in
+        memory and "r+" to write changes back to the files. columns of python objects (e.g. lists)
+        and the categories of categorical columns cannot be mapped and are read in whatever the
+        mode.
+
+    Returns
+    -------
+        the ColumnStore
+    """
+    if mode not in ("r", "c", "r+"):
+        raise ValueError(f"mode must be 'r', 'c' or 'r+', not {mode!r}")
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+    if meta.get("format") != FORMAT_VERSION:
+        raise ValueError(f"{path} is not a saved ml4ms dataset of format {FORMAT_VERSION}")
+    columns = {}
+    for name, column in meta["columns"].items():
+        stem = os.path.join(path, column["file"])
+        categories = None
+        if column["kind"] == CATEGORY:
+            categories = np.load(stem + ".categories.npy").tolist()
+        data = Column.from_arrays(
+            _load_array(stem + ".values.npy", mode), _load_array(stem + ".present.npy", mode), categories
+        )
+        if column["sparse"]:
+            data = SparseColumn.from_arrays(
+                _load_array(stem + ".rows.npy", mode), data, _load_array(stem + ".bits.npy", mode)
+            )
+        columns[name] = data
+    ids = _load_array(os.path.join(path, "ids.npy"), mode)
+    sorted_ids = (
+        _load_array(os.path.join(path, "sorted_ids.npy"), mode),
+        _load_array(os.path.join(path, "order.npy"), mode),
+    )
+    return ColumnStore.from_arrays(IdTable.from_array(ids, sorted_ids=sorted_ids), columns, pinned=meta["pinned"])
@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+
+
+def _snapshot(dataset):
+    return {
+        material_id: {
+            name: (value.tolist() if isinstance(value, np.ndarray) else value) for name, value in row.items()
+        }
+        for material_id, row in dataset.dataset.items()
+    }
+
+
+@pytest.fixture
+def snapshot():
+    """a function giving the contents of a Dataset as plain dicts and lists, to compare with =="""
+    return _snapshot
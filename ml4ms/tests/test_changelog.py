@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pytest
+
+from ml4ms.changelog import ChangeLog
+from ml4ms.core import Dataset
+
+
+@pytest.mark.parametrize("background", [False, True])
+def test_log_replay_and_compaction(tmp_path, background, snapshot):
+    path = str(tmp_path / "log")
+    log = ChangeLog(path)
+    ds = log.open()
+    assert len(ds) == 0
+    ds.merge_new_data({"mp-1": {"a": 1, "system": "cubic"}, "mp-2": {"a": 2.5, "tags": ["x"]}}, policy="upsert")
+    ds.merge_arrays(["mp-3", "mp-1"], {"a": [3, 4], "spectrum": [np.arange(3.0), np.arange(2.0)]}, policy="upsert")
+    expected = snapshot(ds)
+    log.close()
+
+    reopened = ChangeLog(path)
+    ds = reopened.open()
+    assert snapshot(ds) == expected
+    assert list(ds.dataset) == ["mp-1", "mp-2", "mp-3"]
+
+    reopened.compact(background=background)
+    ds.merge_new_data({"mp-2": {"system": "hexagonal"}, "mp-4": {"a": 7}}, policy="upsert")
+    reopened.wait()
+    segments = [name for name in os.listdir(path) if name.startswith("log-")]
+    assert len(segments) == 1
+    expected = snapshot(ds)
+    reopened.close()
+    assert snapshot(ChangeLog(path).open()) == expected
+
+
+def test_follow_and_torn_record(tmp_path, snapshot):
+    path = str(tmp_path / "log")
+    ds = Dataset()
+    ds.dataset = {"mp-1": {"a": 1.5}}
+    log = ChangeLog(path)
+    log.follow(ds)
+    ds.merge_new_data({"mp-1": {"b": 2}})
+    segment = os.path.join(path, sorted(name for name in os.listdir(path) if name.startswith("log-"))[-1])
+    size = os.path.getsize(segment)
+    ds.merge_new_data({"mp-1": {"b": 3}})
+    log.close()
+    # a crash part way through appending the last record
+    with open(segment, "r+b") as f:
+        f.truncate(size + 20)
+    assert snapshot(ChangeLog(path).open()) == {"mp-1": {"a": 1.5, "b": 2}}
+
+
+def test_records_hold_only_the_merged_attributes(tmp_path, snapshot):
+    path = str(tmp_path / "log")
+    ds = Dataset()
+    ds.dataset = {"mp-1": {"a": 1.5, "spectrum": np.arange(10000.0)}}
+    log = ChangeLog(path)
+    log.follow(ds)
+    segment = os.path.join(path, sorted(name for name in os.listdir(path) if name.startswith("log-"))[-1])
+    ds.merge_new_data({"mp-1": {"b": 2}})
+    ds.merge_arrays(["mp-2"], {"a": [0.5]}, policy="upsert")
+    log.close()
+    assert os.path.getsize(segment) < 2000
+    assert snapshot(ChangeLog(path).open()) == snapshot(ds)
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from ml4ms import columns
+from ml4ms.core import Dataset
+
+
+@pytest.fixture
+def dataset(monkeypatch):
+    monkeypatch.setattr(columns, "SPARSE_MIN_ROWS", 8)
+    monkeypatch.setattr(columns, "SPARSE_PENDING", 3)
+    ds = Dataset()
+    ds.merge_arrays([f"mp-{i}" for i in range(40)], {"nsites": np.arange(40)}, policy="upsert")
+    return ds
+
+
+def test_few_values_are_stored_sparse(dataset):
+    dataset.merge_new_data({"mp-30": {"tc": 9.25}, "mp-3": {"tc": 1.5}, "mp-7": {"tc": 39.0}})
+    dataset.merge_new_data({"mp-12": {"tc": 4.0, "label": "sc"}})
+    column = dataset._store.columns["tc"]
+    assert column.sparse
+    assert dataset.schema["tc"] == "float32"
+    np.testing.assert_array_equal(dataset.having("tc"), [3, 7, 12, 30])
+    assert len(column.data.values) == 4
+    assert dataset.dataset["mp-12"]["tc"] == 4.0
+    assert dataset.dataset["mp-30"] == {"nsites": 30, "tc": 9.25}
+    values, present = dataset.column("tc")
+    np.testing.assert_array_equal(np.flatnonzero(present), [3, 7, 12, 30])
+    assert values[7] == 39.0
+
+    dataset.merge_new_data({"mp-7": {"tc": 0.1}})
+    assert dataset.schema["tc"] == "float64"
+    del dataset.dataset["mp-3"]["tc"]
+    np.testing.assert_array_equal(dataset.having("tc"), [7, 12, 30])
+    assert dataset.dataset["mp-7"]["tc"] == 0.1
+
+
+def test_sparse_column_becomes_dense(dataset):
+    report = dataset.merge_arrays([f"mp-{i}" for i in range(5)], {"tc": np.ones(5)})
+    assert report.updated == 5
+    assert dataset._store.columns["tc"].sparse
+    dataset.merge_arrays([f"mp-{i}" for i in range(3, 20)], {"tc": np.full(17, 2.0)})
+    assert not dataset._store.columns["tc"].sparse
+    np.testing.assert_array_equal(dataset.having("tc"), np.arange(20))
+    assert dataset.dataset["mp-0"]["tc"] == 1.0
+    assert dataset.dataset["mp-19"]["tc"] == 2.0
+
+
+def test_compact_makes_columns_sparse(dataset):
+    dataset.merge_new_data({"mp-1": {"label": "a"}})
+    dataset.dataset = {key: dict(value) for key, value in dataset.dataset.items()}
+    assert not dataset._store.columns["label"].sparse
+    dataset.compact()
+    assert dataset._store.columns["label"].sparse
+    assert dataset.dataset["mp-1"]["label"] == "a"
+
+
+def test_save_open_sparse(dataset, tmp_path):
+    dataset.merge_new_data({"mp-30": {"label": "x"}, "mp-3": {"label": "y"}})
+    dataset.save(str(tmp_path))
+    opened = Dataset.open(str(tmp_path), mode="c")
+    assert opened._store.columns["label"].sparse
+    assert opened.dataset == dataset.dataset
+    opened.merge_new_data({"mp-5": {"label": "x"}})
+    np.testing.assert_array_equal(opened.having("label"), [3, 5, 30])
+
+
+def test_column_at_rows(dataset):
+    dataset.merge_new_data({"mp-30": {"tc": 9.25}, "mp-3": {"tc": 1.5}, "mp-7": {"label": "sc"}})
+    assert dataset._store.columns["tc"].sparse
+    values, present = dataset.column("tc", rows=[30, 4, 3])
+    np.testing.assert_array_equal(present, [True, False, True])
+    np.testing.assert_array_equal(values[present], [9.25, 1.5])
+    values, present = dataset.column("nsites", rows=[5, 1])
+    np.testing.assert_array_equal(values, [5, 1])
+    values, present = dataset.column("label", rows=[7, 8])
+    assert dataset.categories("label")[values[0]] == "sc" and not present[1]
+
+
+def test_mixed_object_values_keep_their_types(dataset):
+    dataset.merge_new_data({"mp-1": {"note": "metallic"}, "mp-2": {"note": 7}})
+    dataset.merge_new_data({"mp-3": {"note": "insulator"}, "mp-4": {"note": True}, "mp-5": {"note": 0.5}})
+    assert dataset._store.columns["note"].sparse
+    notes = [dataset.dataset[f"mp-{i}"]["note"] for i in range(1, 6)]
+    assert notes == ["metallic", 7, "insulator", True, 0.5]
+    assert [type(note) for note in notes] == [str, int, str, bool, float]
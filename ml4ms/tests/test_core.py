@@ -0,0 +1,251 @@
+import numpy as np
+import pytest
+
+from ml4ms.core import Dataset
+
+
+@pytest.fixture
+def dataset():
+    ds = Dataset()
+    ds.dataset = {
+        "mp-1": {"formula": "Si", "band_gap": 1.1, "is_metal": False},
+        "mp-2": {"formula": "Cu", "band_gap": 0.0, "is_metal": True},
+    }
+    return ds
+
+
+def test_merge_new_data(dataset):
+    dataset.merge_new_data({"mp-1": {"band_gap": 1.2, "nsites": 2}, "mp-2": {"nsites": 1}})
+    assert dataset.dataset == {
+        "mp-1": {"formula": "Si", "band_gap": 1.2, "is_metal": False, "nsites": 2},
+        "mp-2": {"formula": "Cu", "band_gap": 0.0, "is_metal": True, "nsites": 1},
+    }
+
+
+def test_merge_new_data_unknown_id(dataset):
+    with pytest.raises(KeyError):
+        dataset.merge_new_data({"mp-3": {"band_gap": 2.0}})
+
+
+def test_columns_are_typed(dataset):
+    values, present = dataset._store.column("band_gap")
+    assert values.dtype == np.float64
+    np.testing.assert_array_equal(values, [1.1, 0.0])
+    assert dataset.schema == {"formula": "category", "band_gap": "float64", "is_metal": "bool"}
+    dataset.merge_new_data({"mp-1": {"nsites": 2}})
+    values, present = dataset._store.column("nsites")
+    assert values.dtype == np.int8
+    np.testing.assert_array_equal(present, [True, False])
+
+
+def test_schema_widens_and_downcasts(dataset):
+    dataset.merge_new_data({"mp-1": {"nsites": 2, "energy": -1.5}})
+    assert dataset.schema["nsites"] == "int8"
+    assert dataset.schema["energy"] == "float32"
+    dataset.merge_new_data({"mp-2": {"nsites": 1000, "energy": -1.25}})
+    assert dataset.schema["nsites"] == "int16"
+    assert dataset.schema["energy"] == "float32"
+    dataset.merge_new_data({"mp-2": {"energy": 0.1}})
+    assert dataset.schema["energy"] == "float64"
+    assert dataset.dataset["mp-2"]["energy"] == 0.1
+    assert dataset.dataset["mp-1"]["energy"] == -1.5
+    dataset.merge_new_data({"mp-2": {"energy": -2.0}})
+    dataset.compact()
+    assert dataset.schema["energy"] == "float32"
+    assert dataset.dataset["mp-1"]["formula"] == "Si"
+
+
+def test_pin_schema(dataset):
+    dataset.pin_schema({"band_gap": "float32", "spacegroup": "int16"})
+    assert dataset.schema["band_gap"] == "float32"
+    dataset.merge_new_data({"mp-1": {"spacegroup": 227}})
+    assert dataset.schema["spacegroup"] == "int16"
+    assert dataset.dataset["mp-1"]["band_gap"] == pytest.approx(1.1)
+    with pytest.raises(ValueError):
+        dataset.merge_new_data({"mp-1": {"spacegroup": "Fd-3m"}})
+    with pytest.raises(ValueError):
+        dataset.merge_new_data({"mp-1": {"spacegroup": 5}, "mp-2": {"spacegroup": "x"}, "mp-9": {}}, "upsert")
+    with pytest.raises(ValueError):
+        dataset.merge_arrays(["mp-9", "mp-1"], {"band_gap": [0.5, 0.5], "spacegroup": [1, 1e9]}, "upsert")
+    assert dataset.dataset["mp-1"]["spacegroup"] == 227 and "mp-9" not in dataset.dataset
+    assert dataset.dataset["mp-1"]["band_gap"] == pytest.approx(1.1)
+    with pytest.raises(ValueError):
+        dataset.pin_schema({"formula": "int8"})
+    with pytest.raises(ValueError):
+        dataset.pin_schema({"formula": "str"})
+
+
+def test_dict_view(dataset):
+    dataset.dataset["mp-3"] = {"formula": "Ge"}
+    dataset.dataset["mp-3"]["band_gap"] = 0.67
+    del dataset.dataset["mp-1"]["is_metal"]
+    assert len(dataset) == 3
+    assert "mp-3" in dataset.dataset
+    assert dict(dataset.dataset["mp-3"]) == {"formula": "Ge", "band_gap": 0.67}
+    assert dict(dataset.dataset["mp-1"]) == {"formula": "Si", "band_gap": 1.1}
+    assert Dataset().dataset == {}
+
+    dataset.dataset.update({"mp-4": {"formula": "C"}}, **{"mp-2": {"formula": "Cu"}})
+    assert dataset.dataset.setdefault("mp-5", {"band_gap": 5.5}) == {"band_gap": 5.5}
+    assert dataset.dataset.setdefault("mp-5", {}) == {"band_gap": 5.5}
+    assert list(dataset.dataset) == ["mp-1", "mp-2", "mp-3", "mp-4", "mp-5"]
+    assert dict(dataset.dataset["mp-2"]) == {"formula": "Cu"}
+    for remove in (lambda view: view.pop("mp-1"), lambda view: view.popitem(), lambda view: view.clear()):
+        with pytest.raises(TypeError):
+            remove(dataset.dataset)
+    with pytest.raises(TypeError):
+        del dataset.dataset["mp-1"]
+    assert len(dataset) == 5
+
+
+def test_mixed_types_keep_their_values(dataset):
+    dataset.merge_new_data({"mp-1": {"is_metal": "unknown"}, "mp-2": {"band_gap": 3}})
+    assert dataset.dataset["mp-1"]["is_metal"] == "unknown"
+    assert dataset.dataset["mp-2"]["is_metal"] is True
+    assert dataset.dataset["mp-2"]["band_gap"] == 3.0
+
+
+def test_merge_arrays(dataset):
+    report = dataset.merge_arrays(
+        ["mp-2", "mp-3", "mp-1"],
+        {"band_gap": np.array([0.0, 5.0, 1.3]), "nsites": np.array([1, 4, 2])},
+    )
+    assert report.matched == 2
+    assert report.updated == 2
+    assert list(report.missing) == ["mp-3"]
+    assert dataset.dataset["mp-1"]["band_gap"] == 1.3
+    assert dataset.dataset["mp-2"]["nsites"] == 1
+    assert "mp-3" not in dataset.dataset
+
+    report = dataset.merge_arrays(["mp-1", "mp-2"], {"band_gap": [1.3, 0.5]})
+    assert (report.matched, report.updated) == (2, 1)
+
+
+def test_merge_arrays_misaligned(dataset):
+    with pytest.raises(ValueError):
+        dataset.merge_arrays(["mp-1", "mp-2"], {"band_gap": [1.0]})
+    dataset.merge_new_data({"5": {"band_gap": 5.0}}, policy="upsert")
+    # numpy would turn the int 5 into the id "5"
+    with pytest.raises(TypeError):
+        dataset.merge_arrays(["mp-1", 5], {"band_gap": [1.0, 2.0]})
+    assert dataset.dataset["5"]["band_gap"] == 5.0
+
+
+def test_merge_new_data_policies(dataset):
+    before = {key: dict(value) for key, value in dataset.dataset.items()}
+    with pytest.raises(KeyError):
+        dataset.merge_new_data({"mp-1": {"band_gap": 9.9}, "mp-3": {"band_gap": 2.0}})
+    assert dataset.dataset == before
+
+    report = dataset.merge_new_data({"mp-1": {"band_gap": 1.1}, "mp-3": {"band_gap": 2.0}}, policy="skip")
+    assert (report.matched, report.updated, report.inserted, report.missing) == (1, 0, 0, ["mp-3"])
+    assert "mp-3" not in dataset.dataset
+
+    report = dataset.merge_new_data({"mp-2": {"nsites": 1}, "mp-3": {"band_gap": 2.0}}, policy="upsert")
+    assert (report.matched, report.updated, report.inserted, report.missing) == (1, 1, 1, [])
+    assert dict(dataset.dataset["mp-3"]) == {"band_gap": 2.0}
+
+    with pytest.raises(ValueError):
+        dataset.merge_new_data({}, policy="replace")
+
+
+def test_merge_arrays_upsert(dataset):
+    report = dataset.merge_arrays(["mp-4", "mp-1", "mp-3", "mp-4"], {"nsites": [1, 2, 3, 4]}, policy="upsert")
+    assert (report.matched, report.updated, report.inserted, len(report.missing)) == (1, 1, 2, 0)
+    assert list(dataset.dataset) == ["mp-1", "mp-2", "mp-4", "mp-3"]
+    assert dataset.dataset["mp-4"]["nsites"] == 4
+    assert dataset.dataset["mp-3"]["nsites"] == 3
+    with pytest.raises(KeyError):
+        dataset.merge_arrays(["mp-5"], {"nsites": [1]}, policy="strict")
+
+
+def test_merge_stream(dataset):
+    def records():
+        yield "mp-1", {"band_gap": 1.2}
+        yield "mp-3", {"formula": "Ge"}
+        yield "mp-3", {"band_gap": 0.67}
+        yield "mp-2", {"nsites": 1}
+
+    report = dataset.merge_stream(records(), chunk_size=2, policy="upsert")
+    assert (report.matched, report.updated, report.inserted) == (3, 3, 1)
+    assert dict(dataset.dataset["mp-3"]) == {"formula": "Ge", "band_gap": 0.67}
+    assert dataset.dataset["mp-1"]["band_gap"] == 1.2
+
+    with pytest.raises(KeyError):
+        dataset.merge_stream(iter([("mp-2", {"nsites": 5}), ("mp-9", {})]), chunk_size=1)
+    assert dataset.dataset["mp-2"]["nsites"] == 5
+
+
+def test_row_access(dataset):
+    assert dataset.row_of("mp-2") == 1
+    rows = dataset.rows_of(["mp-2", "mp-9", "mp-1"])
+    assert rows.dtype == np.int32
+    np.testing.assert_array_equal(rows, [1, -1, 0])
+    np.testing.assert_array_equal(dataset.material_ids, ["mp-1", "mp-2"])
+    np.testing.assert_array_equal(dataset.material_ids_of([1, 0]), ["mp-2", "mp-1"])
+    assert dataset.row(1)["formula"] == "Cu"
+    values, present = dataset.column("band_gap")
+    assert values[dataset.row_of("mp-1")] == 1.1
+    with pytest.raises(IndexError):
+        dataset.row(2)
+    with pytest.raises(KeyError):
+        dataset.row_of("mp-9")
+
+
+def test_merge_listeners(dataset):
+    calls = []
+
+    def listener(ds, rows):
+        calls.append(rows.tolist())
+
+    def named(ds, rows, names):
+        calls.append(names)
+
+    dataset.add_merge_listener(listener)
+    dataset.add_merge_listener(named, attributes=True)
+    dataset.merge_new_data({"mp-2": {"nsites": 1}, "mp-3": {"nsites": 4, "tc": 9.2}}, policy="upsert")
+    dataset.merge_arrays(["mp-1", "mp-1", "mp-9"], {"nsites": [2, 3, 5]})
+    dataset.remove_merge_listener(listener)
+    dataset.remove_merge_listener(named)
+    dataset.merge_new_data({"mp-1": {"nsites": 2}})
+    assert calls == [[1, 2], ["nsites", "tc"], [0], ["nsites"]]
+    with pytest.raises(ValueError):
+        dataset.remove_merge_listener(listener)
+
+
+def test_to_arrays():
+    ds = Dataset()
+    ds.dataset = {
+        "mp-1": {"a": 1.5, "b": 2, "e": 0.25},
+        "mp-2": {"a": 2.5, "e": 0.75, "name": "x"},
+        "mp-3": {"b": 7, "e": 1.25},
+    }
+    arrays = ds.to_arrays(["a", "b"], target="e")
+    assert arrays.X.dtype == np.float32 and arrays.X.flags.c_contiguous
+    np.testing.assert_array_equal(arrays.X, [[1.5, 2], [2.5, np.nan], [np.nan, 7]])
+    np.testing.assert_array_equal(arrays.missing, [[False, False], [False, True], [True, False]])
+    np.testing.assert_array_equal(arrays.y, [0.25, 0.75, 1.25])
+    assert not arrays.y_missing.any()
+    assert list(arrays.material_ids) == ["mp-1", "mp-2", "mp-3"]
+    assert np.shares_memory(arrays.y, ds.column("e")[0])
+
+    subset = ds.to_arrays(["b"], target="a", rows=[2, 0], dtype=np.float64)
+    np.testing.assert_array_equal(subset.X, [[7], [2]])
+    np.testing.assert_array_equal(subset.y_missing, [True, False])
+    assert subset.y.dtype == np.float64
+    assert list(subset.material_ids) == ["mp-3", "mp-1"]
+    assert ds.to_arrays(["a"]).y is None
+
+    with pytest.raises(TypeError):
+        ds.to_arrays(["name"])
+    with pytest.raises(KeyError):
+        ds.to_arrays(["nope"])
+
+
+def test_lookup_of_a_few_ids_after_inserts():
+    ds = Dataset()
+    ds.merge_arrays([f"mp-{i}" for i in range(100)], {"a": np.arange(100)}, policy="upsert")
+    ds.merge_new_data({"mp-new": {"a": -1}}, policy="upsert")
+    np.testing.assert_array_equal(ds.rows_of(["mp-new", "mp-7", "mp-x"]), [100, 7, -1])
+    report = ds.merge_arrays(["mp-7", "mp-x"], {"a": [70, 0]})
+    assert (report.matched, report.updated, report.missing.tolist()) == (1, 1, ["mp-x"])
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from ml4ms.core import Dataset
+from ml4ms.hdf5 import ingest_hdf5, read_hdf5, write_hdf5
+from ml4ms.spectra import Spectra
+
+h5py = pytest.importorskip("h5py")
+
+
+@pytest.fixture
+def dataset():
+    ds = Dataset()
+    ds.merge_new_data(
+        {
+            "mp-1": {"band_gap": 1.5, "system": "cubic", "n_atoms": 4},
+            "mp-2": {"band_gap": 0.5, "tags": ["x"]},
+            "mp-3": {"system": "hexagonal", "n_atoms": 2},
+        },
+        policy="upsert",
+    )
+    return ds
+
+
+@pytest.mark.parametrize("uniform", [True, False])
+def test_round_trip(tmp_path, dataset, uniform):
+    path = str(tmp_path / "spectra.h5")
+    n_points = [50, 50, 50] if uniform else [50, 0, 20]
+    ys = [np.random.default_rng(i).random(n) for i, n in enumerate(n_points)]
+    xs = [np.linspace(0, 1, n) for n in n_points]
+    spectra = Spectra.from_arrays(["mp-1", "mp-2", "mp-3"], ys, xs=xs)
+    write_hdf5(path, spectra, dataset, attributes=["band_gap", "system", "n_atoms"], chunk_bytes=400)
+    with h5py.File(path) as f:
+        assert f.attrs["layout"] == ("2d" if uniform else "ragged")
+        assert f["y"].chunks == ((1, 50) if uniform else (50,))
+        assert f["x"].ndim == 1
+        assert f["y"].compression == "gzip"
+
+    read, columns = read_hdf5(path)
+    assert read.material_ids == spectra.material_ids
+    np.testing.assert_array_equal(read.offsets, spectra.offsets)
+    np.testing.assert_array_equal(read.y, spectra.y)
+    np.testing.assert_array_equal(read.x, spectra.x)
+    assert columns["system"][0].tolist() == ["cubic", None, "hexagonal"]
+    np.testing.assert_array_equal(columns["band_gap"][1], [True, True, False])
+
+    read, columns = read_hdf5(path, material_ids=["mp-3", "mp-1"])
+    assert read.material_ids == ["mp-3", "mp-1"]
+    np.testing.assert_array_equal(read[0], ys[2])
+    np.testing.assert_array_equal(read.x_of(1), xs[0])
+    assert columns["n_atoms"][0].tolist() == [2, 4]
+
+    copy = Dataset()
+    report = ingest_hdf5(path, copy, x="q")
+    assert report.inserted == 3
+    np.testing.assert_array_equal(copy.dataset["mp-3"]["intensity"], ys[2])
+    assert copy.dataset["mp-1"]["system"] == "cubic" and "system" not in copy.dataset["mp-2"]
+
+
+def test_rejects_object_attributes(tmp_path, dataset):
+    spectra = Spectra.from_arrays(["mp-2"], [[1.0]])
+    with pytest.raises(TypeError):
+        write_hdf5(str(tmp_path / "spectra.h5"), spectra, dataset, attributes=["tags"])
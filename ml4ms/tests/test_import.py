@@ -0,0 +1,31 @@
+import subprocess
+import sys
+
+import pytest
+
+# the time "import ml4ms" may take in a fresh interpreter, in seconds
+IMPORT_BUDGET = 0.5
+
+SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import ml4ms
+print(time.perf_counter() - start)
+print("ml4ms._version" in sys.modules)
+"""
+
+
+def test_import_is_fast():
+    output = subprocess.run([sys.executable, "-c", SCRIPT], capture_output=True, text=True, check=True)
+    seconds, version_loaded = output.stdout.split()
+    assert version_loaded == "False"
+    assert float(seconds) < IMPORT_BUDGET
+
+
+def test_version_is_resolved_lazily():
+    import ml4ms
+
+    assert isinstance(ml4ms.__version__, str)
+    assert "__version__" in vars(ml4ms)
+    with pytest.raises(AttributeError):
+        ml4ms.not_an_attribute
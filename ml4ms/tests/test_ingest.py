@@ -0,0 +1,112 @@
+import os
+
+import numpy as np
+import pytest
+
+from ml4ms.core import Dataset
+from ml4ms.ingest import Manifest, find_spectra, ingest_directory, read_spectrum
+
+
+@pytest.fixture
+def tree(tmp_path):
+    (tmp_path / "run1").mkdir()
+    (tmp_path / "run2" / "deep").mkdir(parents=True)
+    x = np.linspace(1, 10, 7)
+    np.savetxt(tmp_path / "run1" / "a.xy", np.column_stack([x, x**2]), header="q I")
+    with open(tmp_path / "run1" / "b.chi", "w") as f:
+        f.write("sample b\n2-theta\nintensity\n       3\n 1.0 5.0\n 2.0 6.0\n 3.0 7.0\n")
+    with open(tmp_path / "run2" / "deep" / "c.gr", "w") as f:
+        f.write("[PDFgetX3]\nwavelength = 0.1\n#### start data\n#L r G\n0.5 0.1 0.01\n1.0 0.2 0.01\n\n")
+    (tmp_path / "run2" / "notes.txt").write_text("1 2\n")
+    return tmp_path
+
+
+def test_read_spectrum(tree):
+    x, y = read_spectrum(str(tree / "run1" / "b.chi"))
+    np.testing.assert_array_equal(x, [1, 2, 3])
+    np.testing.assert_array_equal(y, [5, 6, 7])
+    x, y = read_spectrum(str(tree / "run2" / "deep" / "c.gr"))
+    np.testing.assert_array_equal(y, [0.1, 0.2])
+
+
+@pytest.mark.parametrize("processes", [0, 2])
+def test_ingest_directory(tree, processes):
+    assert len(find_spectra(str(tree))) == 3
+    ds = Dataset()
+    ds.dataset = {"run1/a": {"temperature": 300}}
+    spectra = ingest_directory(str(tree), ds, processes=processes, chunk_size=2)
+    assert spectra.material_ids == ["run1/a", "run1/b", "run2/deep/c"]
+    assert list(ds.dataset) == ["run1/a", "run1/b", "run2/deep/c"]
+    a = ds.dataset["run1/a"]
+    assert a["temperature"] == 300
+    np.testing.assert_allclose(a["intensity"], a["q"] ** 2)
+    np.testing.assert_array_equal(ds.dataset["run2/deep/c"]["q"], [0.5, 1.0])
+
+
+def test_unreadable_files(tree):
+    (tree / "run1" / "empty.xy").write_text("# nothing\n")
+    with pytest.raises(ValueError):
+        ingest_directory(str(tree), processes=0)
+    with pytest.warns(UserWarning):
+        spectra = ingest_directory(str(tree), processes=0, errors="skip", material_id=lambda path: path)
+    assert len(spectra) == 3 and not any(i.endswith("empty.xy") for i in spectra.material_ids)
+
+
+def test_manifest_skips_unchanged_files(tree, tmp_path_factory):
+    saved = tmp_path_factory.mktemp("saved")
+    ds = Dataset()
+    first = ingest_directory(str(tree), ds, processes=0, manifest=str(saved))
+    assert len(first) == 3
+    assert (saved / "manifest.json").exists()
+    assert len(ingest_directory(str(tree), ds, processes=0, manifest=str(saved))) == 0
+
+    a = tree / "run1" / "a.xy"
+    os.utime(a, ns=(1, 1))  # touched, same content
+    with open(tree / "run1" / "b.chi", "a") as f:
+        f.write(" 4.0 8.0\n")
+    (tree / "run2" / "deep" / "c.gr").unlink()
+    np.savetxt(tree / "run2" / "d.xy", [[1.0, 2.0]])
+    manifest = Manifest(str(saved))
+    again = ingest_directory(str(tree), ds, processes=0, manifest=manifest)
+    assert again.material_ids == ["run1/b", "run2/d"]
+    assert manifest.removed == [os.path.join("run2", "deep", "c.gr")]
+    np.testing.assert_array_equal(ds.dataset["run1/b"]["intensity"], [5, 6, 7, 8])
+    assert len(ds) == 4
+    assert len(ingest_directory(str(tree), ds, processes=0, manifest=str(saved))) == 0
+
+
+def test_manifest_keeps_files_left_out_of_the_merge(tree, tmp_path_factory):
+    saved = str(tmp_path_factory.mktemp("saved"))
+    ds = Dataset()
+    ds.dataset = {"run1/a": {"temperature": 300}}
+    ingest_directory(str(tree), ds, processes=0, policy="skip", manifest=saved, save=saved)
+    assert list(ds.dataset) == ["run1/a"]
+    ds = Dataset.open(saved, mode="c")
+    ds.merge_new_data({"run1/b": {}}, policy="upsert")
+    again = ingest_directory(str(tree), ds, processes=0, policy="skip", manifest=saved, save=saved)
+    assert again.material_ids == ["run1/b", "run2/deep/c"]
+    np.testing.assert_array_equal(Dataset.open(saved).dataset["run1/b"]["intensity"], [5, 6, 7])
+
+
+def test_manifest_is_written_after_the_dataset_is_saved(tree, tmp_path_factory, monkeypatch):
+    saved = tmp_path_factory.mktemp("saved")
+
+    def crash(self, path):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(Dataset, "save", crash)
+    with pytest.raises(OSError):
+        ingest_directory(str(tree), Dataset(), processes=0, manifest=str(saved), save=str(saved))
+    assert not (saved / "manifest.json").exists()
+    monkeypatch.undo()
+    assert len(ingest_directory(str(tree), Dataset(), processes=0, manifest=str(saved), save=str(saved))) == 3
+    assert (
+        len(ingest_directory(str(tree), Dataset.open(str(saved), mode="c"), processes=0, manifest=str(saved))) == 0
+    )
+
+
+def test_manifest_is_not_written_without_a_dataset(tree, tmp_path_factory):
+    saved = tmp_path_factory.mktemp("saved")
+    assert len(ingest_directory(str(tree), None, processes=0, manifest=str(saved))) == 3
+    assert not (saved / "manifest.json").exists()
+    assert len(ingest_directory(str(tree), Dataset(), processes=0, manifest=str(saved))) == 3
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from ml4ms import columns
+from ml4ms.core import Dataset
+from ml4ms.loader import BatchLoader
+
+
+@pytest.fixture
+def dataset():
+    rng = np.random.default_rng(0)
+    ds = Dataset()
+    ds.dataset = {
+        f"mp-{i}": {"a": float(i), "b": i % 3, "e": i / 2, "intensity": rng.random(1 + (i * 7) % 13)}
+        for i in range(50)
+    }
+    return ds
+
+
+@pytest.mark.parametrize("prefetch", [0, 3])
+def test_batches_cover_every_row_once(dataset, prefetch):
+    loader = BatchLoader(
+        dataset, features=["a", "b"], target="e", batch_size=8, shuffle=True, seed=1, prefetch=prefetch
+    )
+    batches = list(loader)
+    assert len(batches) == len(loader) == 7
+    assert [len(batch.rows) for batch in batches] == [8] * 6 + [2]
+    rows = np.concatenate([batch.rows for batch in batches])
+    assert sorted(rows) == list(range(50))
+    assert list(rows) != list(range(50))
+    for batch in batches:
+        np.testing.assert_array_equal(batch.X[:, 0], batch.rows)
+        np.testing.assert_array_equal(batch.y, batch.rows / 2)
+        assert list(batch.material_ids) == [f"mp-{row}" for row in batch.rows]
+        assert batch.spectra is None
+
+
+def test_epochs_reshuffle_reproducibly(dataset):
+    first = [batch.rows for batch in BatchLoader(dataset, ["a"], batch_size=8, shuffle=True, seed=3)]
+    loader = BatchLoader(dataset, ["a"], batch_size=8, shuffle=True, seed=3)
+    epoch_1, epoch_2 = [np.concatenate([batch.rows for batch in loader]) for _ in range(2)]
+    np.testing.assert_array_equal(epoch_1, np.concatenate(first))
+    assert list(epoch_1) != list(epoch_2)
+
+
+def test_padding_and_bucketing(dataset):
+    loader = BatchLoader(
+        dataset, spectra="intensity", batch_size=10, drop_last=True, rows=np.arange(45), pad_value=-1
+    )
+    batches = list(loader)
+    assert len(batches) == len(loader) == 4
+    for batch in batches:
+        assert batch.X is None
+        assert batch.spectra.shape == (10, batch.lengths.max())
+        for row, padded, length in zip(batch.rows, batch.spectra, batch.lengths):
+            np.testing.assert_array_equal(padded[:length], dataset.row(row)["intensity"])
+            assert (padded[length:] == -1).all()
+
+    def padding(loader):
+        return sum(batch.spectra.size - batch.lengths.sum() for batch in loader)
+
+    bucketed = BatchLoader(dataset, spectra="intensity", batch_size=10, shuffle=True, seed=0, bucket_size=5)
+    plain = BatchLoader(dataset, spectra="intensity", batch_size=10, shuffle=True, seed=0)
+    assert padding(bucketed) < padding(plain)
+    assert sorted(np.concatenate([batch.rows for batch in bucketed])) == list(range(50))
+
+
+def test_workers_read_pending_sparse_values(monkeypatch):
+    monkeypatch.setattr(columns, "SPARSE_MIN_ROWS", 8)
+    ds = Dataset()
+    ds.merge_arrays([f"mp-{i}" for i in range(4096)], {"a": np.arange(4096.0)}, policy="upsert")
+    for _ in range(20):
+        for i in range(0, 4096, 8):
+            ds.merge_new_data({f"mp-{i}": {"tc": float(i)}})
+        assert ds._store.columns["tc"]._pending
+        loader = BatchLoader(ds, features=["tc"], batch_size=64, prefetch=8, workers=8)
+        seen = np.concatenate([batch.X[~batch.missing[:, 0], 0] for batch in loader])
+        np.testing.assert_array_equal(seen, np.arange(0, 4096, 8))
+        for i in range(0, 4096, 8):
+            del ds.dataset[f"mp-{i}"]["tc"]
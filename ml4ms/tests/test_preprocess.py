@@ -0,0 +1,76 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from ml4ms.preprocess import Crop, Normalize, Pipeline, PolynomialBaseline, RollingMinimumBaseline
+from ml4ms.spectra import Spectra
+
+
+@pytest.fixture
+def spectra():
+    x = np.linspace(0, 10, 101)
+    return Spectra.from_arrays(
+        ["mp-1", "mp-2", "mp-3"],
+        [2 + 0.5 * x + np.exp(-((x - 5) ** 2)), 4 * np.exp(-((x - 3) ** 2)), []],
+        xs=[x, x, []],
+    )
+
+
+def test_normalize(spectra):
+    y = spectra.y
+    result = Normalize("max")(spectra)
+    assert result.y is y
+    np.testing.assert_allclose(result.max()[:2], [1.0, 1.0])
+    result = Normalize("area")(spectra)
+    for i in range(2):
+        x, y = result.x_of(i), result[i]
+        np.testing.assert_allclose(np.sum(np.diff(x) * (y[1:] + y[:-1]) / 2), 1.0)
+    with pytest.raises(ValueError):
+        Normalize("sum")
+
+
+def test_crop(spectra):
+    result = Crop(2.0, 4.0)(spectra)
+    np.testing.assert_array_equal(result.lengths, [21, 21, 0])
+    np.testing.assert_allclose(result.x_of(1)[[0, -1]], [2.0, 4.0])
+
+
+def test_polynomial_baseline(spectra):
+    x = spectra.x_of(0)
+    line = Spectra.from_arrays(["a", "b"], [3 - 2 * x + x**2, np.ones(4)], xs=[x, np.arange(4.0)])
+    result = PolynomialBaseline(degree=2)(line)
+    np.testing.assert_allclose(result.y, 0.0, atol=1e-9)
+
+
+def test_polynomial_baseline_memory():
+    n, m = 4096, 100
+    x = np.tile(np.linspace(0, 10, m), n)
+    y = np.random.default_rng(0).random(n * m)
+    spectra = Spectra([f"mp-{i}" for i in range(n)], y, np.arange(n + 1) * m, x=x)
+    expected = y - PolynomialBaseline(degree=3, chunk_size=n).baseline(spectra)
+    tracemalloc.start()
+    try:
+        result = PolynomialBaseline(degree=3, chunk_size=256)(spectra)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert result.y is y
+    # a few chunk-sized arrays, rather than several copies of y
+    assert peak < 0.5 * y.nbytes
+    np.testing.assert_allclose(result.y, expected, atol=1e-9)
+
+
+def test_rolling_minimum_baseline():
+    spectra = Spectra.from_arrays(["a", "b"], [[5.0, 1.0, 5.0, 5.0, 5.0], [0.0, 9.0, 9.0]])
+    baseline = RollingMinimumBaseline(window=3).baseline(spectra)
+    np.testing.assert_array_equal(baseline, [1.0, 1.0, 1.0, 5.0, 5.0, 0.0, 0.0, 9.0])
+
+
+def test_pipeline_copies_read_only_spectra(spectra):
+    spectra.y.flags.writeable = False
+    pipeline = Pipeline([Crop(xmin=1.0), Pipeline([RollingMinimumBaseline(11), Normalize("max")])])
+    result = pipeline(spectra)
+    assert result.y.flags.writeable
+    np.testing.assert_allclose(result.max()[:2], [1.0, 1.0])
+    assert result.y.min() >= 0.0
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+from ml4ms.core import Dataset
+from ml4ms.query import Field, QueryEngine
+
+ELEMENTS = ["Li", "Fe", "O", "Na", "Cl"]
+
+
+@pytest.fixture
+def dataset():
+    rng = np.random.default_rng(0)
+    ds = Dataset()
+    ds.dataset = {
+        f"mp-{i}": {
+            "band_gap": round(float(rng.uniform(0, 6)), 2),
+            "crystal_system": ["cubic", "hexagonal", "monoclinic"][i % 3],
+            "elements": sorted(set(rng.choice(ELEMENTS, 2).tolist())),
+        }
+        for i in range(300)
+    }
+    return ds
+
+
+def brute_force(dataset, test):
+    return [material_id for material_id, material in dataset.dataset.items() if test(material)]
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_queries_match_brute_force(dataset, indexed):
+    dataset.merge_new_data({"mp-3": {"band_gap": float("nan")}})
+    engine = QueryEngine(dataset)
+    if indexed:
+        engine.create_index("band_gap")
+        engine.create_index("crystal_system")
+    gap, system, elements = Field("band_gap"), Field("crystal_system"), Field("elements")
+    cases = [
+        (gap.between(1, 3), lambda m: 1 <= m["band_gap"] <= 3),
+        ((gap > 1) & (gap < 3), lambda m: 1 < m["band_gap"] < 3),
+        (gap.between(1, 3) & elements.contains("Li"), lambda m: 1 <= m["band_gap"] <= 3 and "Li" in m["elements"]),
+        (gap >= 5, lambda m: m["band_gap"] >= 5),
+        (gap > 5.5, lambda m: m["band_gap"] > 5.5),
+        (system == "cubic", lambda m: m["crystal_system"] == "cubic"),
+        (system != "cubic", lambda m: m["crystal_system"] != "cubic"),
+        (
+            system.isin(["cubic", "monoclinic"]) | (gap >= 5.5),
+            lambda m: m["crystal_system"] != "hexagonal" or m["band_gap"] >= 5.5,
+        ),
+        (
+            ~(gap <= 2) & (system == "hexagonal"),
+            lambda m: m["band_gap"] > 2 and m["crystal_system"] == "hexagonal",
+        ),
+        (system == "triclinic", lambda m: False),
+        (Field("volume").exists() | (gap == 0.5), lambda m: m["band_gap"] == 0.5),
+    ]
+    for predicate, test in cases:
+        rows = engine.rows(predicate)
+        assert rows.dtype == np.int32
+        assert np.all(np.diff(rows) > 0)
+        assert list(engine.material_ids(predicate)) == brute_force(dataset, test), predicate
+
+
+def test_planner_and_index_maintenance(dataset):
+    engine = QueryEngine(dataset)
+    engine.create_index("band_gap")
+    engine.create_index("crystal_system")
+    predicate = (
+        Field("elements").contains("Li") & (Field("crystal_system") == "cubic") & Field("band_gap").between(1, 1.2)
+    )
+    plan = engine.explain(predicate).splitlines()
+    assert "sorted index" in plan[1] and "hash index" in plan[2] and plan[3].strip().startswith("scan")
+
+    before = engine.count(Field("band_gap") > 10)
+    dataset.merge_new_data(
+        {"mp-new": {"band_gap": 11.0, "crystal_system": "cubic", "elements": ["Li"]}}, policy="upsert"
+    )
+    assert engine.count(Field("band_gap") > 10) == before + 1
+    assert "mp-new" in engine.material_ids((Field("crystal_system") == "cubic") & Field("elements").contains("Li"))
+    engine.close()
+    with pytest.raises(TypeError):
+        engine.create_index("crystal_system", kind="sorted")
+
+
+@pytest.mark.parametrize("composition", ["elements", "formula"])
+def test_element_index(composition):
+    ds = Dataset()
+    ds.dataset = {
+        "mp-1": {"elements": ["Li", "O"], "formula": "Li2O"},
+        "mp-2": {"elements": ["Li", "Fe", "O"], "formula": "LiFeO2"},
+        "mp-3": {"elements": ["Fe", "O"], "formula": "Fe2O3"},
+        "mp-4": {"elements": ["Os"], "formula": "Os"},
+        "mp-5": {"band_gap": 1.0},
+    }
+    indexed, scanned = QueryEngine(ds), QueryEngine(ds)
+    indexed.create_index(composition, kind="elements")
+    field = Field(composition)
+    cases = [
+        (field.has_elements(["O"]), ["mp-1", "mp-2", "mp-3"]),
+        (field.has_elements(["Li", "O"], exclude=["Fe"]), ["mp-1"]),
+        (field.chemical_system("O-Fe"), ["mp-3"]),
+        (field.chemical_system("Li-O"), ["mp-1"]),
+        (field.has_elements(["Os"]), ["mp-4"]),
+        (field.has_elements(["Cl"]), []),
+        (~field.has_elements(["Fe"]), ["mp-1", "mp-4", "mp-5"]),
+    ]
+    for predicate, expected in cases:
+        assert "elements index" in indexed.explain(predicate)
+        assert list(indexed.material_ids(predicate)) == expected, predicate
+        assert list(scanned.material_ids(predicate)) == expected, predicate
+
+    index = indexed.index(composition)
+    rebuilds = []
+    indexed._build = rebuilds.append
+    new = {"elements": ["Li", "Cl"], "formula": "LiCl"}
+    ds.merge_new_data({"mp-3": {"elements": ["Na", "Cl"], "formula": "NaCl"}, "mp-6": new}, policy="upsert")
+    assert indexed.index(composition) is index and not rebuilds
+    assert list(indexed.material_ids(field.has_elements(["Cl"]))) == ["mp-3", "mp-6"]
+    assert list(indexed.material_ids(field.has_elements(["Fe"]))) == ["mp-2"]
+    assert index.count(["Li"]) == 3
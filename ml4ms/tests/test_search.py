@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+
+from ml4ms.search import IVFIndex, SpectralIndex, normalize_rows, recall
+from ml4ms.spectra import Spectra
+
+
+@pytest.fixture
+def library():
+    rng = np.random.default_rng(0)
+    return rng.random((50, 20)), [f"mp-{i}" for i in range(50)]
+
+
+@pytest.mark.parametrize("metric", ["cosine", "pearson"])
+def test_query_matches_brute_force(library, metric):
+    vectors, ids = library
+    index = SpectralIndex(vectors, ids, metric=metric)
+    queries = vectors[[3, 17]] * 2.0 + 0.01
+    found, scores = index.query(queries, k=5, block_size=7)
+    if metric == "pearson":
+        expected = np.corrcoef(queries, vectors)[:2, 2:]
+    else:
+        expected = normalize_rows(queries, "cosine") @ normalize_rows(vectors, "cosine").T
+    for i in range(2):
+        best = np.argsort(-expected[i])[:5]
+        assert list(found[i]) == [ids[j] for j in best]
+        np.testing.assert_allclose(scores[i], expected[i, best], rtol=1e-5)
+    assert found[0][0] == "mp-3"
+
+
+def test_single_query_and_small_library(library):
+    vectors, ids = library
+    index = SpectralIndex(vectors[:3], ids[:3])
+    found, scores = index.query(vectors[1], k=10)
+    assert found.shape == (3,)
+    assert found[0] == "mp-1"
+    assert scores[0] == pytest.approx(1.0)
+
+
+def test_from_spectra_and_save_open(tmp_path):
+    x = np.linspace(0, 10, 200)
+    spectra = Spectra.from_arrays(
+        ["a", "b", "c"],
+        [np.exp(-((x - c) ** 2)) for c in (2, 5, 8)],
+        xs=[x, x, x],
+    )
+    grid = np.linspace(0, 10, 64)
+    index = SpectralIndex.from_spectra(spectra, grid, metric="pearson")
+    index.save(str(tmp_path))
+    opened = SpectralIndex.open(str(tmp_path))
+    assert isinstance(opened.vectors, np.memmap)
+    found, _ = opened.query(np.exp(-((grid - 5.1) ** 2)), k=1)
+    assert list(found) == ["b"]
+
+
+def test_from_dataset():
+    from ml4ms.core import Dataset
+
+    x = np.linspace(0, 10, 50)
+    ds = Dataset()
+    ds.dataset = {f"mp-{c}": {"q": x, "intensity": np.exp(-((x - c) ** 2))} for c in range(1, 9)}
+    index = SpectralIndex.from_dataset(ds, np.linspace(0, 10, 40))
+    found, _ = index.query(np.exp(-((np.linspace(0, 10, 40) - 4) ** 2)), k=2)
+    assert found[0] == "mp-4"
+
+
+@pytest.fixture
+def clustered():
+    rng = np.random.default_rng(1)
+    centers = rng.normal(size=(20, 32))
+    vectors = centers[rng.integers(0, 20, 2000)] + 0.3 * rng.normal(size=(2000, 32))
+    return vectors, [f"mp-{i}" for i in range(2000)]
+
+
+def test_ivf_recall(clustered):
+    vectors, ids = clustered
+    queries = vectors[:50] + 0.05
+    exact, _ = SpectralIndex(vectors, ids).query(queries, k=10)
+    index = IVFIndex(n_lists=32, nprobe=4)
+    index.add(vectors, ids)
+    assert len(index) == 2000
+    approximate, scores = index.query(queries, k=10)
+    assert approximate.shape == (50, 10)
+    assert np.all(np.diff(scores, axis=1) <= 0)
+    assert recall(approximate, exact) > 0.9
+    approximate, _ = index.query(queries, k=10, nprobe=32)
+    assert recall(approximate, exact) == 1.0
+
+
+def test_ivf_add_replaces_and_pads():
+    index = IVFIndex(n_lists=8)
+    index.add(np.eye(4), ["a", "b", "c", "d"])
+    assert len(index.centroids) == 4
+    index.add(np.array([[0.0, 0.0, 0.0, 1.0]]), ["a"])
+    found, scores = index.query([0.0, 0.0, 0.0, 1.0], k=6, nprobe=4)
+    assert len(index) == 4
+    assert list(found[:2]) == ["a", "d"] or list(found[:2]) == ["d", "a"]
+    assert list(found[4:]) == [None, None]
+    assert np.isneginf(scores[4:]).all()
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_ivf_watch(tmp_path, backend):
+    from ml4ms.core import Dataset
+    from ml4ms.sqlite import SQLiteDataset
+
+    x = np.linspace(0, 10, 50)
+    grid = np.linspace(0, 10, 40)
+    ds = Dataset() if backend == "memory" else SQLiteDataset(str(tmp_path / "materials.db"))
+    index = IVFIndex(n_lists=8, nprobe=8)
+    listener = index.watch(ds, grid)
+    ds.merge_new_data({"mp-0": {"temperature": 300}}, policy="upsert")
+    assert len(index) == 0
+    ds.merge_new_data({"mp-1": {"q": x, "intensity": np.exp(-((x - 1) ** 2))}}, policy="upsert")
+    assert len(index.centroids) == 1
+    ds.merge_new_data({f"mp-{c}": {"q": x, "intensity": np.exp(-((x - c) ** 2))} for c in range(2, 5)}, "upsert")
+    assert len(index) == 4 and len(index.centroids) == 4
+    ds.merge_new_data({"mp-7": {"q": x, "intensity": np.exp(-((x - 7) ** 2))}}, policy="upsert")
+    found, _ = index.query(np.exp(-((grid - 7) ** 2)), k=1)
+    assert list(found) == ["mp-7"]
+    ds.remove_merge_listener(listener)
+    ds.merge_new_data({"mp-9": {"q": x, "intensity": np.exp(-((x - 9) ** 2))}}, policy="upsert")
+    assert len(index) == 5
+
+
+def test_ivf_query_time_does_not_grow_with_the_library():
+    import time
+
+    def query_time(n, n_lists):
+        vectors = np.random.default_rng(0).random((n, 16)).astype(np.float32)
+        index = IVFIndex(n_lists=n_lists, nprobe=1)
+        index.train(vectors[: 16 * n_lists])
+        index.add(vectors, [f"mp-{i}" for i in range(n)])
+        best = np.inf
+        for _ in range(20):
+            start = time.perf_counter()
+            index.query(vectors[0], k=5)
+            best = min(best, time.perf_counter() - start)
+        return best
+
+    # the same number of rows per list, so a probe scores as many rows in both
+    assert query_time(100000, 400) < 8 * query_time(1000, 4)
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from ml4ms.core import Dataset
+from ml4ms.spectra import Spectra
+
+
+@pytest.fixture
+def spectra():
+    return Spectra.from_arrays(
+        ["mp-1", "mp-2", "mp-3"],
+        [[1.0, 3.0, 2.0], [], [4.0, 0.0]],
+        xs=[[0.1, 0.2, 0.3], [], [1.0, 2.0]],
+    )
+
+
+def test_packing(spectra):
+    np.testing.assert_array_equal(spectra.offsets, [0, 3, 3, 5])
+    np.testing.assert_array_equal(spectra.y, [1.0, 3.0, 2.0, 4.0, 0.0])
+    np.testing.assert_array_equal(spectra.lengths, [3, 0, 2])
+    np.testing.assert_array_equal(spectra.segment_ids, [0, 0, 0, 2, 2])
+    x, y = spectra.spectrum("mp-3")
+    np.testing.assert_array_equal(x, [1.0, 2.0])
+    assert np.shares_memory(y, spectra.y)
+    y[0] = 5.0
+    assert spectra.y[3] == 5.0
+
+
+def test_batch_operations(spectra):
+    np.testing.assert_array_equal(spectra.max(), [3.0, np.nan, 4.0])
+    np.testing.assert_array_equal(spectra.sum(), [6.0, 0.0, 4.0])
+    np.testing.assert_array_equal(spectra.mean()[[0, 2]], [2.0, 2.0])
+    np.testing.assert_array_equal(spectra.broadcast([1, 2, 3]), [1, 1, 1, 3, 3])
+
+
+def test_take(spectra):
+    taken = spectra.take([2, 0])
+    assert taken.material_ids == ["mp-3", "mp-1"]
+    np.testing.assert_array_equal(taken.y, [4.0, 0.0, 1.0, 3.0, 2.0])
+    np.testing.assert_array_equal(taken.x_of(1), [0.1, 0.2, 0.3])
+
+
+def test_from_dataset():
+    ds = Dataset()
+    ds.dataset = {
+        "mp-1": {"q": [1.0, 2.0], "intensity": [5.0, 6.0]},
+        "mp-2": {"band_gap": 1.0},
+        "mp-3": {"q": [1.0], "intensity": np.array([7.0])},
+    }
+    spectra = Spectra.from_dataset(ds, y="intensity", x="q")
+    assert spectra.material_ids == ["mp-1", "mp-3"]
+    np.testing.assert_array_equal(spectra.y, [5.0, 6.0, 7.0])
+    np.testing.assert_array_equal(spectra.x, [1.0, 2.0, 1.0])
+
+
+def test_save_open(spectra, tmp_path):
+    spectra.save(str(tmp_path))
+    opened = Spectra.open(str(tmp_path))
+    assert isinstance(opened.y, np.memmap)
+    assert opened.material_ids == spectra.material_ids
+    np.testing.assert_array_equal(opened.x, spectra.x)
+
+
+def test_regrid_linear():
+    rng = np.random.default_rng(0)
+    xs = [np.sort(rng.uniform(0, 10, n)) for n in (5, 50, 1, 0, 20)]
+    ys = [rng.normal(size=len(x)) for x in xs]
+    spectra = Spectra.from_arrays(list("abcde"), ys, xs=xs)
+    grid = np.linspace(-1, 11, 97)
+    out = np.empty((5, 97))
+    result = spectra.regrid(grid, out=out, chunk_size=2)
+    assert result is out
+    for i in (0, 1, 4):
+        expected = np.interp(grid, xs[i], ys[i], left=np.nan, right=np.nan)
+        np.testing.assert_allclose(result[i], expected)
+    assert np.isnan(result[[2, 3]]).all()
+    # grid points on the samples, the first and last included, give the samples back
+    np.testing.assert_allclose(spectra.take([1]).regrid(xs[1])[0], ys[1])
+
+
+def test_regrid_cubic():
+    x = np.linspace(0, 4, 9)
+    spectra = Spectra.from_arrays(["a", "b"], [x**2, 3 * x - 1], xs=[x, x])
+    grid = np.linspace(0.5, 3.5, 13)
+    result = spectra.regrid(grid, kind="cubic", fill=0.0, chunk_size=1)
+    np.testing.assert_allclose(result[0], grid**2)
+    np.testing.assert_allclose(result[1], 3 * grid - 1)
+    assert spectra.regrid([-1.0, 5.0], kind="cubic", fill=0.0).tolist() == [[0.0, 0.0], [0.0, 0.0]]
+    with pytest.raises(ValueError):
+        spectra.regrid(grid, kind="quadratic")
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from ml4ms.core import Dataset
+from ml4ms.splits import kfold, split
+
+
+@pytest.fixture
+def dataset():
+    ds = Dataset()
+    ds.dataset = {
+        f"mp-{i}": {
+            "system": ["Fe-O", "Li-O", "Na-Cl", "Si"][i % 4] + str(i % 25),
+            "phase": "cubic" if i % 5 else "hex",
+            "gap": i / 10,
+        }
+        for i in range(400)
+    }
+    return ds
+
+
+def test_random_split(dataset):
+    parts = split(dataset, seed=0)
+    assert list(parts) == ["train", "validation", "test"]
+    assert [len(rows) for rows in parts.values()] == [320, 40, 40]
+    np.testing.assert_array_equal(np.sort(np.concatenate(list(parts.values()))), np.arange(400))
+    assert parts["train"].dtype == np.int32
+    assert list(parts.material_ids("test")) == [f"mp-{row}" for row in parts["test"]]
+    np.testing.assert_array_equal(parts.to_arrays("test", ["gap"]).X[:, 0], parts["test"] / 10)
+    np.testing.assert_array_equal(split(dataset, seed=0)["test"], parts["test"])
+
+
+def test_stratified_split(dataset):
+    parts = split(dataset, fractions=(0.5, 0.5), names=("a", "b"), stratify="phase", seed=1)
+    for rows in parts.values():
+        assert (np.array([dataset.row(row)["phase"] for row in rows]) == "hex").sum() == 40
+    binned = split(dataset, fractions=(0.75, 0.25), names=("a", "b"), stratify="gap", bins=4, seed=2)
+    assert np.histogram(binned["b"], bins=4, range=(0, 400))[0].tolist() == [25, 25, 25, 25]
+
+
+def test_group_split_keeps_groups_together(dataset):
+    parts = split(dataset, groups="system", seed=3)
+    systems = [{dataset.row(row)["system"] for row in rows} for rows in parts.values()]
+    assert not systems[0] & systems[1] and not systems[0] & systems[2] and not systems[1] & systems[2]
+    assert 240 <= len(parts["train"]) <= 400
+    keys = np.arange(400) // 10
+    parts = split(dataset, groups=keys, seed=3, fractions=(0.5, 0.5), names=("a", "b"))
+    assert not set(keys[parts["a"]]) & set(keys[parts["b"]])
+
+
+def test_kfold(dataset):
+    folds = list(kfold(dataset, n_folds=8, stratify="phase", seed=0))
+    assert len(folds) == 8
+    tests = np.concatenate([fold["test"] for fold in folds])
+    np.testing.assert_array_equal(np.sort(tests), np.arange(400))
+    for fold in folds:
+        assert len(fold["test"]) == 50
+        assert not np.intersect1d(fold["train"], fold["test"]).size
+        assert len(fold["train"]) + len(fold["test"]) == 400
+    for fold in kfold(dataset, n_folds=5, groups="system", seed=0, rows=np.arange(200)):
+        assert not {dataset.row(r)["system"] for r in fold["train"]} & {
+            dataset.row(r)["system"] for r in fold["test"]
+        }
+    with pytest.raises(ValueError):
+        split(dataset, stratify="phase", groups="system")
+    with pytest.raises(ValueError):
+        split(dataset, fractions=(0.5, 0.4))
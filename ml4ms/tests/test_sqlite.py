@@ -0,0 +1,87 @@
+import threading
+
+import numpy as np
+import pytest
+
+from ml4ms.core import Dataset
+from ml4ms.sqlite import SQLiteDataset
+
+
+def test_matches_in_memory_dataset(tmp_path, snapshot):
+    path = str(tmp_path / "materials.db")
+    sq, ds = SQLiteDataset(path), Dataset()
+    new_data = {
+        "mp-1": {"band_gap": 1.5, "system": "cubic", "stable": True, "spectrum": np.arange(3.0)},
+        "mp-2": {"band_gap": float("nan"), "system": "hexagonal", "tags": ["x", 1]},
+    }
+    for dataset in (sq, ds):
+        assert dataset.merge_new_data(new_data, policy="upsert") == (0, 0, 2, [])
+        report = dataset.merge_new_data({"mp-2": {"band_gap": 2.0}, "mp-1": {"band_gap": 1.5}, "mp-9": {}}, "skip")
+        assert report == (2, 1, 0, ["mp-9"])
+        report = dataset.merge_arrays(["mp-3", "mp-1"], {"n_atoms": [4, 8]}, policy="upsert")
+        assert (report.matched, report.updated, report.inserted) == (1, 1, 1)
+    assert snapshot(sq) == snapshot(ds)
+    assert sq.material_ids.tolist() == ["mp-1", "mp-2", "mp-3"]
+    assert sq.schema == {**ds.schema, "system": "category"}
+    assert sq.rows_of(["mp-3", "mp-0"]).tolist() == [2, -1]
+    assert "mp-2" in sq.dataset and "mp-0" not in sq.dataset
+    for dataset in (sq, ds):
+        dataset.merge_new_data({"mp-4": {}}, policy="upsert")
+    assert sq.row(3) == {}
+    with pytest.raises(IndexError):
+        sq.row(4)
+    with pytest.raises(KeyError):
+        sq.dataset["mp-0"]
+
+    values, present = sq.column("system")
+    assert [sq.categories("system")[code] for code in values[present]] == ["cubic", "hexagonal"]
+    values, present = sq.column("n_atoms", rows=[2, 1])
+    assert values.tolist()[0] == 4 and present.tolist() == [True, False]
+    values, present = sq.column("spectrum", rows=[0, 2, 0])
+    assert values[0].tolist() == [0.0, 1.0, 2.0] and present.tolist() == [True, False, True]
+    values, present = sq.column("system", rows=[1])
+    assert sq.categories("system")[values[0]] == "hexagonal"
+    assert sq.material_ids_of([2, 0]).tolist() == ds.material_ids_of([2, 0]).tolist() == ["mp-3", "mp-1"]
+    assert sq.having("n_atoms").tolist() == [0, 2]
+    X, y, ids, missing, y_missing = sq.to_arrays(["n_atoms"], target="band_gap")
+    expected = ds.to_arrays(["n_atoms"], target="band_gap")
+    np.testing.assert_array_equal(X, expected.X)
+    np.testing.assert_array_equal(y_missing, expected.y_missing)
+    sq.close()
+
+    reopened = SQLiteDataset(path)
+    assert snapshot(reopened) == snapshot(ds)
+    reopened.close()
+
+
+def test_failed_merge_is_rolled_back(tmp_path, snapshot):
+    sq = SQLiteDataset(str(tmp_path / "materials.db"))
+    sq.merge_new_data({"mp-1": {"a": 1}}, policy="upsert")
+    with pytest.raises(KeyError):
+        sq.merge_new_data({"mp-1": {"a": 2}, "mp-2": {"a": 3}}, policy="strict")
+    assert snapshot(sq) == {"mp-1": {"a": 1}}
+    sq.close()
+
+
+def test_listeners_and_threads(tmp_path):
+    sq = SQLiteDataset(str(tmp_path / "materials.db"))
+    notified = []
+    sq.add_merge_listener(lambda dataset, rows: notified.append(rows.tolist()))
+    sq.merge_stream(((f"mp-{i}", {"a": i}) for i in range(5)), chunk_size=2, policy="upsert")
+    assert notified == [[0, 1], [2, 3], [4]]
+    sq.dataset = {"mp-9": {"a": 9}}
+    assert notified[-1] == [0] and len(sq) == 1
+
+    counts = []
+    threads = [threading.Thread(target=lambda: counts.append(len(sq))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counts == [1] * 4
+    # the connections of the finished threads are closed when the next thread opens one
+    thread = threading.Thread(target=len, args=(sq,))
+    thread.start()
+    thread.join()
+    assert len(sq._connections) == 2
+    sq.close()
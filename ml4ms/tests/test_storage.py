@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from ml4ms.core import Dataset
+
+
+@pytest.fixture
+def dataset():
+    ds = Dataset()
+    ds.dataset = {
+        "mp-2": {"formula": "Cu", "band_gap": 0.0, "is_metal": True},
+        "mp-1": {"formula": "Si", "band_gap": 1.1, "is_metal": False, "nsites": 2},
+    }
+    return ds
+
+
+def test_save_open_round_trip(dataset, tmp_path):
+    dataset.save(str(tmp_path))
+    opened = Dataset.open(str(tmp_path))
+    assert opened.dataset == dataset.dataset
+    assert list(opened.dataset) == ["mp-2", "mp-1"]
+    values, present = opened._store.column("band_gap")
+    assert isinstance(values, np.memmap)
+    np.testing.assert_array_equal(opened._store.column("nsites")[1], [False, True])
+
+
+def test_open_is_lazy_and_read_only(dataset, tmp_path):
+    dataset.save(str(tmp_path))
+    opened = Dataset.open(str(tmp_path))
+    assert opened.dataset["mp-1"]["band_gap"] == 1.1
+    assert opened._store.ids._index is None
+    with pytest.raises(KeyError):
+        opened.dataset["mp-3"]
+    with pytest.raises(ValueError):
+        opened.merge_new_data({"mp-1": {"band_gap": 2.0}})
+
+
+def test_open_copy_on_write(dataset, tmp_path):
+    dataset.save(str(tmp_path))
+    opened = Dataset.open(str(tmp_path), mode="c")
+    opened.merge_new_data({"mp-1": {"band_gap": 2.0}, "mp-3": {"band_gap": 3.0}}, policy="upsert")
+    assert opened.dataset["mp-1"]["band_gap"] == 2.0
+    assert opened.dataset["mp-3"]["band_gap"] == 3.0
+    assert Dataset.open(str(tmp_path)).dataset["mp-1"]["band_gap"] == 1.1
+
+
+def test_save_into_the_directory_opened_from(tmp_path):
+    ds = Dataset()
+    ids = [f"mp-{i}" for i in range(1000)]
+    ds.merge_arrays(ids, {"band_gap": np.arange(1000.0), "formula": ["Si", "Cu"] * 500}, policy="upsert")
+    ds.save(str(tmp_path))
+    # the columns stay memory mapped from the files being replaced
+    opened = Dataset.open(str(tmp_path), mode="c")
+    opened.merge_new_data({"mp-1": {"band_gap": -1.0}})
+    opened.save(str(tmp_path))
+    reopened = Dataset.open(str(tmp_path), mode="c")
+    assert reopened.dataset["mp-1"]["band_gap"] == -1.0
+    assert reopened.dataset["mp-999"] == {"band_gap": 999.0, "formula": "Cu"}
+    reopened.merge_new_data({"mp-new": {"band_gap": 5.0}}, policy="upsert")
+    reopened.save(str(tmp_path))
+    assert len(Dataset.open(str(tmp_path))) == 1001
+
+
+def test_mixed_id_types_are_not_saved(tmp_path):
+    ds = Dataset()
+    ds.dataset = {"mp-1": {"a": 1}, 1: {"a": 2}}
+    with pytest.raises(TypeError):
+        ds.save(str(tmp_path))
+    ds = Dataset()
+    ds.dataset = {1: {"a": 1}, 2: {"a": 2}}
+    ds.save(str(tmp_path))
+    assert Dataset.open(str(tmp_path)).dataset[1]["a"] == 1
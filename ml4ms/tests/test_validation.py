@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from ml4ms.core import Dataset
+from ml4ms.splits import kfold
+from ml4ms.validation import cross_validate
+
+
+def ridge_score(alpha, X_train, y_train, X_test, y_test):
+    A = X_train.T @ X_train + alpha * np.eye(X_train.shape[1])
+    weights = np.linalg.solve(A, X_train.T @ y_train)
+    return -np.mean((X_test @ weights - y_test) ** 2)
+
+
+@pytest.fixture
+def dataset():
+    rng = np.random.default_rng(0)
+    ds = Dataset()
+    ds.dataset = {f"mp-{i}": {"a": rng.normal(), "b": rng.normal()} for i in range(120)}
+    for i in range(110):
+        row = ds.row(i)
+        row["e"] = 2 * row["a"] - row["b"] + 0.01 * rng.normal()
+    return ds
+
+
+def test_processes_match_serial(dataset):
+    serial = cross_validate(ridge_score, [0.0, 100.0], dataset, ["a", "b"], "e", folds=4, processes=0, seed=0)
+    parallel = cross_validate(ridge_score, [0.0, 100.0], dataset, ["a", "b"], "e", folds=4, processes=2, seed=0)
+    assert [result.configuration for result in parallel] == [0.0, 100.0]
+    for s, p in zip(serial, parallel):
+        np.testing.assert_array_equal(s.scores, p.scores)
+        assert len(p.scores) == 4
+    assert parallel[0].mean > parallel[1].mean > -10
+    assert parallel[0].mean > -1e-3
+
+
+def test_explicit_folds_leave_out_missing_targets(dataset):
+    calls = []
+
+    def fit_score(configuration, X_train, y_train, X_test, y_test):
+        calls.append(len(y_train) + len(y_test))
+        assert not np.isnan(y_train).any()
+        return configuration
+
+    folds = kfold(dataset, n_folds=3, seed=1)
+    results = cross_validate(fit_score, [1, 2], dataset, ["a"], "e", folds=folds, processes=0)
+    assert calls == [110] * 6
+    assert [result.mean for result in results] == [1.0, 2.0]
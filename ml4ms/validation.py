@@ -0,0 +1,99 @@
+import os
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ml4ms.splits import kfold
+
+CVResult = namedtuple("CVResult", ["configuration", "scores", "mean", "std"])
+CVResult.__doc__ = """
+the cross-validation scores of one configuration
+
+scores holds the score of every fold, in the order of the folds, and mean and std summarize them.
+"""
+
+# the memory mapped (X, y) of the cross validation a worker process is running
+_shared = None
+
+
+def _attach(path):
+    global _shared
+    _shared = (
+        np.load(os.path.join(path, "X.npy"), mmap_mode="r"),
+        np.load(os.path.join(path, "y.npy"), mmap_mode="r"),
+    )
+
+
+def _fit_score(fit_score, configuration, train, test, arrays=None):
+    X, y = _shared if arrays is None else arrays
+    return float(fit_score(configuration, X[train], y[train], X[test], y[test]))
+
+
+def cross_validate(
+    fit_score, configurations, dataset, features, target, folds=5, processes=None, dtype=None, seed=None
+):
+    """
+    the cross-validation scores of every one of a set of model configurations
+
+    every (configuration, fold) pair is fitted and scored in a pool of processes. the feature matrix
+    and target are written once to .npy files in a temporary directory and memory mapped by the
+    workers, so that only the row numbers of the folds are sent to them. the results are collected
+    in the order of configurations and folds, whichever order the workers finish in.
+
+    Parameters
+    ----------
+    fit_score: callable
+        fit_score(configuration, X_train, y_train, X_test, y_test) fits a model with configuration
+        and returns its score on the test rows as a float. it is sent to the workers, so it must be
+        picklable (e.g. a function defined at module level).
+    configurations: sequence
+        the configurations to evaluate, each passed to fit_score as it is
+    dataset: Dataset
+        the materials
+    features: sequence of str
+        the numeric attributes the models are fitted on, missing values being nan
+    target: str
+        the numeric attribute the models predict. materials without it are left out of every fold.
+    folds: int or iterable of Split
+        the folds, each a Split with "train" and "test" rows, or a number of random folds
+    processes: int or None
+        the number of worker processes, os.cpu_count() when None and 0 to fit every fold in this
+        process
+    dtype: numpy.dtype or None
+        the float dtype of the arrays, as for Dataset.to_arrays
+    seed: int or None
+        the seed of the random folds when folds is a number
+
+    Returns
+    -------
+        a list with the CVResult of every configuration, in order
+    """
+    configurations = list(configurations)
+    if isinstance(folds, int):
+        folds = kfold(dataset, n_folds=folds, seed=seed)
+    X, y, _, _, y_missing = dataset.to_arrays(features, target=target, dtype=dtype)
+    folds = [(fold["train"][~y_missing[fold["train"]]], fold["test"][~y_missing[fold["test"]]]) for fold in folds]
+    tasks = [(i, j) for i in range(len(configurations)) for j in range(len(folds))]
+    scores = np.zeros((len(configurations), len(folds)))
+    if processes == 0:
+        for i, j in tasks:
+            scores[i, j] = _fit_score(fit_score, configurations[i], *folds[j], arrays=(X, y))
+    else:
+        with tempfile.TemporaryDirectory(prefix="ml4ms-cv-") as path:
+            np.save(os.path.join(path, "X.npy"), X)
+            np.save(os.path.join(path, "y.npy"), y)
+            del X, y
+            with ProcessPoolExecutor(max_workers=processes, initializer=_attach, initargs=(path,)) as pool:
+                futures = {
+                    (i, j): pool.submit(_fit_score, fit_score, configurations[i], *folds[j]) for i, j in tasks
+                }
+                for (i, j), future in futures.items():
+                    scores[i, j] = future.result()
+    return [
+        CVResult(
+            configuration, row, float(row.mean()) if len(row) else np.nan, float(row.std()) if len(row) else np.nan
+        )
+        for configuration, row in zip(configurations, scores)
+    ]